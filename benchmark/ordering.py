@@ -18,6 +18,8 @@ def main():
     parser = argparse.ArgumentParser(description="Benchmark surya reading order model.")
     parser.add_argument("--results_dir", type=str, help="Path to JSON file with benchmark results.", default=os.path.join(settings.RESULT_DIR, "benchmark"))
     parser.add_argument("--max", type=int, help="Maximum number of images to run benchmark on.", default=None)
+    parser.add_argument("--engine", type=str, help="Ordering engine, autoregressive or multibox.", default=settings.ORDER_ENGINE)
+    parser.add_argument("--compare_engines", action="store_true", help="Also run the other ordering engine, and report its time and accuracy.", default=False)
     args = parser.parse_args()
 
     model = load_model()
@@ -34,9 +36,16 @@ def main():
     bboxes = list(dataset["bboxes"])
 
     start = time.time()
-    order_predictions = batch_ordering(images, bboxes, model, processor)
+    order_predictions = batch_ordering(images, bboxes, model, processor, engine=args.engine)
     surya_time = time.time() - start
 
+    compare_engine = None
+    if args.compare_engines:
+        compare_engine = "multibox" if args.engine == "autoregressive" else "autoregressive"
+        start = time.time()
+        compare_predictions = batch_ordering(images, bboxes, model, processor, engine=compare_engine)
+        compare_time = time.time() - start
+
     folder_name = os.path.basename(pathname).split(".")[0]
     result_path = os.path.join(args.results_dir, folder_name)
     os.makedirs(result_path, exist_ok=True)
@@ -59,16 +68,32 @@ def main():
     mean_accuracy /= len(order_predictions)
 
     out_data = {
+        "engine": args.engine,
         "time": surya_time,
         "mean_accuracy": mean_accuracy,
         "page_metrics": page_metrics
     }
 
+    if compare_engine is not None:
+        compare_accuracy = 0
+        for idx, order_pred in enumerate(compare_predictions):
+            pred_labels = [str(l.position) for l in order_pred.bboxes]
+            compare_accuracy += rank_accuracy(pred_labels, dataset[idx]["labels"])
+        compare_accuracy /= len(compare_predictions)
+
+        out_data["compare"] = {
+            "engine": compare_engine,
+            "time": compare_time,
+            "mean_accuracy": compare_accuracy
+        }
+
     with open(os.path.join(result_path, "results.json"), "w+") as f:
         json.dump(out_data, f, indent=4)
 
     print(f"Mean accuracy is {mean_accuracy:.2f}.")
     print(f"Took {surya_time / len(images):.2f} seconds per image, and {surya_time:.1f} seconds total.")
+    if compare_engine is not None:
+        print(f"The {compare_engine} engine had mean accuracy {compare_accuracy:.2f}, and took {compare_time / len(images):.2f} seconds per image.")
     print("Mean accuracy is the % of correct ranking pairs.")
     print(f"Wrote results to {result_path}")
 
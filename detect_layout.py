@@ -6,12 +6,14 @@ import copy
 import json
 from collections import defaultdict
 
-from surya.detection import batch_text_detection
 from surya.input.load import load_from_folder, load_from_file
-from surya.layout import batch_layout_detection
+from surya.input.processing import PageSubset
+from surya.layout import batch_text_and_layout_detection
 from surya.model.detection.model import load_model, load_processor
 from surya.postprocessing.heatmap import draw_polys_on_image
+from surya.schema import LayoutResult
 from surya.settings import settings
+from surya.util.cache import PageResultCache, get_page_cache_path, iter_cached_pages
 import os
 
 
@@ -22,6 +24,7 @@ def main():
     parser.add_argument("--max", type=int, help="Maximum number of pages to process.", default=None)
     parser.add_argument("--images", action="store_true", help="Save images of detected layout bboxes.", default=False)
     parser.add_argument("--debug", action="store_true", help="Run in debug mode.", default=False)
+    parser.add_argument("--cache", action="store_true", help=f"Cache the results for each page in {get_page_cache_path()}, so pages of unchanged files skip the models next time.  Not used with --debug.", default=False)
     args = parser.parse_args()
 
     model = load_model(checkpoint=settings.LAYOUT_MODEL_CHECKPOINT)
@@ -30,16 +33,31 @@ def main():
     det_processor = load_processor()
 
     if os.path.isdir(args.input_path):
-        images, names, _ = load_from_folder(args.input_path, args.max)
+        images, names, _, sources = load_from_folder(args.input_path, args.max, lazy=True, return_sources=True)
         folder_name = os.path.basename(args.input_path)
     else:
-        images, names, _ = load_from_file(args.input_path, args.max)
+        images, names, _, sources = load_from_file(args.input_path, args.max, lazy=True, return_sources=True)
         folder_name = os.path.basename(args.input_path).split(".")[0]
 
-    start = time.time()
-    line_predictions = batch_text_detection(images, det_model, det_processor)
+    # --debug saves the segmentation maps, which aren't stored
+    cache = None
+    layout_keys = [None] * len(images)
+    line_keys = None
+    if args.cache and not args.debug:
+        cache = PageResultCache(get_page_cache_path())
+        layout_keys = [cache.get_key(path, page_idx, "layout") for path, page_idx in sources]
+        line_keys = [cache.get_key(path, page_idx, "detection") for path, page_idx in sources]
+
+    def detect_layout(idxs):
+        # Text lines and layout come from one pass over the pages.  Text detection results are shared with detect_text.py.
+        line_predictions, layout_predictions = batch_text_and_layout_detection(PageSubset(images, idxs), det_model, det_processor, model, processor, include_maps=args.debug)
+        if cache is not None:
+            for idx, line_pred in zip(idxs, line_predictions):
+                cache.put(line_keys[idx], line_pred)
+        return layout_predictions
 
-    layout_predictions = batch_layout_detection(images, model, processor, line_predictions, include_maps=args.debug)
+    start = time.time()
+    layout_predictions = list(iter_cached_pages(cache, layout_keys, LayoutResult, detect_layout))
     result_path = os.path.join(args.results_dir, folder_name)
     os.makedirs(result_path, exist_ok=True)
     if args.debug:
@@ -57,7 +75,7 @@ def main():
                 heatmap.save(os.path.join(result_path, f"{name}_{idx}_segmentation.png"))
 
     predictions_by_page = defaultdict(list)
-    for idx, (pred, name, image) in enumerate(zip(layout_predictions, names, images)):
+    for pred, name in zip(layout_predictions, names):
         out_pred = pred.model_dump(exclude=["segmentation_map"])
         out_pred["page"] = len(predictions_by_page[name]) + 1
         predictions_by_page[name].append(out_pred)
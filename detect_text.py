@@ -5,11 +5,14 @@ import time
 from collections import defaultdict
 
 from surya.input.load import load_from_folder, load_from_file
+from surya.input.processing import PageSubset
 from surya.model.detection.model import load_model, load_processor
 from surya.detection import batch_text_detection
 from surya.postprocessing.affinity import draw_lines_on_image
 from surya.postprocessing.heatmap import draw_polys_on_image
+from surya.schema import TextDetectionResult
 from surya.settings import settings
+from surya.util.cache import PageResultCache, get_page_cache_path, iter_cached_pages
 import os
 from tqdm import tqdm
 
@@ -21,21 +24,33 @@ def main():
     parser.add_argument("--max", type=int, help="Maximum number of pages to process.", default=None)
     parser.add_argument("--images", action="store_true", help="Save images of detected bboxes.", default=False)
     parser.add_argument("--debug", action="store_true", help="Run in debug mode.", default=False)
+    parser.add_argument("--cache", action="store_true", help=f"Cache the results for each page in {get_page_cache_path()}, so pages of unchanged files skip the models next time.  Not used with --debug.", default=False)
     args = parser.parse_args()
 
     checkpoint = settings.DETECTOR_MODEL_CHECKPOINT
     model = load_model(checkpoint=checkpoint)
     processor = load_processor(checkpoint=checkpoint)
 
+    # Lazy, so pages served from the cache are only rendered for --images
     if os.path.isdir(args.input_path):
-        images, names, _ = load_from_folder(args.input_path, args.max)
+        images, names, _, sources = load_from_folder(args.input_path, args.max, lazy=True, return_sources=True)
         folder_name = os.path.basename(args.input_path)
     else:
-        images, names, _ = load_from_file(args.input_path, args.max)
+        images, names, _, sources = load_from_file(args.input_path, args.max, lazy=True, return_sources=True)
         folder_name = os.path.basename(args.input_path).split(".")[0]
 
+    # The heatmaps and affinity maps from --debug aren't stored, so debug runs always detect
+    cache = None
+    keys = [None] * len(images)
+    if args.cache and not args.debug:
+        cache = PageResultCache(get_page_cache_path())
+        keys = [cache.get_key(path, page_idx, "detection") for path, page_idx in sources]
+
     start = time.time()
-    predictions = batch_text_detection(images, model, processor, include_maps=args.debug)
+    predictions = list(iter_cached_pages(
+        cache, keys, TextDetectionResult,
+        lambda idxs: batch_text_detection(PageSubset(images, idxs), model, processor, include_maps=args.debug)
+    ))
     result_path = os.path.join(args.results_dir, folder_name)
     os.makedirs(result_path, exist_ok=True)
     end = time.time()
@@ -59,7 +74,7 @@ def main():
                 affinity_map.save(os.path.join(result_path, f"{name}_{idx}_affinity.png"))
 
     predictions_by_page = defaultdict(list)
-    for idx, (pred, name, image) in enumerate(zip(predictions, names, images)):
+    for pred, name in zip(predictions, names):
         out_pred = pred.model_dump(exclude=["heatmap", "affinity_map"])
         out_pred["page"] = len(predictions_by_page[name]) + 1
         predictions_by_page[name].append(out_pred)
@@ -7,7 +7,7 @@ from pypdfium2 import PdfiumError
 
 from surya.detection import batch_text_detection
 from surya.input.pdflines import get_page_text_lines, get_table_blocks
-from surya.layout import batch_layout_detection
+from surya.layout import batch_text_and_layout_detection
 from surya.model.detection.model import load_model, load_processor
 from surya.model.recognition.model import load_model as load_rec_model
 from surya.model.recognition.processor import load_processor as load_rec_processor
@@ -61,8 +61,8 @@ def text_detection(img) -> (Image.Image, TextDetectionResult):
 
 
 def layout_detection(img) -> (Image.Image, LayoutResult):
-    _, det_pred = text_detection(img)
-    pred = batch_layout_detection([img], layout_model, layout_processor, [det_pred])[0]
+    _, preds = batch_text_and_layout_detection([img], det_model, det_processor, layout_model, layout_processor)
+    pred = preds[0]
     polygons = [p.polygon for p in pred.bboxes]
     labels = [p.label for p in pred.bboxes]
     layout_img = draw_polys_on_image(polygons, img.copy(), labels=labels, label_font_size=18)
@@ -6,12 +6,15 @@ from collections import defaultdict
 
 from surya.input.langs import replace_lang_with_code
 from surya.input.load import load_from_folder, load_from_file, load_lang_file
+from surya.input.processing import PageSubset
 from surya.model.detection.model import load_model as load_detection_model, load_processor as load_detection_processor
 from surya.model.recognition.model import load_model as load_recognition_model
 from surya.model.recognition.processor import load_processor as load_recognition_processor
-from surya.ocr import run_ocr
+from surya.ocr import iter_ocr
 from surya.postprocessing.text import draw_text_on_image
+from surya.schema import OCRResult
 from surya.settings import settings
+from surya.util.cache import PageResultCache, get_page_cache_path, iter_cached_pages
 
 
 def main():
@@ -23,16 +26,22 @@ def main():
     parser.add_argument("--images", action="store_true", help="Save images of detected bboxes.", default=False)
     parser.add_argument("--langs", type=str, help="Optional language(s) to use for OCR. Comma separate for multiple. Can be a capitalized language name, or a 2-letter ISO 639 code.", default=None)
     parser.add_argument("--lang_file", type=str, help="Optional path to file with languages to use for OCR. Should be a JSON dict with file names as keys, and the value being a list of language codes/names.", default=None)
+    parser.add_argument("--pdf_text", action="store_true", help="Use the embedded PDF text as a draft to speed up recognition.  Doesn't change the results.", default=False)
+    parser.add_argument("--reuse_pdf_text", action="store_true", help="Use the embedded PDF text as is for lines where it can be trusted, and only OCR the rest.", default=False)
+    parser.add_argument("--cache", action="store_true", help=f"Cache the results for each page in {get_page_cache_path()}, so pages of unchanged files skip the models next time.", default=False)
     parser.add_argument("--debug", action="store_true", help="Enable debug logging.", default=False)
     args = parser.parse_args()
 
+    load_text_lines = args.pdf_text or args.reuse_pdf_text
+
+    # Pages are rendered lazily, so only a window of pages is in memory at once
     if os.path.isdir(args.input_path):
-        images, names, _ = load_from_folder(args.input_path, args.max, args.start_page)
-        highres_images, _, _ = load_from_folder(args.input_path, args.max, args.start_page, settings.IMAGE_DPI_HIGHRES)
+        images, names, text_lines, sources = load_from_folder(args.input_path, args.max, args.start_page, load_text_lines=load_text_lines, lazy=True, return_sources=True)
+        highres_images, _, _ = load_from_folder(args.input_path, args.max, args.start_page, settings.IMAGE_DPI_HIGHRES, lazy=True)
         folder_name = os.path.basename(args.input_path)
     else:
-        images, names, _ = load_from_file(args.input_path, args.max, args.start_page)
-        highres_images, _, _ = load_from_file(args.input_path, args.max, args.start_page, settings.IMAGE_DPI_HIGHRES)
+        images, names, text_lines, sources = load_from_file(args.input_path, args.max, args.start_page, load_text_lines=load_text_lines, lazy=True, return_sources=True)
+        highres_images, _, _ = load_from_file(args.input_path, args.max, args.start_page, settings.IMAGE_DPI_HIGHRES, lazy=True)
         folder_name = os.path.basename(args.input_path).split(".")[0]
 
     if args.lang_file:
@@ -59,25 +68,49 @@ def main():
     os.makedirs(result_path, exist_ok=True)
 
     start = time.time()
-    predictions_by_image = run_ocr(images, image_langs, det_model, det_processor, rec_model, rec_processor, highres_images=highres_images)
-    if args.debug:
-        print(f"OCR took {time.time() - start:.2f} seconds")
-        max_chars = max([len(l.text) for p in predictions_by_image for l in p.text_lines])
-        print(f"Max chars: {max_chars}")
-
-    if args.images:
-        for idx, (name, image, pred, langs) in enumerate(zip(names, images, predictions_by_image, image_langs)):
+    max_chars = 0
+    out_preds = defaultdict(list)
+    cache = None
+    keys = [None] * len(images)
+    if args.cache:
+        cache = PageResultCache(get_page_cache_path())
+        keys = [
+            cache.get_key(path, page_idx, "ocr", extra={"langs": langs, "reuse_pdf_text": args.reuse_pdf_text})
+            for (path, page_idx), langs in zip(sources, image_langs)
+        ]
+
+    def recognize_pages(idxs):
+        # Only pages that aren't cached are rendered and recognized
+        return iter_ocr(
+            PageSubset(images, idxs),
+            [image_langs[idx] for idx in idxs],
+            det_model,
+            det_processor,
+            rec_model,
+            rec_processor,
+            highres_images=PageSubset(highres_images, idxs),
+            text_lines=[text_lines[idx] for idx in idxs] if load_text_lines else None,
+            reuse_text_layer=args.reuse_pdf_text
+        )
+
+    predictions_by_image = iter_cached_pages(cache, keys, OCRResult, recognize_pages)
+    for idx, (name, pred, langs) in enumerate(zip(names, predictions_by_image, image_langs)):
+        if args.images:
             bboxes = [l.bbox for l in pred.text_lines]
             pred_text = [l.text for l in pred.text_lines]
-            page_image = draw_text_on_image(bboxes, pred_text, image.size, langs, has_math="_math" in langs if langs else False)
+            image_size = (int(pred.image_bbox[2]), int(pred.image_bbox[3]))
+            page_image = draw_text_on_image(bboxes, pred_text, image_size, langs, has_math="_math" in langs if langs else False)
             page_image.save(os.path.join(result_path, f"{name}_{idx}_text.png"))
 
-    out_preds = defaultdict(list)
-    for name, pred, image in zip(names, predictions_by_image, images):
+        max_chars = max([max_chars] + [len(l.text) for l in pred.text_lines])
         out_pred = pred.model_dump()
         out_pred["page"] = len(out_preds[name]) + 1
         out_preds[name].append(out_pred)
 
+    if args.debug:
+        print(f"OCR took {time.time() - start:.2f} seconds")
+        print(f"Max chars: {max_chars}")
+
     with open(os.path.join(result_path, "results.json"), "w+", encoding="utf-8") as f:
         json.dump(out_preds, f, ensure_ascii=False)
 
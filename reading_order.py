@@ -4,13 +4,12 @@ import copy
 import json
 from collections import defaultdict
 
-from surya.detection import batch_text_detection
 from surya.input.load import load_from_folder, load_from_file
-from surya.layout import batch_layout_detection
+from surya.layout import batch_text_and_layout_detection
 from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
 from surya.model.ordering.model import load_model
 from surya.model.ordering.processor import load_processor
-from surya.ordering import batch_ordering
+from surya.ordering import batch_ordering, tiered_ordering
 from surya.postprocessing.heatmap import draw_polys_on_image
 from surya.settings import settings
 
@@ -21,6 +20,7 @@ def main():
     parser.add_argument("--results_dir", type=str, help="Path to JSON file with layout results.", default=os.path.join(settings.RESULT_DIR, "surya"))
     parser.add_argument("--max", type=int, help="Maximum number of pages to process.", default=None)
     parser.add_argument("--images", action="store_true", help="Save images of detected layout bboxes.", default=False)
+    parser.add_argument("--tiered", action="store_true", help="Order simple pages geometrically, and only use the model for complex pages.", default=False)
     args = parser.parse_args()
 
     model = load_model()
@@ -39,14 +39,18 @@ def main():
         images, names, _ = load_from_file(args.input_path, args.max)
         folder_name = os.path.basename(args.input_path).split(".")[0]
 
-    line_predictions = batch_text_detection(images, det_model, det_processor)
-    layout_predictions = batch_layout_detection(images, layout_model, layout_processor, line_predictions)
+    line_predictions, layout_predictions = batch_text_and_layout_detection(images, det_model, det_processor, layout_model, layout_processor)
     bboxes = []
     for layout_pred in layout_predictions:
         bbox = [l.bbox for l in layout_pred.bboxes]
         bboxes.append(bbox)
 
-    order_predictions = batch_ordering(images, bboxes, model, processor)
+    if args.tiered:
+        vertical_lines = [line_pred.vertical_lines for line_pred in line_predictions]
+        order_predictions, order_stats = tiered_ordering(images, bboxes, model, processor, vertical_lines=vertical_lines)
+        print(f"Ordered {order_stats['heuristic']} pages geometrically, and {order_stats['model']} pages with the model.")
+    else:
+        order_predictions = batch_ordering(images, bboxes, model, processor)
     result_path = os.path.join(args.results_dir, folder_name)
     os.makedirs(result_path, exist_ok=True)
 
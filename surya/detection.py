@@ -1,4 +1,5 @@
 import contextlib
+from dataclasses import dataclass
 
 import torch
 from typing import List, Tuple, Generator
@@ -7,9 +8,10 @@ import numpy as np
 from PIL import Image
 
 from surya.model.detection.model import EfficientViTForSemanticSegmentation
-from surya.postprocessing.heatmap import get_and_clean_boxes
-from surya.postprocessing.affinity import get_vertical_lines
-from surya.input.processing import prepare_image_detection, split_image, get_total_splits
+from surya.postprocessing.boxes import BoxArray
+from surya.postprocessing.heatmap import get_and_clean_boxes, clean_detected_box_array, detect_boxes_from_seeds, scale_dynamic_thresholds
+from surya.postprocessing.affinity import get_vertical_lines, get_vertical_lines_from_sobel
+from surya.input.processing import prepare_image_detection, split_image, get_total_splits, get_image_sizes
 from surya.schema import TextDetectionResult
 from surya.settings import settings
 from tqdm import tqdm
@@ -30,18 +32,10 @@ def get_batch_size():
     return batch_size
 
 
-def batch_detection(
-    images: List,
-    model: EfficientViTForSemanticSegmentation,
-    processor,
-    batch_size=None
-) -> Generator[Tuple[List[List[np.ndarray]], List[Tuple[int, int]]], None, None]:
-    assert all([isinstance(image, Image.Image) for image in images])
-    if batch_size is None:
-        batch_size = get_batch_size()
-    heatmap_count = model.config.num_labels
-
-    orig_sizes = [image.size for image in images]
+def get_detection_batches(images: List, processor, batch_size: int) -> List[List[int]]:
+    # Groups image indices into batches of at most batch_size splits
+    # Images can be a lazy page source, so avoid touching them until their batch comes up
+    orig_sizes = get_image_sizes(images)
     splits_per_image = [get_total_splits(size, processor) for size in orig_sizes]
 
     batches = []
@@ -58,26 +52,88 @@ def batch_detection(
 
     if len(current_batch) > 0:
         batches.append(current_batch)
+    return batches
+
+
+def prepare_detection_batch(batch_images: List[Image.Image], processor) -> Tuple[torch.Tensor, List[int], List[int]]:
+    # Splits tall images and preprocesses the splits into one (splits, C, H, W) batch on the cpu
+    split_index = []
+    split_heights = []
+    image_splits = []
+    for image_idx, image in enumerate(batch_images):
+        image_parts, split_height = split_image(image, processor)
+        image_splits.extend(image_parts)
+        split_index.extend([image_idx] * len(image_parts))
+        split_heights.extend(split_height)
+
+    image_splits = [prepare_image_detection(image, processor) for image in image_splits]
+    # Batch images in dim 0
+    return torch.stack(image_splits, dim=0), split_index, split_heights
+
+
+def same_detection_preprocessing(processor, other_processor) -> bool:
+    # Whether two detection processors turn an image into the same pixel values, so one preprocessed batch can feed both models
+    fields = ["size", "do_resize", "resample", "do_rescale", "rescale_factor", "do_normalize", "image_mean", "image_std"]
+    return all([getattr(processor, field, None) == getattr(other_processor, field, None) for field in fields])
+
+
+@dataclass
+class DetectionMaps:
+    # Text detection maps thresholded on the model device, so only these are copied to the cpu instead of the float heatmaps
+    text_mask: np.ndarray # uint8, heatmap pixels above the (dynamic) blank threshold
+    seed_coords: np.ndarray # (y, x) of the heatmap pixels at or above the (dynamic) text threshold
+    seed_values: np.ndarray # float32 heatmap values at the seeds
+    text_threshold: float
+    affinity_sobel: np.ndarray # uint8, scaled horizontal sobel of the affinity map, for the column lines
+
+
+def get_split_parts(split_index: List[int], split_heights: List[int], processor_height: int) -> List[List[Tuple[int, int | None]]]:
+    # For each image, the (split, height) parts to stack back together.  Splits after the first are cut to their height,
+    # to drop the padding.  Height is None if the whole split is used.
+    parts = []
+    for i, (idx, height) in enumerate(zip(split_index, split_heights)):
+        if len(parts) <= idx:
+            parts.append([(i, None)])
+        else:
+            parts[idx].append((i, height if height < processor_height else None))
+    return parts
+
+
+def get_device_detection_maps(heatmap: torch.Tensor, affinity_map: torch.Tensor) -> DetectionMaps:
+    # Dynamic thresholds, from the average of the top 10% of the heatmap, like get_dynamic_thresholds
+    flat_map = heatmap.flatten()
+    top_count = flat_map.numel() - int(flat_map.numel() * 0.9)
+    avg_intensity = torch.topk(flat_map, top_count, sorted=False).values.double().mean()
+    text_threshold, low_text = scale_dynamic_thresholds(np.float32(avg_intensity.item()), settings.DETECTOR_TEXT_THRESHOLD, settings.DETECTOR_BLANK_THRESHOLD)
+
+    text_mask = (heatmap > float(low_text)).to(torch.uint8)
+    seed_coords = torch.nonzero(heatmap >= float(text_threshold))
+    seed_values = heatmap[seed_coords[:, 0], seed_coords[:, 1]]
+
+    # Horizontal sobel with reflected borders, in the same order of operations as cv2.Sobel(dx=1, ksize=3)
+    image = F.pad((affinity_map * 255)[None, None], (1, 1, 1, 1), mode="reflect")[0, 0]
+    rows = image[:, 2:] - image[:, :-2]
+    sobel = torch.abs(2 * rows[1:-1] + (rows[:-2] + rows[2:]))
+    sobel_max = torch.max(sobel)
+    scaled_sobel = torch.where(sobel_max > 0, 255 * sobel / sobel_max, torch.zeros_like(sobel)).to(torch.uint8)
+
+    return DetectionMaps(
+        text_mask=text_mask.cpu().numpy(),
+        seed_coords=seed_coords.cpu().numpy(),
+        seed_values=seed_values.cpu().numpy(),
+        text_threshold=text_threshold,
+        affinity_sobel=scaled_sobel.cpu().numpy()
+    )
 
-    for batch_idx in tqdm(range(len(batches)), desc="Detecting bboxes"):
-        batch_image_idxs = batches[batch_idx]
-        batch_images = [images[j].convert("RGB") for j in batch_image_idxs]
-
-        split_index = []
-        split_heights = []
-        image_splits = []
-        for image_idx, image in enumerate(batch_images):
-            image_parts, split_height = split_image(image, processor)
-            image_splits.extend(image_parts)
-            split_index.extend([image_idx] * len(image_parts))
-            split_heights.extend(split_height)
 
-        image_splits = [prepare_image_detection(image, processor) for image in image_splits]
-        # Batch images in dim 0
-        batch = torch.stack(image_splits, dim=0).to(model.dtype).to(model.device)
+def run_detection_model(model: EfficientViTForSemanticSegmentation, processor, batch: torch.Tensor, split_index: List[int], split_heights: List[int], device_postprocessing: bool = False) -> List[List[np.ndarray] | DetectionMaps]:
+    # Heatmaps for each image, with the splits stacked back together
+    # With device_postprocessing, text detection maps are thresholded on the model device instead (see DetectionMaps)
+    heatmap_count = model.config.num_labels
+    batch = batch.to(model.dtype).to(model.device)
 
-        with torch.inference_mode():
-            pred = model(pixel_values=batch)
+    with torch.inference_mode():
+        pred = model(pixel_values=batch)
 
         logits = pred.logits
         correct_shape = [processor.size["height"], processor.size["width"]]
@@ -85,29 +141,71 @@ def batch_detection(
         if current_shape != correct_shape:
             logits = F.interpolate(logits, size=correct_shape, mode='bilinear', align_corners=False)
 
-        logits = logits.cpu().detach().numpy().astype(np.float32)
-        preds = []
-        for i, (idx, height) in enumerate(zip(split_index, split_heights)):
-            # If our current prediction length is below the image idx, that means we have a new image
-            # Otherwise, we need to add to the current image
-            if len(preds) <= idx:
-                preds.append([logits[i][k] for k in range(heatmap_count)])
-            else:
-                heatmaps = preds[idx]
-                pred_heatmaps = [logits[i][k] for k in range(heatmap_count)]
+        split_parts = get_split_parts(split_index, split_heights, processor.size["height"])
+        if device_postprocessing:
+            assert heatmap_count == 2, "Device postprocessing is only for text detection"
+            logits = logits.float()
+            preds = []
+            for parts in split_parts:
+                image_logits = torch.cat([logits[i, :, :height] for i, height in parts], dim=1)
+                preds.append(get_device_detection_maps(image_logits[0], image_logits[1]))
+            return preds
+
+    logits = logits.cpu().detach().numpy().astype(np.float32)
+    preds = []
+    for parts in split_parts:
+        if len(parts) == 1:
+            preds.append([logits[parts[0][0]][k] for k in range(heatmap_count)])
+            continue
+
+        image_logits = np.concatenate([logits[i][:, :height] for i, height in parts], axis=1)
+        preds.append([image_logits[k] for k in range(heatmap_count)])
+    return preds
+
+
+def load_detection_batch(images: List, batch_image_idxs: List[int]) -> Tuple[List[Image.Image], List[Tuple[int, int]]]:
+    batch_images = [images[j] for j in batch_image_idxs]
+    assert all([isinstance(image, Image.Image) for image in batch_images])
+    batch_images = [image.convert("RGB") for image in batch_images]
+    batch_orig_sizes = [image.size for image in batch_images]
+    return batch_images, batch_orig_sizes
+
 
-                if height < processor.size["height"]:
-                    # Cut off padding to get original height
-                    pred_heatmaps = [pred_heatmap[:height, :] for pred_heatmap in pred_heatmaps]
+def batch_detection(
+    images: List,
+    model: EfficientViTForSemanticSegmentation,
+    processor,
+    batch_size=None,
+    device_postprocessing: bool = False
+) -> Generator[Tuple[List[List[np.ndarray] | DetectionMaps], List[Tuple[int, int]]], None, None]:
+    if batch_size is None:
+        batch_size = get_batch_size()
+
+    batches = get_detection_batches(images, processor, batch_size)
+    for batch_idx in tqdm(range(len(batches)), desc="Detecting bboxes"):
+        batch_images, batch_orig_sizes = load_detection_batch(images, batches[batch_idx])
+        batch, split_index, split_heights = prepare_detection_batch(batch_images, processor)
+        preds = run_detection_model(model, processor, batch, split_index, split_heights, device_postprocessing=device_postprocessing)
+        yield preds, batch_orig_sizes
 
-                for k in range(heatmap_count):
-                    heatmaps[k] = np.vstack([heatmaps[k], pred_heatmaps[k]])
-                preds[idx] = heatmaps
 
-        yield preds, [orig_sizes[j] for j in batch_image_idxs]
+def use_device_postprocessing(include_maps: bool) -> bool:
+    # The maps need the full heatmaps
+    return settings.DETECTOR_DEVICE_POSTPROCESSING and not include_maps
 
 
 def parallel_get_lines(preds, orig_sizes, include_maps=False):
+    if isinstance(preds, DetectionMaps):
+        map_size = list(reversed(preds.text_mask.shape))
+        boxes = BoxArray(*detect_boxes_from_seeds(preds.text_mask, preds.seed_coords, preds.seed_values, preds.text_threshold))
+        return TextDetectionResult(
+            bboxes=clean_detected_box_array(boxes, map_size, orig_sizes).to_boxes(),
+            vertical_lines=get_vertical_lines_from_sobel(preds.affinity_sobel, map_size, orig_sizes),
+            heatmap=None,
+            affinity_map=None,
+            image_bbox=[0, 0, orig_sizes[0], orig_sizes[1]]
+        )
+
     heatmap, affinity_map = preds
     heat_img, aff_img = None, None
     if include_maps:
@@ -128,8 +226,22 @@ def parallel_get_lines(preds, orig_sizes, include_maps=False):
     return result
 
 
+def iter_text_detection(images: List, model, processor, batch_size=None, include_maps=False) -> Generator[TextDetectionResult, None, None]:
+    # Yields results in page order as each detection batch finishes, instead of waiting for every page
+    detection_generator = batch_detection(images, model, processor, batch_size=batch_size, device_postprocessing=use_device_postprocessing(include_maps))
+
+    max_workers = min(settings.DETECTOR_POSTPROCESSING_CPU_WORKERS, len(images))
+    parallelize = not settings.IN_STREAMLIT and len(images) >= settings.DETECTOR_MIN_PARALLEL_THRESH
+    executor = ThreadPoolExecutor if parallelize else FakeExecutor
+    with executor(max_workers=max_workers) as e:
+        for preds, orig_sizes in detection_generator:
+            postprocessing_futures = [e.submit(parallel_get_lines, pred, orig_size, include_maps) for pred, orig_size in zip(preds, orig_sizes)]
+            for future in postprocessing_futures:
+                yield future.result()
+
+
 def batch_text_detection(images: List, model, processor, batch_size=None, include_maps=False) -> List[TextDetectionResult]:
-    detection_generator = batch_detection(images, model, processor, batch_size=batch_size)
+    detection_generator = batch_detection(images, model, processor, batch_size=batch_size, device_postprocessing=use_device_postprocessing(include_maps))
 
     postprocessing_futures = []
     max_workers = min(settings.DETECTOR_POSTPROCESSING_CPU_WORKERS, len(images))
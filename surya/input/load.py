@@ -1,6 +1,6 @@
 import PIL
 
-from surya.input.processing import open_pdf, get_page_images
+from surya.input.processing import open_pdf, get_pdf_page_images, LazyPdfPages, ChainedPages
 from surya.settings import settings
 import os
 import filetype
@@ -13,10 +13,8 @@ def get_name_from_path(path):
     return os.path.basename(path).split(".")[0]
 
 
-def load_pdf(pdf_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF):
-    doc = open_pdf(pdf_path)
-    last_page = len(doc)
-
+def get_page_indices(page_count, max_pages=None, start_page=None):
+    last_page = page_count
     if start_page:
         assert start_page < last_page and start_page >= 0, f"Start page must be between 0 and {last_page}"
     else:
@@ -26,59 +24,87 @@ def load_pdf(pdf_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI,
         assert max_pages >= 0, f"Max pages must be greater than 0"
         last_page = min(start_page + max_pages, last_page)
 
-    page_indices = list(range(start_page, last_page))
-    images = get_page_images(doc, page_indices, dpi=dpi)
+    return list(range(start_page, last_page))
+
+
+def load_pdf(pdf_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF, lazy=False, return_sources=False):
+    # With lazy=True, pages are rendered on demand by a LazyPdfPages source instead of all at once
+    # With return_sources=True, the (file path, page index) of every page is returned too
+    doc = open_pdf(pdf_path)
+    page_indices = get_page_indices(len(doc), max_pages, start_page)
+    if lazy:
+        doc.close()
+        images = LazyPdfPages(pdf_path, page_indices, dpi=dpi)
+        image_sizes = images.sizes
+    else:
+        images = get_pdf_page_images(pdf_path, page_indices, dpi=dpi, doc=doc)
+        image_sizes = [i.size for i in images]
+        doc.close()
+
     text_lines = [None] * len(page_indices)
     if load_text_lines:
         from surya.input.pdflines import get_page_text_lines # Putting import here because pypdfium2 causes warnings if its not the top import
         text_lines = get_page_text_lines(
             pdf_path,
             page_indices,
-            [i.size for i in images],
+            image_sizes,
             flatten_pdf=flatten_pdf
         )
-    doc.close()
     names = [get_name_from_path(pdf_path) for _ in page_indices]
+    if return_sources:
+        return images, names, text_lines, [(pdf_path, page_idx) for page_idx in page_indices]
     return images, names, text_lines
 
 
-def load_image(image_path):
+def load_image(image_path, return_sources=False):
     image = Image.open(image_path).convert("RGB")
     name = get_name_from_path(image_path)
+    if return_sources:
+        return [image], [name], [None], [(image_path, 0)]
     return [image], [name], [None]
 
 
-def load_from_file(input_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF):
+def load_from_file(input_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF, lazy=False, return_sources=False):
     input_type = filetype.guess(input_path)
     if input_type.extension == "pdf":
-        return load_pdf(input_path, max_pages, start_page, dpi=dpi, load_text_lines=load_text_lines, flatten_pdf=flatten_pdf)
+        return load_pdf(input_path, max_pages, start_page, dpi=dpi, load_text_lines=load_text_lines, flatten_pdf=flatten_pdf, lazy=lazy, return_sources=return_sources)
     else:
-        return load_image(input_path)
+        return load_image(input_path, return_sources=return_sources)
 
 
-def load_from_folder(folder_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF):
+def load_from_folder(folder_path, max_pages=None, start_page=None, dpi=settings.IMAGE_DPI, load_text_lines=False, flatten_pdf=settings.FLATTEN_PDF, lazy=False, return_sources=False):
     image_paths = [os.path.join(folder_path, image_name) for image_name in os.listdir(folder_path) if not image_name.startswith(".")]
     image_paths = [ip for ip in image_paths if not os.path.isdir(ip)]
 
-    images = []
+    image_sources = []
     names = []
     text_lines = []
+    sources = []
     for path in image_paths:
         extension = filetype.guess(path)
         if extension and extension.extension == "pdf":
-            image, name, text_line = load_pdf(path, max_pages, start_page, dpi=dpi, load_text_lines=load_text_lines, flatten_pdf=flatten_pdf)
-            images.extend(image)
+            image, name, text_line, source = load_pdf(path, max_pages, start_page, dpi=dpi, load_text_lines=load_text_lines, flatten_pdf=flatten_pdf, lazy=lazy, return_sources=True)
+            image_sources.append(image)
             names.extend(name)
             text_lines.extend(text_line)
+            sources.extend(source)
         else:
             try:
-                image, name, text_line = load_image(path)
-                images.extend(image)
+                image, name, text_line, source = load_image(path, return_sources=True)
+                image_sources.append(image)
                 names.extend(name)
                 text_lines.extend(text_line)
+                sources.extend(source)
             except PIL.UnidentifiedImageError:
                 print(f"Could not load image {path}")
                 continue
+
+    if lazy:
+        images = ChainedPages(image_sources)
+    else:
+        images = [image for source in image_sources for image in source]
+    if return_sources:
+        return images, names, text_lines, sources
     return images, names, text_lines
 
 
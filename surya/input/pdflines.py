@@ -26,6 +26,114 @@ def get_page_text_lines(filepath: str, page_idxs: list, out_sizes: list, flatten
     return pages_text
 
 
+def get_line_chars(full_text: dict | None, polygons: list, margin: float = .1) -> list:
+    # Assigns each char of the PDF text layer to the detected line that contains its center, in PDF order.
+    # Text layer and polygons need to be in the same coordinates (see get_page_text_lines).
+    line_chars = [[] for _ in polygons]
+    if full_text is None or len(polygons) == 0:
+        return line_chars
+
+    chars = [char for block in full_text["blocks"] for line in block["lines"] for span in line["spans"] for char in span["chars"]]
+    if len(chars) == 0:
+        return line_chars
+
+    char_bboxes = np.array([char["bbox"] for char in chars], dtype=np.float32)
+    char_centers = np.stack([(char_bboxes[:, 0] + char_bboxes[:, 2]) / 2, (char_bboxes[:, 1] + char_bboxes[:, 3]) / 2], axis=1)
+
+    line_bboxes = get_line_bboxes(polygons)
+    # Pad the lines a little vertically, since detected lines can be tighter than the glyph boxes
+    pad = (line_bboxes[:, 3] - line_bboxes[:, 1]) * margin
+    line_bboxes[:, 1] -= pad
+    line_bboxes[:, 3] += pad
+
+    # chars x lines containment, each char goes to the first line that contains it
+    contained = (
+        (char_centers[:, None, 0] >= line_bboxes[None, :, 0]) & (char_centers[:, None, 0] <= line_bboxes[None, :, 2]) &
+        (char_centers[:, None, 1] >= line_bboxes[None, :, 1]) & (char_centers[:, None, 1] <= line_bboxes[None, :, 3])
+    )
+    has_line = contained.any(axis=1)
+    char_lines = contained.argmax(axis=1)
+
+    for char, has, line_idx in zip(chars, has_line, char_lines):
+        if has:
+            line_chars[line_idx].append(char)
+    return line_chars
+
+
+def get_line_bboxes(polygons: list) -> np.ndarray:
+    line_polys = np.array(polygons, dtype=np.float32)
+    return np.concatenate([line_polys.min(axis=1), line_polys.max(axis=1)], axis=1)
+
+
+def get_line_text_drafts(full_text: dict | None, polygons: list, margin: float = .1) -> list:
+    # Text layer for each detected line, to use as a recognition draft.  Lines with no chars get None.
+    drafts = []
+    for chars in get_line_chars(full_text, polygons, margin=margin):
+        text = "".join([char["char"] for char in chars]).strip()
+        drafts.append(text if text else None)
+    return drafts
+
+
+def is_valid_glyph(char: str) -> bool:
+    # Empty, replacement, private use, and control chars mean the font has no usable unicode mapping
+    if len(char) == 0 or char in ("\ufffd", "\x00"):
+        return False
+    code = ord(char[0])
+    if 0xE000 <= code <= 0xF8FF:
+        return False
+    return char.isprintable() or char.isspace()
+
+
+def score_text_layer_line(chars: list, polygon: list) -> dict:
+    # How far the text layer for a line can be trusted:
+    # - coverage: share of the line width covered by glyph boxes, low when part of the line is an image or vector text
+    # - valid: share of glyphs with a real unicode mapping
+    # - iou: overlap of the glyph boxes with the detected line, low when the text layer is offset or has bad font metrics
+    text = "".join([char["char"] for char in chars])
+    if len(text.strip()) == 0:
+        return {"coverage": 0., "valid": 0., "iou": 0.}
+
+    line_bbox = get_line_bboxes([polygon])[0]
+    char_bboxes = np.array([char["bbox"] for char in chars], dtype=np.float32)
+
+    # Union of the glyph x extents, clipped to the line
+    starts = np.clip(char_bboxes[:, 0], line_bbox[0], line_bbox[2])
+    ends = np.clip(char_bboxes[:, 2], line_bbox[0], line_bbox[2])
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    covered_until = np.maximum.accumulate(ends)
+    prev_until = np.concatenate([[line_bbox[0]], covered_until[:-1]])
+    covered = np.clip(ends - np.maximum(starts, prev_until), 0, None).sum()
+    coverage = covered / max(line_bbox[2] - line_bbox[0], 1)
+
+    valid = sum([is_valid_glyph(char["char"]) for char in chars]) / len(chars)
+
+    glyph_bbox = np.concatenate([char_bboxes[:, :2].min(axis=0), char_bboxes[:, 2:].max(axis=0)])
+    inter_w = max(min(glyph_bbox[2], line_bbox[2]) - max(glyph_bbox[0], line_bbox[0]), 0)
+    inter_h = max(min(glyph_bbox[3], line_bbox[3]) - max(glyph_bbox[1], line_bbox[1]), 0)
+    intersection = inter_w * inter_h
+    union = (glyph_bbox[2] - glyph_bbox[0]) * (glyph_bbox[3] - glyph_bbox[1]) + (line_bbox[2] - line_bbox[0]) * (line_bbox[3] - line_bbox[1]) - intersection
+    iou = intersection / union if union > 0 else 0.
+
+    return {"coverage": float(coverage), "valid": float(valid), "iou": float(iou)}
+
+
+def get_trusted_line_text(full_text: dict | None, polygons: list) -> list:
+    # (text, score) for each detected line whose text layer passes the trust thresholds, None for lines that need OCR.
+    # The score is the lowest of the trust measures.
+    line_text = []
+    for chars, polygon in zip(get_line_chars(full_text, polygons), polygons):
+        score = score_text_layer_line(chars, polygon)
+        trusted = (
+            score["coverage"] >= settings.RECOGNITION_TEXT_LAYER_MIN_COVERAGE and
+            score["valid"] >= settings.RECOGNITION_TEXT_LAYER_MIN_VALID and
+            score["iou"] >= settings.RECOGNITION_TEXT_LAYER_MIN_IOU
+        )
+        text = "".join([char["char"] for char in chars]).strip()
+        line_text.append((text, min(score["coverage"], score["valid"], score["iou"])) if trusted else None)
+    return line_text
+
+
 def get_dynamic_gap_thresh(full_text: dict, img_size: list, default_thresh=.01, min_chars=100):
     space_dists = []
     for block in full_text["blocks"]:
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+import os
 from typing import List
 
 import cv2
@@ -80,6 +83,155 @@ def get_page_images(doc, indices: List, dpi=settings.IMAGE_DPI):
     return images
 
 
+def get_pdf_page_images(pdf_path, indices: List, dpi=settings.IMAGE_DPI, doc=None):
+    # Renders in a process pool when PDF_RENDER_WORKERS > 1 and there is more than one chunk of pages
+    workers = settings.PDF_RENDER_WORKERS
+    if workers > 1 and len(indices) > settings.PDF_RENDER_CHUNK_SIZE and isinstance(pdf_path, (str, os.PathLike)):
+        from surya.input.rasterize import render_pdf_pages_parallel
+        return render_pdf_pages_parallel(pdf_path, list(indices), dpi, workers, settings.PDF_RENDER_CHUNK_SIZE)
+
+    close_doc = doc is None
+    if doc is None:
+        doc = open_pdf(pdf_path)
+    images = get_page_images(doc, indices, dpi=dpi)
+    if close_doc:
+        doc.close()
+    return images
+
+
+def get_page_size(page, dpi=settings.IMAGE_DPI):
+    # Matches the bitmap size pypdfium2 renders at this scale, without rendering
+    scale = dpi / 72
+    width, height = page.get_size()
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def get_image_sizes(images) -> List[tuple]:
+    # Lazy page sources know their sizes without rendering
+    if hasattr(images, "sizes"):
+        return list(images.sizes)
+    return [image.size for image in images]
+
+
+class LazyPdfPages(Sequence):
+    """
+    Renders pages of a PDF on demand, instead of up front.
+
+    At most window_size rendered pages are kept in memory.  On a miss, the next window_size // 2 pages
+    are rendered together, since pages are usually accessed in order.
+    """
+    def __init__(self, pdf_path, page_indices: List[int], dpi=settings.IMAGE_DPI, window_size=None):
+        self.pdf_path = pdf_path
+        self.page_indices = list(page_indices)
+        self.dpi = dpi
+        self.window_size = max(1, window_size or settings.PDF_RENDER_WINDOW_SIZE)
+        self._doc = None
+        self._cache = OrderedDict()
+
+        # The document is reopened on the first render, so unused sources don't hold file handles
+        doc = open_pdf(pdf_path)
+        self.sizes = [get_page_size(doc[page_idx], dpi) for page_idx in self.page_indices]
+        doc.close()
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = open_pdf(self.pdf_path)
+        return self._doc
+
+    def __len__(self):
+        return len(self.page_indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"Page {idx} out of range for {len(self)} pages")
+
+        if idx not in self._cache:
+            prefetch_end = min(len(self), idx + max(1, self.window_size // 2))
+            to_render = [i for i in range(idx, prefetch_end) if i not in self._cache]
+            rendered = get_pdf_page_images(self.pdf_path, [self.page_indices[i] for i in to_render], dpi=self.dpi, doc=self.doc)
+            for i, image in zip(to_render, rendered):
+                self._cache[i] = image
+
+        self._cache.move_to_end(idx)
+        image = self._cache[idx]
+        while len(self._cache) > self.window_size:
+            self._cache.popitem(last=False)
+        return image
+
+    def close(self):
+        self._cache.clear()
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+
+class ChainedPages(Sequence):
+    """Concatenates several page sources (lists of images or LazyPdfPages) without materializing them."""
+    def __init__(self, sources: List[Sequence]):
+        self.sources = [source for source in sources if len(source) > 0]
+        self.offsets = np.cumsum([0] + [len(source) for source in self.sources]).tolist()
+        self._last_source_idx = None
+
+    @property
+    def sizes(self):
+        return [size for source in self.sources for size in get_image_sizes(source)]
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"Page {idx} out of range for {len(self)} pages")
+
+        source_idx = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+
+        # Pages are mostly read in order, so free the rendered pages of a PDF once we move past it
+        last_source = self.sources[self._last_source_idx] if self._last_source_idx is not None else None
+        if source_idx != self._last_source_idx and hasattr(last_source, "close"):
+            last_source.close()
+        self._last_source_idx = source_idx
+
+        return self.sources[source_idx][idx - self.offsets[source_idx]]
+
+    def close(self):
+        for source in self.sources:
+            if hasattr(source, "close"):
+                source.close()
+
+
+class PageSubset(Sequence):
+    """Some of the pages of a page source, in the given order.  Lazy sources only render the pages that are read."""
+    def __init__(self, source: Sequence, idxs: List[int]):
+        self.source = source
+        self.idxs = list(idxs)
+
+    @property
+    def sizes(self):
+        if hasattr(self.source, "sizes"):
+            sizes = self.source.sizes
+            return [sizes[idx] for idx in self.idxs]
+        return [self.source[idx].size for idx in self.idxs]
+
+    def __len__(self):
+        return len(self.idxs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.source[self.idxs[idx]]
+
+
 def slice_bboxes_from_image(image: Image.Image, bboxes):
     lines = []
     for bbox in bboxes:
@@ -91,10 +243,38 @@ def slice_bboxes_from_image(image: Image.Image, bboxes):
 
 
 def slice_polys_from_image(image: Image.Image, polys):
-    image_array = np.array(image, dtype=np.uint8)
+    image_array = np.asarray(image, dtype=np.uint8)
+    return [Image.fromarray(line) for line in slice_polys_from_array(image_array, polys)]
+
+
+def slice_polys_from_array(image_array: np.ndarray, polys) -> List[np.ndarray]:
+    # Returns the padded line crops as RGB arrays, which batch_recognition takes directly
+    if len(polys) == 0:
+        return []
+
+    polys = np.asarray(polys, dtype=np.int32).reshape(-1, 4, 2)
+    mins = polys.min(axis=1)
+    maxes = polys.max(axis=1)
+
+    # Axis-aligned rectangles cover their whole bbox, so they don't need a mask
+    # That is the case if every corner is a distinct bbox corner, and every edge is horizontal or vertical
+    corner_codes = (polys[:, :, 0] == maxes[:, None, 0]) * 2 + (polys[:, :, 1] == maxes[:, None, 1])
+    on_corners = (polys[:, :, 0] == mins[:, None, 0]) | (polys[:, :, 0] == maxes[:, None, 0])
+    on_corners &= (polys[:, :, 1] == mins[:, None, 1]) | (polys[:, :, 1] == maxes[:, None, 1])
+    distinct_corners = (np.sort(corner_codes, axis=1) == np.arange(4)).all(axis=1)
+    next_corners = np.roll(polys, -1, axis=1)
+    straight_edges = ((polys[:, :, 0] == next_corners[:, :, 0]) | (polys[:, :, 1] == next_corners[:, :, 1])).all(axis=1)
+    is_rectangle = on_corners.all(axis=1) & distinct_corners & straight_edges
+
     lines = []
-    for idx, poly in enumerate(polys):
-        lines.append(slice_and_pad_poly(image_array, poly))
+    for (x1, y1), (x2, y2), poly, rectangle in zip(mins.tolist(), maxes.tolist(), polys, is_rectangle.tolist()):
+        cropped_polygon = image_array[y1:y2, x1:x2].copy()
+        if not rectangle:
+            # Pad the area outside the polygon with the pad value
+            mask = np.zeros(cropped_polygon.shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [poly - np.array([x1, y1], dtype=np.int32)], 1)
+            cropped_polygon[mask == 0] = settings.RECOGNITION_PAD_VALUE
+        lines.append(cropped_polygon)
     return lines
 
 
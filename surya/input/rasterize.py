@@ -0,0 +1,87 @@
+import atexit
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+import pypdfium2
+from PIL import Image
+
+# Keep this module light (no torch or settings imports) - it is imported by every spawned render worker
+
+_render_pool = None
+_render_pool_workers = None
+
+
+def get_render_pool(workers: int) -> ProcessPoolExecutor:
+    # One pool is shared by every PDF, so we only pay the process startup once
+    global _render_pool, _render_pool_workers
+    if _render_pool is None or _render_pool_workers != workers:
+        shutdown_render_pool()
+        # Spawn, since forking a process that has loaded torch/CUDA is not safe
+        _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _render_pool_workers = workers
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool, _render_pool_workers
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True)
+        _render_pool = None
+        _render_pool_workers = None
+
+
+atexit.register(shutdown_render_pool)
+
+
+def render_pages_to_shared_memory(pdf_path, page_indices: List[int], dpi) -> List[tuple]:
+    # Runs in a worker.  Each worker opens its own document, since pdfium documents can't be shared across processes.
+    # Pages go back through shared memory instead of pickling the pixels.
+    doc = pypdfium2.PdfDocument(pdf_path)
+    pages = []
+    try:
+        for page_idx in page_indices:
+            bitmap = doc[page_idx].render(scale=dpi / 72)
+            page_array = np.asarray(bitmap.to_pil().convert("RGB"), dtype=np.uint8)
+
+            shm = shared_memory.SharedMemory(create=True, size=max(1, page_array.nbytes))
+            np.ndarray(page_array.shape, dtype=np.uint8, buffer=shm.buf)[:] = page_array
+            pages.append((shm.name, page_array.shape))
+            shm.close()  # The main process unlinks it once it's read
+    finally:
+        doc.close()
+    return pages
+
+
+def read_page_from_shared_memory(shm_name, shape) -> Image.Image:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        page_array = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return Image.fromarray(page_array)
+
+
+def render_pdf_pages_parallel(pdf_path, page_indices: List[int], dpi: int, workers: int, chunk_size: int) -> List[Image.Image]:
+    # Shards the pages into chunks across the render pool.  Results are read in submission order, so page order is preserved.
+    pool = get_render_pool(workers)
+
+    chunks = [page_indices[i:i + chunk_size] for i in range(0, len(page_indices), chunk_size)]
+    # Bound the chunks in flight, so rendered pages don't pile up in shared memory
+    max_in_flight = 2 * workers
+
+    images = []
+    pending = deque()
+    next_chunk = 0
+    while next_chunk < len(chunks) or len(pending) > 0:
+        while next_chunk < len(chunks) and len(pending) < max_in_flight:
+            pending.append(pool.submit(render_pages_to_shared_memory, pdf_path, chunks[next_chunk], dpi))
+            next_chunk += 1
+
+        for shm_name, shape in pending.popleft().result():
+            images.append(read_page_from_shared_memory(shm_name, shape))
+    return images
@@ -1,32 +1,32 @@
 import contextlib
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from PIL import Image
 import numpy as np
 
-from surya.detection import batch_detection
-from surya.postprocessing.heatmap import keep_largest_boxes, get_and_clean_boxes, get_detected_boxes
+from surya.detection import batch_detection, get_batch_size, get_detection_batches, load_detection_batch, prepare_detection_batch, \
+    run_detection_model, same_detection_preprocessing, parallel_get_lines, use_device_postprocessing
+from surya.postprocessing.boxes import BoxArray
+from surya.postprocessing.heatmap import get_largest_box_mask, get_and_clean_box_array, get_detected_box_array
+from surya.postprocessing.util import rescale_bboxes
 from surya.schema import LayoutResult, LayoutBox, TextDetectionResult
 from surya.settings import settings
 from surya.util.parallel import FakeExecutor
+from tqdm import tqdm
 
 
 def get_regions_from_detection_result(detection_result: TextDetectionResult, heatmaps: List[np.ndarray], orig_size, id2label, segment_assignment, vertical_line_width=20) -> List[LayoutBox]:
     logits = np.stack(heatmaps, axis=0)
-    vertical_line_bboxes = detection_result.vertical_lines
-    line_bboxes = detection_result.bboxes
+    heatmap_size = list(reversed(heatmaps[0].shape))
 
-    # Scale back to processor size
-    for line in vertical_line_bboxes:
-        line.rescale_bbox(orig_size, list(reversed(heatmaps[0].shape)))
+    # Scale back to processor size.  The detection result isn't changed.
+    vertical_line_bboxes = rescale_bboxes([line.bbox for line in detection_result.vertical_lines], orig_size, heatmap_size)
+    lines = BoxArray.from_boxes(detection_result.bboxes).rescale(orig_size, heatmap_size)
+    line_bboxes = lines.bboxes
 
-    for line in line_bboxes:
-        line.rescale(orig_size, list(reversed(heatmaps[0].shape)))
-
-    for bbox in vertical_line_bboxes:
+    for vert_bbox in vertical_line_bboxes:
         # Give some width to the vertical lines
-        vert_bbox = list(bbox.bbox)
         vert_bbox[2] = min(heatmaps[0].shape[0], vert_bbox[2] + vertical_line_width)
 
         logits[:, vert_bbox[1]:vert_bbox[3], vert_bbox[0]:vert_bbox[2]] = 0  # zero out where the column lines are
@@ -37,32 +37,34 @@ def get_regions_from_detection_result(detection_result: TextDetectionResult, hea
     for i in range(logits.shape[0]):
         logits[i, segment_assignment != i] = 0
 
-    detected_boxes = []
+    detected_arrays = []
+    detected_labels = []
     for heatmap_idx in range(1, len(id2label)):  # Skip the blank class
         heatmap = logits[heatmap_idx]
         if np.max(heatmap) < settings.DETECTOR_BLANK_THRESHOLD:
             continue
-        bboxes = get_detected_boxes(heatmap)
-        bboxes = [bbox for bbox in bboxes if bbox.area > 25]
-        for bb in bboxes:
-            bb.fit_to_bounds([0, 0, heatmap.shape[1] - 1, heatmap.shape[0] - 1])
+        bboxes = get_detected_box_array(heatmap)
+        bboxes = bboxes[bboxes.areas > 25].fit_to_bounds([0, 0, heatmap.shape[1] - 1, heatmap.shape[0] - 1])
+        detected_arrays.append(bboxes)
+        detected_labels.extend([id2label[heatmap_idx]] * len(bboxes))
 
-        for bbox in bboxes:
-            detected_boxes.append(LayoutBox(polygon=bbox.polygon, label=id2label[heatmap_idx], confidence=1))
+    detected_boxes = BoxArray.concatenate(detected_arrays)
+    detected_boxes.confidences[:] = 1
+    line_coverage = lines.intersection_pct(detected_boxes)
+    detected_boxes = detected_boxes.to_boxes(LayoutBox, label=detected_labels)
 
-    detected_boxes = sorted(detected_boxes, key=lambda x: x.confidence, reverse=True)
     # Expand bbox to cover intersecting lines
     box_lines = defaultdict(list)
-    used_lines = set()
+    used_lines = np.zeros(len(lines), dtype=bool)
 
     # We try 2 rounds of identifying the correct lines to snap to
     # First round is majority intersection, second lowers the threshold
     for thresh in [.5, .4]:
-        for bbox_idx, bbox in enumerate(detected_boxes):
-            for line_idx, line_bbox in enumerate(line_bboxes):
-                if line_bbox.intersection_pct(bbox) > thresh and line_idx not in used_lines:
-                    box_lines[bbox_idx].append(line_bbox.bbox)
-                    used_lines.add(line_idx)
+        for bbox_idx in range(len(detected_boxes)):
+            line_idxs = np.flatnonzero((line_coverage[:, bbox_idx] > thresh) & ~used_lines)
+            if len(line_idxs) > 0:
+                box_lines[bbox_idx].extend(line_bboxes[line_idxs].tolist())
+                used_lines[line_idxs] = True
 
     new_boxes = []
     for bbox_idx, bbox in enumerate(detected_boxes):
@@ -124,32 +126,29 @@ def get_regions_from_detection_result(detection_result: TextDetectionResult, hea
         new_boxes = [bbox for idx, bbox in enumerate(new_boxes) if idx not in to_remove]
 
     # Ensure we account for all text lines in the layout
-    unused_lines = [line for idx, line in enumerate(line_bboxes) if idx not in used_lines]
-    for bbox in unused_lines:
-        new_boxes.append(LayoutBox(polygon=bbox.polygon, label="Text", confidence=.5))
-
-    for bbox in new_boxes:
-        bbox.rescale(list(reversed(heatmaps[0].shape)), orig_size)
+    unused_lines = lines[~used_lines]
+    new_labels = [bbox.label for bbox in new_boxes] + ["Text"] * len(unused_lines)
+    new_boxes = BoxArray.from_boxes(new_boxes)
+    new_boxes = BoxArray.concatenate([new_boxes, unused_lines])
+    new_boxes.confidences[len(new_boxes) - len(unused_lines):] = .5
 
-    detected_boxes = [bbox for bbox in new_boxes if bbox.area > 16]
+    new_boxes = new_boxes.rescale(heatmap_size, orig_size)
+    keep = new_boxes.areas > 16
+    new_boxes = new_boxes[keep]
+    new_labels = [label for label, keep_box in zip(new_labels, keep) if keep_box]
 
     # Remove bboxes contained inside others, unless they're captions
-    contained_bbox = []
-    for i, bbox in enumerate(detected_boxes):
-        for j, bbox2 in enumerate(detected_boxes):
-            if i == j:
-                continue
-
-            if bbox2.intersection_pct(bbox) >= .95 and bbox2.label not in ["Caption"]:
-                contained_bbox.append(j)
+    coverage = new_boxes.intersection_pct(new_boxes)
+    np.fill_diagonal(coverage, 0)
+    contained = (coverage >= .95).any(axis=1) & np.array([label not in ["Caption"] for label in new_labels], dtype=bool)
+    new_labels = [label for label, is_contained in zip(new_labels, contained) if not is_contained]
 
-    detected_boxes = [bbox for idx, bbox in enumerate(detected_boxes) if idx not in contained_bbox]
-
-    return detected_boxes
+    return new_boxes[~contained].to_boxes(LayoutBox, label=new_labels)
 
 
 def get_regions(heatmaps: List[np.ndarray], orig_size, id2label, segment_assignment) -> List[LayoutBox]:
     bboxes = []
+    labels = []
     for i in range(1, len(id2label)):  # Skip the blank class
         heatmap = heatmaps[i]
         assert heatmap.shape == segment_assignment.shape
@@ -159,12 +158,16 @@ def get_regions(heatmaps: List[np.ndarray], orig_size, id2label, segment_assignm
         if np.max(heatmap) < settings.DETECTOR_BLANK_THRESHOLD:
             continue
 
-        bbox = get_and_clean_boxes(heatmap, list(reversed(heatmap.shape)), orig_size)
-        for bb in bbox:
-            bboxes.append(LayoutBox(polygon=bb.polygon, label=id2label[i]))
+        bbox = get_and_clean_box_array(heatmap, list(reversed(heatmap.shape)), orig_size)
+        bboxes.append(bbox)
+        labels.extend([id2label[i]] * len(bbox))
 
-    bboxes = keep_largest_boxes(bboxes)
-    return bboxes
+    bboxes = BoxArray.concatenate(bboxes)
+    bboxes.confidences[:] = np.nan # Region boxes don't have a confidence
+    keep = get_largest_box_mask(bboxes)
+    labels = [label for label, keep_box in zip(labels, keep) if keep_box]
+    # The regions are validated LayoutBoxes, with float corners
+    return bboxes[keep].to_boxes(LayoutBox, validate=True, label=labels)
 
 
 def parallel_get_regions(heatmaps: List[np.ndarray], orig_size, id2label, detection_results=None, include_maps=False) -> LayoutResult:
@@ -214,4 +217,41 @@ def batch_layout_detection(images: List, model, processor, detection_results: Op
                 postprocessing_futures.append(future)
                 img_idx += 1
 
-    return [future.result() for future in postprocessing_futures]
\ No newline at end of file
+    return [future.result() for future in postprocessing_futures]
+
+
+def batch_text_and_layout_detection(images: List, det_model, det_processor, layout_model, layout_processor, batch_size=None, include_maps=False) -> Tuple[List[TextDetectionResult], List[LayoutResult]]:
+    # Same results as batch_text_detection followed by batch_layout_detection, but each page is loaded, split and
+    # preprocessed once, and the batch feeds both models.  Layout postprocessing gets the text lines from the same pass.
+    if batch_size is None:
+        batch_size = get_batch_size()
+    id2label = layout_model.config.id2label
+    shared_preprocessing = same_detection_preprocessing(det_processor, layout_processor)
+
+    max_workers = min(settings.DETECTOR_POSTPROCESSING_CPU_WORKERS, len(images))
+    parallelize = not settings.IN_STREAMLIT and len(images) >= settings.DETECTOR_MIN_PARALLEL_THRESH
+    executor = ThreadPoolExecutor if parallelize else FakeExecutor
+
+    det_futures = []
+    layout_futures = []
+    batches = get_detection_batches(images, det_processor, batch_size)
+    with executor(max_workers=max_workers) as e:
+        for batch_image_idxs in tqdm(batches, desc="Detecting bboxes and layout"):
+            batch_images, batch_orig_sizes = load_detection_batch(images, batch_image_idxs)
+            batch, split_index, split_heights = prepare_detection_batch(batch_images, det_processor)
+            det_preds = run_detection_model(det_model, det_processor, batch, split_index, split_heights, device_postprocessing=use_device_postprocessing(include_maps))
+            batch_det_futures = [e.submit(parallel_get_lines, pred, orig_size, include_maps) for pred, orig_size in zip(det_preds, batch_orig_sizes)]
+            det_futures.extend(batch_det_futures)
+
+            # Text line postprocessing runs while the layout model does
+            if not shared_preprocessing:
+                batch, split_index, split_heights = prepare_detection_batch(batch_images, layout_processor)
+            layout_preds = run_detection_model(layout_model, layout_processor, batch, split_index, split_heights)
+            del batch
+
+            for pred, orig_size, det_future in zip(layout_preds, batch_orig_sizes, batch_det_futures):
+                layout_futures.append(e.submit(parallel_get_regions, pred, orig_size, id2label, det_future.result(), include_maps))
+
+    det_results = [future.result() for future in det_futures]
+    layout_results = [future.result() for future in layout_futures]
+    return det_results, layout_results
@@ -0,0 +1,48 @@
+import torch
+
+
+class KVCachePool:
+    """
+    Backing storage for one attention block's key/value cache.  It is sized for the largest batch and sequence seen so far,
+    and handed out as views, so setting up a new batch reuses the same memory instead of going back to the allocator.
+    """
+
+    def __init__(self):
+        self.keys = None
+        self.values = None
+
+    def get(self, batch_size: int, num_heads: int, length: int, head_dim: int, device, dtype, capacity: int = 0):
+        # Views of the first batch_size rows and length positions.  Contents are left as they are - callers reset what they need.
+        # capacity is the sequence length to allocate for up front, so a growing cache doesn't reallocate every step.
+        if not self._fits(batch_size, num_heads, length, head_dim, device, dtype):
+            self._grow(batch_size, num_heads, max(length, capacity), head_dim, device, dtype)
+        return self.keys[:batch_size, :, :length], self.values[:batch_size, :, :length]
+
+    def _compatible(self, num_heads, head_dim, device, dtype) -> bool:
+        return (
+            self.keys is not None and
+            self.keys.device == torch.device(device) and
+            self.keys.dtype == dtype and
+            self.keys.shape[1] == num_heads and
+            self.keys.shape[3] == head_dim
+        )
+
+    def _fits(self, batch_size, num_heads, length, head_dim, device, dtype) -> bool:
+        return self._compatible(num_heads, head_dim, device, dtype) and self.keys.shape[0] >= batch_size and self.keys.shape[2] >= length
+
+    def _grow(self, batch_size, num_heads, length, head_dim, device, dtype):
+        old_keys, old_values = None, None
+        if self._compatible(num_heads, head_dim, device, dtype):
+            old_keys, old_values = self.keys, self.values
+            batch_size = max(batch_size, old_keys.shape[0])
+            length = max(length, old_keys.shape[2])
+
+        shape = (batch_size, num_heads, length, head_dim)
+        self.keys = torch.zeros(shape, dtype=dtype, device=device)
+        self.values = torch.zeros(shape, dtype=dtype, device=device)
+
+        # Keep what was cached, so a cache can grow mid-sequence
+        if old_keys is not None:
+            old_batch, _, old_length, _ = old_keys.shape
+            self.keys[:old_batch, :, :old_length] = old_keys
+            self.values[:old_batch, :, :old_length] = old_values
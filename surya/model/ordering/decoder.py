@@ -87,6 +87,12 @@ class MBartGQAttention(nn.Module):
         self.q_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
         self.out_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
 
+        # Static cache, see _setup_cache
+        self.static_cache = False
+        self.cache_length = 0
+        self.key_states = None
+        self.value_states = None
+
     def _shape(self, tensor: torch.Tensor, seq_len: int, bsz: int):
         return tensor.view(bsz, seq_len, self.num_heads, self.head_dim).transpose(1, 2).contiguous()
 
@@ -116,7 +122,20 @@ class MBartGQAttention(nn.Module):
         # `past_key_value[0].shape[2] == key_value_states.shape[1]`
         # is checking that the `sequence_length` of the `past_key_value` is the same as
         # the provided `key_value_states` to support prefix tuning
-        if (
+        if self.static_cache and is_cross_attention:
+            # Computed on the first step, then reused.  Finished rows are dropped from the end of the batch.
+            if self.key_states is None:
+                self.key_states = self._shape_key_value(self.k_proj(key_value_states), -1, bsz)
+                self.value_states = self._shape_key_value(self.v_proj(key_value_states), -1, bsz)
+            key_states = self.key_states[:bsz]
+            value_states = self.value_states[:bsz]
+        elif self.static_cache:
+            # Write the new keys and values at the write index, and attend to the filled part of the buffers
+            key_states, value_states = self._update_static_cache(
+                self._shape_key_value(self.k_proj(hidden_states), -1, bsz),
+                self._shape_key_value(self.v_proj(hidden_states), -1, bsz)
+            )
+        elif (
             is_cross_attention
             and past_key_value is not None
             and past_key_value[0].shape[2] == key_value_states.shape[1]
@@ -147,7 +166,7 @@ class MBartGQAttention(nn.Module):
             # all previous decoder key/value_states. Further calls to uni-directional self-attention
             # can concat previous decoder key/value_states to current projected key/value_states (third "elif" case)
             # if encoder bi-directional self-attention `past_key_value` is always `None`
-            past_key_value = (key_states, value_states)
+            past_key_value = (key_states, value_states) if not self.static_cache else ()
 
         query_states = self._shape(query_states, tgt_len, bsz)
 
@@ -173,6 +192,31 @@ class MBartGQAttention(nn.Module):
 
         return attn_output, None, past_key_value
 
+    def _setup_cache(self, batch_size, device, dtype, max_length=None):
+        # Preallocated key and value buffers for self attention, filled in place, instead of concatenating past_key_values
+        # every step.  Cross attention (max_length None) keeps its keys and values from the first step.
+        self.static_cache = True
+        self.cache_length = 0
+        self.key_states = None
+        self.value_states = None
+        if max_length is not None:
+            self.key_states = torch.zeros((batch_size, self.num_kv_heads, max_length, self.head_dim), device=device, dtype=dtype)
+            self.value_states = torch.zeros((batch_size, self.num_kv_heads, max_length, self.head_dim), device=device, dtype=dtype)
+
+    def _clear_cache(self):
+        self.static_cache = False
+        self.cache_length = 0
+        self.key_states = None
+        self.value_states = None
+
+    def _update_static_cache(self, key_states, value_states):
+        bsz, _, q_len, _ = key_states.shape
+        end = self.cache_length + q_len
+        self.key_states[:bsz, :, self.cache_length:end] = key_states
+        self.value_states[:bsz, :, self.cache_length:end] = value_states
+        self.cache_length = end
+        return self.key_states[:bsz, :, :end], self.value_states[:bsz, :, :end]
+
 
 class MBartOrderDecoderLayer(nn.Module):
     def __init__(self, config: MBartConfig):
@@ -371,9 +415,27 @@ class MBartOrderDecoder(MBartPreTrainedModel):
         self.layer_norm = nn.LayerNorm(config.d_model)
 
         self.gradient_checkpointing = False
+        self.static_cache = False
+        self.cache_length = 0
         # Initialize weights and apply final processing
         self.post_init()
 
+    def _setup_cache(self, batch_size, max_length, device, dtype):
+        # Use static caches for the next decode, up to max_length boxes and predictions.  past_key_values aren't
+        # passed in or returned while they're set up.  Later steps can run on fewer rows, as long as they're the first rows.
+        self.static_cache = True
+        self.cache_length = 0
+        for layer in self.layers:
+            layer.self_attn._setup_cache(batch_size, device, dtype, max_length=max_length)
+            layer.encoder_attn._setup_cache(batch_size, device, dtype)
+
+    def _clear_cache(self):
+        self.static_cache = False
+        self.cache_length = 0
+        for layer in self.layers:
+            layer.self_attn._clear_cache()
+            layer.encoder_attn._clear_cache()
+
     def get_input_embeddings(self):
         return self.embed_tokens
 
@@ -417,6 +479,8 @@ class MBartOrderDecoder(MBartPreTrainedModel):
 
         # past_key_values_length
         past_key_values_length = past_key_values[0][0].shape[2] if past_key_values is not None else 0
+        if self.static_cache:
+            past_key_values_length = self.cache_length
 
         if inputs_embeds is None:
             inputs_embeds = self.embed_tokens(input_boxes, input_boxes_counts, past_key_values_length) * self.embed_scale
@@ -528,6 +592,8 @@ class MBartOrderDecoder(MBartPreTrainedModel):
                     all_cross_attentions += (layer_outputs[2],)
 
         hidden_states = self.layer_norm(hidden_states)
+        if self.static_cache:
+            self.cache_length += input_shape[1]
 
         # add hidden states from the last decoder layer
         if output_hidden_states:
@@ -599,6 +665,12 @@ class MBartOrder(MBartPreTrainedModel, GenerationMixin):
     def get_decoder(self):
         return self.model.decoder
 
+    def _setup_cache(self, batch_size, max_length, device, dtype):
+        self.model.decoder._setup_cache(batch_size, max_length, device, dtype)
+
+    def _clear_cache(self):
+        self.model.decoder._clear_cache()
+
     def forward(
         self,
         input_boxes: torch.LongTensor = None,
@@ -14,6 +14,7 @@ from transformers.modeling_attn_mask_utils import AttentionMaskConverter
 from transformers.modeling_outputs import BaseModelOutputWithNoAttention, CausalLMOutput
 from transformers.pytorch_utils import ALL_LAYERNORM_LAYERS
 
+from surya.model.kv_cache import KVCachePool
 from surya.settings import settings
 
 _MAX_SQRT_GRADIENT = 1000.0
@@ -142,6 +143,7 @@ class SuryaOCRDecoderSdpaCrossAttention(nn.Module):
             self.head_dim,
             base=config.rope_theta,
         )
+        self.cache_pool = KVCachePool()
 
     def forward(
         self,
@@ -187,15 +189,31 @@ class SuryaOCRDecoderSdpaCrossAttention(nn.Module):
         attn_output = self.o_proj(attn_output)
         return attn_output
 
-    def _setup_cache(self, batch_size, device, dtype=None):
+    def _setup_cache(self, batch_size, device, dtype=None, static_cache=None, max_length=None):
         # Setup initial caches
         self.value_states = None
         self.key_states = None
 
     @torch.no_grad()
     def _update_cache(self, key_states, value_states, **cache_kwargs):
-        self.value_states = value_states
-        self.key_states = key_states
+        # Keep the encoder keys/values in the pooled cache, instead of holding on to new tensors every batch
+        bsz, num_key_value_heads, v_len, head_dim = key_states.shape
+        k_out, v_out = self.cache_pool.get(bsz, num_key_value_heads, v_len, head_dim, key_states.device, key_states.dtype)
+        k_out.copy_(key_states)
+        v_out.copy_(value_states)
+        self.key_states, self.value_states = k_out, v_out
+
+    @torch.no_grad()
+    def _reset_cache_slots(self, slot_idxs, encoder_hidden_states):
+        # Recompute the cached encoder keys/values for the batch rows that received a new line
+        bsz, v_len, _ = encoder_hidden_states.size()
+        key_states = self.k_proj(encoder_hidden_states)
+        value_states = self.v_proj(encoder_hidden_states)
+        key_states = key_states.view(bsz, v_len, self.num_key_value_heads, self.head_dim).transpose(1, 2)
+        value_states = value_states.view(bsz, v_len, self.num_key_value_heads, self.head_dim).transpose(1, 2)
+
+        self.key_states[slot_idxs] = key_states.to(self.key_states.dtype)
+        self.value_states[slot_idxs] = value_states.to(self.value_states.dtype)
 
 
 class SuryaOCRDecoderSdpaAttention(nn.Module):
@@ -219,6 +237,8 @@ class SuryaOCRDecoderSdpaAttention(nn.Module):
             self.head_dim,
             base=config.rope_theta,
         )
+        self.cache_pool = KVCachePool()
+        self.static_cache = settings.RECOGNITION_STATIC_CACHE
 
     def forward(
         self,
@@ -254,12 +274,11 @@ class SuryaOCRDecoderSdpaAttention(nn.Module):
         if attention_mask is not None:
             # Mask is batch, head, seq_len, kv_len
             causal_mask = causal_mask[:, :, :, :key_states.shape[-2]]
-            current_cache_position = cache_position[-1].item() if cache_position is not None else None
-            if current_cache_position and settings.RECOGNITION_STATIC_CACHE:
-                # Mask out future cache positions
-                position_mask = torch.ones_like(causal_mask, dtype=torch.bool, device=causal_mask.device)
-                position_mask[:, :, :, :current_cache_position + 1] = False
-                causal_mask = torch.where(position_mask, torch.finfo(causal_mask.dtype).min, causal_mask)
+            # Per-row (2D) cache positions already come with a per-row mask
+            if self.static_cache and cache_position is not None and cache_position.dim() == 1:
+                # Mask out future cache positions, compared on device so decoding doesn't wait on the host
+                position_mask = torch.arange(causal_mask.shape[-1], device=causal_mask.device) > cache_position[-1]
+                causal_mask = causal_mask.masked_fill(position_mask, torch.finfo(causal_mask.dtype).min)
 
         attn_output = torch.nn.functional.scaled_dot_product_attention(
             query_states,
@@ -275,45 +294,65 @@ class SuryaOCRDecoderSdpaAttention(nn.Module):
         attn_output = self.o_proj(attn_output)
         return attn_output
 
-    def _setup_cache(self, batch_size, device, dtype=None):
+    def _setup_cache(self, batch_size, device, dtype=None, static_cache=None, max_length=None):
         if dtype is None and self.config.torch_dtype is not None:
             dtype = self.config.torch_dtype
         dtype = dtype if dtype is not None else torch.float32
+        if static_cache is None:
+            static_cache = settings.RECOGNITION_STATIC_CACHE
 
         # Setup initial caches
         self.value_states = None
         self.key_states = None
+        self.static_cache = static_cache
 
-        if settings.RECOGNITION_STATIC_CACHE:
-            cache_shape = (batch_size, self.num_key_value_heads, settings.RECOGNITION_MAX_TOKENS, self.head_dim)
-            self.value_states = torch.zeros(cache_shape, dtype=dtype, device=device)
-            self.key_states = torch.zeros(cache_shape, dtype=dtype, device=device)
+        if static_cache:
+            # Reuse the pooled cache, zeroed in place
+            max_length = max_length if max_length is not None else settings.RECOGNITION_MAX_TOKENS
+            self.key_states, self.value_states = self.cache_pool.get(
+                batch_size, self.num_key_value_heads, max_length, self.head_dim, device, dtype
+            )
+            self.key_states.zero_()
+            self.value_states.zero_()
+
+    @torch.no_grad()
+    def _reset_cache_slots(self, slot_idxs, encoder_hidden_states=None):
+        # Evict the rows of finished lines, so new lines can be decoded in their place
+        self.key_states[slot_idxs] = 0
+        self.value_states[slot_idxs] = 0
 
     def _update_static_cache(self, key_states, value_states, **cache_kwargs):
         cache_position = cache_kwargs.get("cache_position")
         k_out, v_out = self.key_states.to(key_states.device), self.value_states.to(value_states.device)
 
-        k_out[:, :, cache_position] = key_states.to(k_out.dtype)
-        v_out[:, :, cache_position] = value_states.to(v_out.dtype)
+        if cache_position.dim() == 2:
+            # Every row writes at its own position - batch, seq_len
+            batch_idxs = torch.arange(k_out.shape[0], device=k_out.device).unsqueeze(1)
+            k_out[batch_idxs, :, cache_position] = key_states.transpose(1, 2).to(k_out.dtype)
+            v_out[batch_idxs, :, cache_position] = value_states.transpose(1, 2).to(v_out.dtype)
+        else:
+            k_out[:, :, cache_position] = key_states.to(k_out.dtype)
+            v_out[:, :, cache_position] = value_states.to(v_out.dtype)
 
         self.key_states, self.value_states = k_out, v_out
         return k_out, v_out
 
     def _update_dynamic_cache(self, key_states, value_states, **cache_kwargs):
-        k_out = key_states
-        if self.key_states is not None:
-            k_out = torch.cat([self.key_states, key_states], dim=2)
-
-        v_out = value_states
-        if self.value_states is not None:
-            v_out = torch.cat([self.value_states, value_states], dim=2)
+        # Append into the pooled cache, instead of concatenating into a new tensor every step
+        bsz, num_key_value_heads, q_len, head_dim = key_states.shape
+        start = self.key_states.shape[2] if self.key_states is not None else 0
+        k_out, v_out = self.cache_pool.get(
+            bsz, num_key_value_heads, start + q_len, head_dim, key_states.device, key_states.dtype, capacity=settings.RECOGNITION_MAX_TOKENS
+        )
+        k_out[:, :, start:] = key_states
+        v_out[:, :, start:] = value_states
 
         self.key_states, self.value_states = k_out, v_out
         return k_out, v_out
 
     @torch.no_grad()
     def _update_cache(self, key_states, value_states, **cache_kwargs):
-        if settings.RECOGNITION_STATIC_CACHE:
+        if self.static_cache:
             return self._update_static_cache(key_states, value_states, **cache_kwargs)
 
         return self._update_dynamic_cache(key_states, value_states, **cache_kwargs)
@@ -422,13 +461,24 @@ class SuryaOCRDecoderPreTrainedModel(PreTrainedModel):
             if module.padding_idx is not None:
                 module.weight.data[module.padding_idx].zero_()
 
-    def _setup_cache(self, config, batch, device, dtype):
+    def _setup_cache(self, config, batch, device, dtype, static_cache=None, max_length=None):
+        # max_length is the static cache length, it defaults to RECOGNITION_MAX_TOKENS
+        model = getattr(self, "model", self)
+        model.static_cache_length = max_length if max_length is not None else settings.RECOGNITION_MAX_TOKENS
+        for layer in model.layers:
+            if layer.temporal_block:
+                layer.temporal_block._setup_cache(batch, device, dtype, static_cache=static_cache, max_length=max_length)
+            if layer.cross_attn_block:
+                layer.cross_attn_block._setup_cache(batch, device, dtype, static_cache=static_cache, max_length=max_length)
+
+    def _reset_cache_slots(self, slot_idxs, encoder_hidden_states):
+        # Only works with a static cache, and after the cross attention cache has been filled
         layers = getattr(self, "model", self).layers
         for layer in layers:
             if layer.temporal_block:
-                layer.temporal_block._setup_cache(batch, device, dtype)
+                layer.temporal_block._reset_cache_slots(slot_idxs)
             if layer.cross_attn_block:
-                layer.cross_attn_block._setup_cache(batch, device, dtype)
+                layer.cross_attn_block._reset_cache_slots(slot_idxs, encoder_hidden_states)
 
     def reset_cache(self, batch, device, dtype):
         pass
@@ -503,7 +553,7 @@ class SuryaOCRDecoderModel(SuryaOCRDecoderPreTrainedModel):
         if cache_position is None:
             cache_position = torch.arange(hidden_states.shape[1], device=hidden_states.device)
         if position_ids is None:
-            position_ids = cache_position.unsqueeze(0)
+            position_ids = cache_position if cache_position.dim() == 2 else cache_position.unsqueeze(0)
 
         causal_mask = self._update_causal_mask(attention_mask, inputs_embeds, cache_position)
 
@@ -538,12 +588,21 @@ class SuryaOCRDecoderModel(SuryaOCRDecoderPreTrainedModel):
     # `fullgraph=True`. See more context in https://github.com/huggingface/transformers/pull/29114
     # Ignore copy
     def _update_causal_mask(self, attention_mask, input_tensor, cache_position):
-        if not self.causal:
-            return None
-
         dtype, device = input_tensor.dtype, input_tensor.device
         min_dtype = torch.finfo(dtype).min
         sequence_length = input_tensor.shape[1]
+
+        if cache_position.dim() == 2:
+            # Each row is at its own position in a static cache (continuous batching, speculative decoding), so build the mask per row.
+            # Positions past each row's tokens hold zeros or stale entries, so they are always masked, even for non-causal models.
+            target_length = max(getattr(self, "static_cache_length", settings.RECOGNITION_MAX_TOKENS), sequence_length)
+            future_positions = torch.arange(target_length, device=device)[None, None, :] > cache_position[:, :, None]
+            causal_mask = torch.zeros(future_positions.shape, dtype=dtype, device=device).masked_fill(future_positions, min_dtype)
+            return causal_mask[:, None, :, :]
+
+        if not self.causal:
+            return None
+
         target_length = max(settings.RECOGNITION_MAX_TOKENS, sequence_length)
 
         diagonal = torch.full((sequence_length, target_length), fill_value=min_dtype, dtype=dtype, device=device)
@@ -38,44 +38,36 @@ class SuryaImageProcessor(DonutImageProcessor):
 
         return resized_image
 
-    def process_inner(self, images: List[np.ndarray]):
+    def process_inner(self, images: List[np.ndarray], dtype=np.float32) -> np.ndarray:
         assert images[0].shape[2] == 3 # RGB input images, channel dim last
 
-        # Rotate if the bbox is wider than it is tall
-        images = [SuryaImageProcessor.align_long_axis(image, size=self.max_size, input_data_format=ChannelDimension.LAST) for image in images]
-
-        # Verify that the image is wider than it is tall
-        for img in images:
-            assert img.shape[1] >= img.shape[0]
-
-        # This also applies the right channel dim format, to channel x height x width
-        images = [SuryaImageProcessor.numpy_resize(img, self.max_size, self.resample) for img in images]
-        assert images[0].shape[0] == 3 # RGB input images, channel dim first
-
-        # Convert to float32 for rescale/normalize
-        images = [img.astype(np.float32) for img in images]
-
-        # Pads with 255 (whitespace)
-        # Pad to max size to improve performance
-        max_size = self.max_size
-        images = [
-            SuryaImageProcessor.pad_image(
-                image=image,
-                size=max_size,
-                input_data_format=ChannelDimension.FIRST,
-                pad_value=settings.RECOGNITION_PAD_VALUE
-            )
-            for image in images
-        ]
-        # Rescale and normalize
-        for idx in range(len(images)):
-            images[idx] = images[idx] * self.rescale_factor
-        images = [
-            SuryaImageProcessor.normalize(img, mean=self.image_mean, std=self.image_std, input_data_format=ChannelDimension.FIRST)
-            for img in images
-        ]
-
-        return images
+        height, width = self.max_size["height"], self.max_size["width"]
+
+        # Rescale and normalize fold into one multiply-add: (x * rescale - mean) / std == x * scale - offset
+        mean = np.asarray(self.image_mean, dtype=np.float32)
+        std = np.asarray(self.image_std, dtype=np.float32)
+        scale = (np.float32(self.rescale_factor) / std)[:, None, None]
+        offset = (mean / std)[:, None, None]
+
+        # Every line is written into one preallocated channel x height x width batch, with scratch buffers reused across lines
+        pixel_values = np.empty((len(images), 3, height, width), dtype=dtype)
+        resized = np.empty((height, width, 3), dtype=np.uint8)
+        scaled = np.empty((3, height, width), dtype=np.float32)
+        for idx, image in enumerate(images):
+            # Rotate if the bbox is wider than it is tall
+            image = SuryaImageProcessor.align_long_axis(image, size=self.max_size, input_data_format=ChannelDimension.LAST)
+
+            # Verify that the image is wider than it is tall
+            assert image.shape[1] >= image.shape[0]
+
+            # Resizing straight to the max size means no padding is needed
+            cv2.resize(image, (width, height), dst=resized, interpolation=self.resample)
+
+            # Multiply in float32, then cast once when writing into the output batch (float16 if requested)
+            np.multiply(resized.transpose(2, 0, 1), scale, out=scaled)
+            np.subtract(scaled, offset, out=pixel_values[idx], casting="same_kind")
+
+        return pixel_values
 
     def preprocess(
         self,
@@ -95,13 +87,15 @@ class SuryaImageProcessor(DonutImageProcessor):
         return_tensors: Optional[Union[str, TensorType]] = None,
         data_format: Optional[ChannelDimension] = ChannelDimension.FIRST,
         input_data_format: Optional[Union[str, ChannelDimension]] = None,
+        dtype=np.float32,
         **kwargs,
     ) -> PIL.Image.Image:
         images = make_list_of_images(images)
 
-        # Convert to numpy for later processing steps
-        images = [np.array(img) for img in images]
-        images = self.process_inner(images)
+        # Convert to numpy for later processing steps, numpy inputs aren't copied
+        images = [np.asarray(img) for img in images]
+        # Batched (N, 3, H, W) array, so it can be wrapped with torch.from_numpy without a copy
+        images = self.process_inner(images, dtype=dtype)
 
         data = {"pixel_values": images}
         return BatchFeature(data=data, tensor_type=return_tensors)
@@ -0,0 +1,130 @@
+import torch
+import torch.nn.functional as F
+
+
+class StaticDecodeEngine:
+    """
+    Decodes fixed size batches with persistent buffers.  The KV cache, the step inputs (token ids and per-row cache positions),
+    and the step outputs keep the same shapes and addresses across steps and batches, so the decode step is captured once
+    as a CUDA graph and replayed (or compiled once with torch.compile off cuda).
+
+    Every row feeds one token per step at its own position, so prompts of different lengths don't need padding.
+    """
+
+    def __init__(self, model, batch_size: int, max_tokens: int, encoder_length: int, encoder_hidden_size: int):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.encoder_length = encoder_length
+        self.encoder_hidden_size = encoder_hidden_size
+        self.device = model.device
+        self.dtype = model.dtype
+
+        self.input_ids = torch.zeros((batch_size, 1), dtype=torch.long, device=self.device)
+        self.cache_position = torch.zeros((batch_size, 1), dtype=torch.long, device=self.device)
+        self.encoder_hidden_states = torch.zeros((batch_size, encoder_length, encoder_hidden_size), dtype=self.dtype, device=self.device)
+        self.all_slots = torch.arange(batch_size, device=self.device)
+
+        self.graph = None
+        self.compiled_step = None
+        self.preds = None
+        self.scores = None
+
+        self.caches = self._allocate_caches()
+        self._bind_caches()
+        self._warm()
+
+    def _allocate_caches(self):
+        # The engine owns its KV cache, instead of using the decoder's pooled caches.  Other decode paths set up the pooled
+        # caches between static batches, and would otherwise move the memory the graph was captured with.
+        caches = []
+        for layer in self.model.decoder.model.layers:
+            for block, length in [(layer.temporal_block, self.max_tokens), (layer.cross_attn_block, self.encoder_length)]:
+                if block is None:
+                    continue
+                shape = (self.batch_size, block.num_key_value_heads, length, block.head_dim)
+                caches.append((block, torch.zeros(shape, dtype=self.dtype, device=self.device), torch.zeros(shape, dtype=self.dtype, device=self.device)))
+        return caches
+
+    def _bind_caches(self):
+        # Point the decoder back at the engine's caches, after other decode paths have set up their own
+        self.model.decoder.model.static_cache_length = self.max_tokens
+        for block, keys, values in self.caches:
+            block.key_states, block.value_states = keys, values
+            if hasattr(block, "static_cache"):
+                block.static_cache = True
+
+    def matches(self, model, batch_size, max_tokens, encoder_hidden_states) -> bool:
+        return (
+            self.model is model and
+            self.batch_size == batch_size and
+            self.max_tokens == max_tokens and
+            self.device == model.device and
+            self.dtype == model.dtype and
+            encoder_hidden_states.shape[1:] == (self.encoder_length, self.encoder_hidden_size)
+        )
+
+    def _decode_step(self):
+        logits = self.model.decoder(
+            input_ids=self.input_ids,
+            encoder_hidden_states=self.encoder_hidden_states,
+            cache_position=self.cache_position,
+            use_cache=True,
+            prefill=False
+        )["logits"][:, -1]
+
+        preds = torch.argmax(logits, dim=-1)
+        scores = torch.max(F.softmax(logits, dim=-1), dim=-1).values
+        return preds, scores
+
+    @torch.no_grad()
+    def _warm(self):
+        self._decode_step()
+
+        if self.device.type == "cuda":
+            # Warm up on a side stream before capturing, as cuda graphs require
+            stream = torch.cuda.Stream(device=self.device)
+            stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(stream):
+                for _ in range(2):
+                    self._decode_step()
+            torch.cuda.current_stream(self.device).wait_stream(stream)
+
+            self.graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.graph):
+                self.preds, self.scores = self._decode_step()
+        else:
+            # Shapes never change, so this compiles once
+            self.compiled_step = torch.compile(self._decode_step, dynamic=False)
+            self.compiled_step()
+
+    @torch.no_grad()
+    def reset(self, encoder_hidden_states: torch.Tensor):
+        # Load a new batch - rows past the end of the batch get zeros, and are never read
+        batch_size = encoder_hidden_states.shape[0]
+        self.encoder_hidden_states[:batch_size].copy_(encoder_hidden_states)
+        self.encoder_hidden_states[batch_size:].zero_()
+        self._bind_caches()
+        self.model.decoder.model._reset_cache_slots(self.all_slots, self.encoder_hidden_states)
+
+    @torch.no_grad()
+    def step(self, input_ids: torch.Tensor, cache_position: torch.Tensor):
+        # Returned tensors are overwritten by the next step
+        self.input_ids.copy_(input_ids.view(self.batch_size, 1))
+        self.cache_position.copy_(cache_position.view(self.batch_size, 1))
+
+        if self.graph is not None:
+            self.graph.replay()
+            return self.preds, self.scores
+        return self.compiled_step()
+
+
+def get_static_decode_engine(model, batch_size: int, max_tokens: int, encoder_hidden_states: torch.Tensor) -> StaticDecodeEngine:
+    # Kept on the model, so repeated calls reuse the captured graph instead of warming up again
+    if not hasattr(model, "static_decode_engines"):
+        model.static_decode_engines = {}
+    engine = model.static_decode_engines.get((batch_size, max_tokens))
+    if engine is None or not engine.matches(model, batch_size, max_tokens, encoder_hidden_states):
+        engine = StaticDecodeEngine(model, batch_size, max_tokens, encoder_hidden_states.shape[1], encoder_hidden_states.shape[2])
+        model.static_decode_engines[(batch_size, max_tokens)] = engine
+    return engine
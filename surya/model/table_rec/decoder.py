@@ -14,6 +14,7 @@ from transformers.modeling_attn_mask_utils import AttentionMaskConverter
 from transformers.modeling_outputs import BaseModelOutputWithNoAttention, CausalLMOutput
 from transformers.pytorch_utils import ALL_LAYERNORM_LAYERS
 
+from surya.model.kv_cache import KVCachePool
 from surya.settings import settings
 
 _MAX_SQRT_GRADIENT = 1000.0
@@ -141,6 +142,7 @@ class SuryaTableRecDecoderSdpaCrossAttention(nn.Module):
             self.head_dim,
             base=config.rope_theta,
         )
+        self.cache_pool = KVCachePool()
 
     def forward(
         self,
@@ -193,8 +195,12 @@ class SuryaTableRecDecoderSdpaCrossAttention(nn.Module):
 
     @torch.no_grad()
     def _update_cache(self, key_states, value_states, **cache_kwargs):
-        self.value_states = value_states
-        self.key_states = key_states
+        # Keep the encoder keys/values in the pooled cache, instead of holding on to new tensors every batch
+        bsz, num_key_value_heads, v_len, head_dim = key_states.shape
+        k_out, v_out = self.cache_pool.get(bsz, num_key_value_heads, v_len, head_dim, key_states.device, key_states.dtype)
+        k_out.copy_(key_states)
+        v_out.copy_(value_states)
+        self.key_states, self.value_states = k_out, v_out
 
 
 class SuryaTableRecDecoderSdpaAttention(nn.Module):
@@ -218,6 +224,7 @@ class SuryaTableRecDecoderSdpaAttention(nn.Module):
             self.head_dim,
             base=config.rope_theta,
         )
+        self.cache_pool = KVCachePool()
 
     def forward(
         self,
@@ -284,9 +291,12 @@ class SuryaTableRecDecoderSdpaAttention(nn.Module):
         self.key_states = None
 
         if settings.RECOGNITION_STATIC_CACHE:
-            cache_shape = (batch_size, self.num_key_value_heads, settings.RECOGNITION_MAX_TOKENS, self.head_dim)
-            self.value_states = torch.zeros(cache_shape, dtype=dtype, device=device)
-            self.key_states = torch.zeros(cache_shape, dtype=dtype, device=device)
+            # Reuse the pooled cache, zeroed in place
+            self.key_states, self.value_states = self.cache_pool.get(
+                batch_size, self.num_key_value_heads, settings.RECOGNITION_MAX_TOKENS, self.head_dim, device, dtype
+            )
+            self.key_states.zero_()
+            self.value_states.zero_()
 
     def _update_static_cache(self, key_states, value_states, **cache_kwargs):
         cache_position = cache_kwargs.get("cache_position")
@@ -299,13 +309,14 @@ class SuryaTableRecDecoderSdpaAttention(nn.Module):
         return k_out, v_out
 
     def _update_dynamic_cache(self, key_states, value_states, **cache_kwargs):
-        k_out = key_states
-        if self.key_states is not None:
-            k_out = torch.cat([self.key_states, key_states], dim=2)
-
-        v_out = value_states
-        if self.value_states is not None:
-            v_out = torch.cat([self.value_states, value_states], dim=2)
+        # Append into the pooled cache, instead of concatenating into a new tensor every step
+        bsz, num_key_value_heads, q_len, head_dim = key_states.shape
+        start = self.key_states.shape[2] if self.key_states is not None else 0
+        k_out, v_out = self.cache_pool.get(
+            bsz, num_key_value_heads, start + q_len, head_dim, key_states.device, key_states.dtype, capacity=settings.TABLE_REC_MAX_BOXES
+        )
+        k_out[:, :, start:] = key_states
+        v_out[:, :, start:] = value_states
 
         self.key_states, self.value_states = k_out, v_out
         return k_out, v_out
@@ -1,12 +1,15 @@
 from copy import deepcopy
-from typing import List
+from typing import List, Generator
+import numpy as np
 from PIL import Image
 
-from surya.detection import batch_text_detection
-from surya.input.processing import slice_polys_from_image, slice_bboxes_from_image, convert_if_not_rgb
+from surya.detection import batch_text_detection, iter_text_detection, get_batch_size as get_detector_batch_size
+from surya.input.processing import slice_polys_from_image, slice_polys_from_array, slice_bboxes_from_image, convert_if_not_rgb
+from surya.postprocessing.boxes import BoxArray
 from surya.postprocessing.text import sort_text_lines
 from surya.recognition import batch_recognition
-from surya.schema import TextLine, OCRResult
+from surya.schema import TextLine, OCRResult, TextDetectionResult
+from surya.settings import settings
 
 
 def run_recognition(images: List[Image.Image], langs: List[List[str] | None], rec_model, rec_processor, bboxes: List[List[List[int]]] = None, polygons: List[List[List[List[int]]]] = None, batch_size=None) -> List[OCRResult]:
@@ -60,78 +63,157 @@ def run_recognition(images: List[Image.Image], langs: List[List[str] | None], re
     return predictions_by_image
 
 
-def run_ocr(images: List[Image.Image], langs: List[List[str] | None], det_model, det_processor, rec_model, rec_processor, batch_size=None, highres_images: List[Image.Image] | None = None) -> List[OCRResult]:
-    # 确保所有图像都是RGB格式
-    images = convert_if_not_rgb(images)
-    # 如果提供了高分辨率图像,也将其转换为RGB格式;否则,用None填充
-    highres_images = convert_if_not_rgb(highres_images) if highres_images is not None else [None] * len(images)
-    # 对所有图像进行文本检测
-    det_predictions = batch_text_detection(images, det_model, det_processor)
+def slice_detected_lines(det_pred: TextDetectionResult, image: Image.Image | None, highres_image: Image.Image | None = None, line_idxs: List[int] | None = None) -> List[np.ndarray]:
+    # The lowres image is only needed if there is no highres image, since the detection result has its size
+    # line_idxs picks which detected lines to slice, defaults to all of them
+    polygons = BoxArray.from_boxes(det_pred.bboxes)
+    if line_idxs is not None:
+        polygons = polygons[np.asarray(line_idxs, dtype=np.int64)]
+    if len(polygons) == 0:
+        return []
+
+    if highres_image:
+        polygons = polygons.rescale(det_pred.image_bbox[2:], highres_image.size)
+        return slice_polys_from_array(np.asarray(highres_image, dtype=np.uint8), polygons.polygons)
+    return slice_polys_from_array(np.asarray(image, dtype=np.uint8), polygons.polygons)
+
+
+def get_ocr_result(det_pred: TextDetectionResult, lang: List[str] | None, image_lines: List[str], line_confidences: List[float], line_sources: List[str] | None = None) -> OCRResult:
+    assert len(image_lines) == len(det_pred.bboxes)
+    if line_sources is None:
+        line_sources = ["ocr"] * len(image_lines)
+
+    lines = []
+    for text_line, confidence, source, bbox in zip(image_lines, line_confidences, line_sources, det_pred.bboxes):
+        lines.append(TextLine(
+            text=text_line,
+            polygon=bbox.polygon,
+            bbox=bbox.bbox,
+            confidence=confidence,
+            source=source
+        ))
 
-    all_slices = []  # 存储所有图像的文本区域切片
-    slice_map = []   # 记录每张图像的文本区域数量
-    all_langs = []   # 存储所有文本区域对应的语言
-
-    # 遍历每张图像及其对应的检测结果、高分辨率图像(如果有)和语言
-    for idx, (det_pred, image, highres_image, lang) in enumerate(zip(det_predictions, images, highres_images, langs)):
-        # 获取检测到的多边形区域
-        polygons = [p.polygon for p in det_pred.bboxes]
-        if highres_image:
-            # 如果有高分辨率图像,计算缩放比例
-            width_scaler = highres_image.size[0] / image.size[0]
-            height_scaler = highres_image.size[1] / image.size[1]
-            # 将多边形坐标缩放到高分辨率图像的尺寸
-            scaled_polygons = [[[int(p[0] * width_scaler), int(p[1] * height_scaler)] for p in polygon] for polygon in polygons]
-            # 从高分辨率图像中切割文本区域
-            slices = slice_polys_from_image(highres_image, scaled_polygons)
-        else:
-            # 如果没有高分辨率图像,直接从原图中切割文本区域
-            slices = slice_polys_from_image(image, polygons)
-        
-        # 记录该图像的文本区域数量
-        slice_map.append(len(slices))
-        # 为每个文本区域添加对应的语言
-        all_langs.extend([lang] * len(slices))
-        # 将该图像的所有文本区域切片添加到总列表中
-        all_slices.extend(slices)
+    lines = sort_text_lines(lines)
+    return OCRResult(
+        text_lines=lines,
+        languages=lang,
+        image_bbox=det_pred.image_bbox
+    )
 
-    # 对所有文本区域进行批量识别
-    rec_predictions, confidence_scores = batch_recognition(all_slices, all_langs, rec_model, rec_processor, batch_size=batch_size)
 
-    predictions_by_image = []  # 存储每张图像的OCR结果
-    slice_start = 0  # 记录当前图像的文本区域在总列表中的起始位置
-    # 遍历每张图像及其对应的检测结果和语言
-    for idx, (image, det_pred, lang) in enumerate(zip(images, det_predictions, langs)):
-        # 计算当前图像的文本区域在总列表中的结束位置
-        slice_end = slice_start + slice_map[idx]
-        # 获取当前图像的文本识别结果和置信度
-        image_lines = rec_predictions[slice_start:slice_end]
-        line_confidences = confidence_scores[slice_start:slice_end]
-        # 更新下一张图像的起始位置
+def get_trusted_text(det_predictions: List[TextDetectionResult], text_lines: List[dict | None]) -> List[List[tuple | None]]:
+    # For each page, (text, score) for the lines whose PDF text layer can be used as is, None for lines that need OCR
+    from surya.input.pdflines import get_trusted_line_text # Putting import here because pypdfium2 causes warnings if its not the top import
+    return [get_trusted_line_text(page_text, [p.polygon for p in det_pred.bboxes]) for det_pred, page_text in zip(det_predictions, text_lines)]
+
+
+def recognize_detected_pages(pages: List[tuple], rec_model, rec_processor, batch_size=None, text_lines: List[dict | None] | None = None, trusted_text: List[List[tuple | None]] | None = None) -> List[OCRResult]:
+    # Each page is a (det_pred, image, highres_image, lang) tuple
+    # text_lines is the optional PDF text layer for each page (see get_page_text_lines), in detection image coordinates.
+    # It is used as a draft for speculative decoding, so it makes recognition faster but doesn't change the output.
+    # trusted_text (see get_trusted_text) has the lines that skip recognition and keep their PDF text.  Pages where every
+    # line is trusted don't need an image.
+    all_slices = []
+    all_langs = []
+    all_drafts = None
+    if text_lines is not None:
+        from surya.input.pdflines import get_line_text_drafts # Putting import here because pypdfium2 causes warnings if its not the top import
+        all_drafts = []
+
+    page_ocr_idxs = []
+    for page_idx, (det_pred, image, highres_image, lang) in enumerate(pages):
+        line_count = len(det_pred.bboxes)
+        page_trusted = trusted_text[page_idx] if trusted_text is not None else [None] * line_count
+        ocr_idxs = [idx for idx in range(line_count) if page_trusted[idx] is None]
+        page_ocr_idxs.append(ocr_idxs)
+        if len(ocr_idxs) == 0:
+            continue
+
+        image = convert_if_not_rgb([image])[0] if image is not None else None
+        highres_image = convert_if_not_rgb([highres_image])[0] if highres_image is not None else None
+        all_slices.extend(slice_detected_lines(det_pred, image, highres_image, line_idxs=ocr_idxs))
+        all_langs.extend([lang] * len(ocr_idxs))
+        if text_lines is not None:
+            page_drafts = get_line_text_drafts(text_lines[page_idx], [p.polygon for p in det_pred.bboxes])
+            all_drafts.extend([page_drafts[idx] for idx in ocr_idxs])
+
+    rec_predictions, confidence_scores = batch_recognition(all_slices, all_langs, rec_model, rec_processor, batch_size=batch_size, drafts=all_drafts)
+    del all_slices
+
+    results = []
+    slice_start = 0
+    for page_idx, ((det_pred, _, _, lang), ocr_idxs) in enumerate(zip(pages, page_ocr_idxs)):
+        line_count = len(det_pred.bboxes)
+        page_trusted = trusted_text[page_idx] if trusted_text is not None else [None] * line_count
+        image_lines = [trusted[0] if trusted is not None else None for trusted in page_trusted]
+        line_confidences = [trusted[1] if trusted is not None else None for trusted in page_trusted]
+        line_sources = ["pdf" if trusted is not None else "ocr" for trusted in page_trusted]
+
+        slice_end = slice_start + len(ocr_idxs)
+        for idx, text, confidence in zip(ocr_idxs, rec_predictions[slice_start:slice_end], confidence_scores[slice_start:slice_end]):
+            image_lines[idx] = text
+            line_confidences[idx] = confidence
         slice_start = slice_end
+        results.append(get_ocr_result(det_pred, lang, image_lines, line_confidences, line_sources))
+    return results
 
-        # 确保识别结果数量与检测到的文本框数量一致
-        assert len(image_lines) == len(det_pred.bboxes)
-
-        lines = []
-        # 将识别结果、置信度和边界框信息组合
-        for text_line, confidence, bbox in zip(image_lines, line_confidences, det_pred.bboxes):
-            lines.append(TextLine(
-                text=text_line,
-                polygon=bbox.polygon,
-                bbox=bbox.bbox,
-                confidence=confidence
-            ))
 
-        # 对文本行进行排序(可能是基于位置)
-        lines = sort_text_lines(lines)
+def run_ocr(images: List[Image.Image], langs: List[List[str] | None], det_model, det_processor, rec_model, rec_processor, batch_size=None, highres_images: List[Image.Image] | None = None, text_lines: List[dict | None] | None = None, reuse_text_layer: bool = False) -> List[OCRResult]:
+    # With reuse_text_layer, lines where the PDF text layer (text_lines) can be trusted use it instead of being recognized
+    images = convert_if_not_rgb(images)
+    highres_images = convert_if_not_rgb(highres_images) if highres_images is not None else [None] * len(images)
+    det_predictions = batch_text_detection(images, det_model, det_processor)
+
+    trusted_text = None
+    if reuse_text_layer and text_lines is not None:
+        trusted_text = get_trusted_text(det_predictions, text_lines)
 
-        # 创建并添加当前图像的OCR结果
-        predictions_by_image.append(OCRResult(
-            text_lines=lines,
-            languages=lang,
-            image_bbox=det_pred.image_bbox
-        ))
+    pages = list(zip(det_predictions, images, highres_images, langs))
+    return recognize_detected_pages(pages, rec_model, rec_processor, batch_size=batch_size, text_lines=text_lines, trusted_text=trusted_text)
 
-    # 返回所有图像的OCR结果
-    return predictions_by_image
+
+def iter_ocr(images: List[Image.Image], langs: List[List[str] | None], det_model, det_processor, rec_model, rec_processor, batch_size=None, highres_images: List[Image.Image] | None = None, max_pages_in_flight: int | None = None, text_lines: List[dict | None] | None = None, reuse_text_layer: bool = False) -> Generator[OCRResult, None, None]:
+    # Streaming version of run_ocr.  Detection results are recognized in windows of max_pages_in_flight pages,
+    # and each OCRResult is yielded in page order as soon as its window is done.
+    # images and highres_images can be lazy page sources (see surya.input.load), pages are only read when needed.
+    assert len(images) == len(langs), "You need to pass in one list of languages for each image"
+    if max_pages_in_flight is None:
+        max_pages_in_flight = settings.RECOGNITION_MAX_PAGES_IN_FLIGHT
+    assert max_pages_in_flight > 0, "max_pages_in_flight must be greater than 0"
+
+    has_highres = highres_images is not None
+    if has_highres:
+        assert len(highres_images) == len(images)
+    if text_lines is not None:
+        assert len(text_lines) == len(images)
+
+    # Keep detection batches no bigger than the window, so we never hold more pages than needed
+    det_batch_size = min(get_detector_batch_size(), max_pages_in_flight)
+    det_generator = iter_text_detection(images, det_model, det_processor, batch_size=det_batch_size)
+
+    def recognize_window(window):
+        pages = []
+        window_text_lines = [text_lines[page_idx] for page_idx, _ in window] if text_lines is not None else None
+        trusted_text = None
+        if reuse_text_layer and window_text_lines is not None:
+            trusted_text = get_trusted_text([det_pred for _, det_pred in window], window_text_lines)
+
+        for window_idx, (page_idx, det_pred) in enumerate(window):
+            # Only render the pages we need - highres pages for pages with lines to recognize, lowres pages if there is no highres version
+            has_lines = len(det_pred.bboxes) > 0
+            if trusted_text is not None:
+                has_lines = any([trusted is None for trusted in trusted_text[window_idx]])
+            highres_image = highres_images[page_idx] if has_highres and has_lines else None
+            image = images[page_idx] if not has_highres and has_lines else None
+            pages.append((det_pred, image, highres_image, langs[page_idx]))
+        return recognize_detected_pages(pages, rec_model, rec_processor, batch_size=batch_size, text_lines=window_text_lines, trusted_text=trusted_text)
+
+    pending_pages = []
+    for page_idx, det_pred in enumerate(det_generator):
+        pending_pages.append((page_idx, det_pred))
+        if len(pending_pages) >= max_pages_in_flight:
+            yield from recognize_window(pending_pages)
+            pending_pages = []
+
+    if len(pending_pages) > 0:
+        yield from recognize_window(pending_pages)
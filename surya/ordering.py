@@ -1,10 +1,10 @@
 from copy import deepcopy
-from typing import List
+from typing import List, Tuple, Dict
 import torch
 from PIL import Image
 
 from surya.model.ordering.encoderdecoder import OrderVisionEncoderDecoderModel
-from surya.schema import OrderBox, OrderResult
+from surya.schema import OrderBox, OrderResult, ColumnLine
 from surya.settings import settings
 from tqdm import tqdm
 import numpy as np
@@ -31,17 +31,34 @@ def rank_elements(arr):
     return rank
 
 
-def batch_ordering(images: List, bboxes: List[List[List[float]]], model: OrderVisionEncoderDecoderModel, processor, batch_size=None) -> List[OrderResult]:
+def get_step_box_count(engine: str, label_counts: List[int], active_count: int, placed: int, decode_steps: int) -> int:
+    if engine == "autoregressive":
+        return 1
+
+    # Every active row places the same number of boxes, so the step ends on the next page to finish, which is then sliced off.
+    # At least one box per step, or the decode loop never finishes.
+    return min(max(1, settings.ORDER_MULTIBOX_BOXES_PER_STEP), label_counts[active_count - 1] - placed, decode_steps - placed)
+
+
+def batch_ordering(images: List, bboxes: List[List[List[float]]], model: OrderVisionEncoderDecoderModel, processor, batch_size=None, engine=None) -> List[OrderResult]:
     assert all([isinstance(image, Image.Image) for image in images])
     assert len(images) == len(bboxes)
     if batch_size is None:
         batch_size = get_batch_size()
+    if engine is None:
+        engine = settings.ORDER_ENGINE
+    assert engine in ["autoregressive", "multibox"], f"Unknown ordering engine {engine}"
 
 
-    output_order = []
+    # Batch pages with similar box counts, so short pages don't wait for long ones, and there is less padding
+    sorted_idxs = sorted(range(len(images)), key=lambda idx: len(bboxes[idx]), reverse=True)
+
+    output_order = [None] * len(images)
     for i in tqdm(range(0, len(images), batch_size), desc="Finding reading order"):
-        batch_bboxes = deepcopy(bboxes[i:i+batch_size])
-        batch_images = images[i:i+batch_size]
+        batch_idxs = sorted_idxs[i:i+batch_size]
+        # Copied page by page, since the processor rescales boxes in place and a page's boxes can be passed more than once
+        batch_bboxes = [deepcopy(bboxes[idx]) for idx in batch_idxs]
+        batch_images = [images[idx] for idx in batch_idxs]
         batch_images = [image.convert("RGB") for image in batch_images]  # also copies the images
 
         orig_sizes = [image.size for image in batch_images]
@@ -57,83 +74,193 @@ def batch_ordering(images: List, bboxes: List[List[List[float]]], model: OrderVi
         batch_pixel_values = torch.tensor(np.array(batch_pixel_values), dtype=model.dtype).to(model.device)
         batch_bbox_counts = torch.tensor(np.array(batch_bbox_counts), dtype=torch.long).to(model.device)
 
-        token_count = 0
-        past_key_values = None
+        # Each page predicts one box per step (or several with the multibox engine), so it's done after as many steps as it has boxes
+        # Pages are sorted by box count, so the pages still decoding are always the first rows, and finished rows are sliced off
+        label_counts = [len(bboxes[idx]) for idx in batch_idxs]
+        max_label_count = max(label_counts)
+        predictions = torch.zeros((len(batch_idxs), max(max_label_count, 1)), dtype=torch.long, device=model.device)
+        blocked = None # Logits that can't be predicted - positions past the box count, and boxes already predicted
         encoder_outputs = None
-        batch_predictions = [[] for _ in range(len(batch_images))]
-        done = torch.zeros(len(batch_images), dtype=torch.bool, device=model.device)
-
-        with torch.inference_mode():
-            while token_count < settings.ORDER_MAX_BOXES:
-                return_dict = model(
-                    pixel_values=batch_pixel_values,
-                    decoder_input_boxes=batch_bboxes,
-                    decoder_input_boxes_mask=batch_bbox_mask,
-                    decoder_input_boxes_counts=batch_bbox_counts,
-                    encoder_outputs=encoder_outputs,
-                    past_key_values=past_key_values,
-                )
-                logits = return_dict["logits"].detach()
-
-                last_tokens = []
-                last_token_mask = []
-                min_val = torch.finfo(model.dtype).min
-                for j in range(logits.shape[0]):
-                    label_count = batch_bbox_counts[j, 1] - batch_bbox_counts[j, 0] - 1  # Subtract 1 for the sep token
-                    new_logits = logits[j, -1]
-                    new_logits[batch_predictions[j]] = min_val  # Mask out already predicted tokens, we can only predict each token once
-                    new_logits[label_count:] = min_val  # Mask out all logit positions above the number of bboxes
-                    pred = int(torch.argmax(new_logits, dim=-1).item())
-
-                    # Add one to avoid colliding with the 1000 height/width token for bboxes
-                    last_tokens.append([[pred + processor.box_size["height"] + 1] * 4])
-                    if len(batch_predictions[j]) == label_count - 1:  # Minus one since we're appending the final label
-                        last_token_mask.append([0])
-                        batch_predictions[j].append(pred)
-                        done[j] = True
-                    elif len(batch_predictions[j]) < label_count - 1:
-                        last_token_mask.append([1])
-                        batch_predictions[j].append(pred)  # Get rank prediction for given position
+        min_val = torch.finfo(model.dtype).min
+
+        # The decoder keys and values go in static caches, and the box mask is preallocated, so each step writes one
+        # position instead of copying everything decoded so far
+        decode_steps = min(max_label_count, settings.ORDER_MAX_BOXES)
+        prefix_length = batch_bbox_mask.shape[1]
+        full_bbox_mask = torch.ones((batch_bbox_mask.shape[0], prefix_length + decode_steps), dtype=batch_bbox_mask.dtype, device=model.device)
+        full_bbox_mask[:, :prefix_length] = batch_bbox_mask
+        try:
+            model.decoder._setup_cache(len(batch_idxs), prefix_length + decode_steps, model.device, model.dtype)
+            with torch.inference_mode():
+                placed = 0
+                while placed < decode_steps:
+                    active_count = sum([count > placed for count in label_counts])
+                    step_box_count = get_step_box_count(engine, label_counts, active_count, placed, decode_steps)
+                    if active_count < batch_bboxes.shape[0]:
+                        if encoder_outputs is None:
+                            batch_pixel_values = batch_pixel_values[:active_count] # Pages without boxes
+                        else:
+                            encoder_outputs = (encoder_outputs[0][:active_count],)
+                        batch_bboxes = batch_bboxes[:active_count]
+                        batch_bbox_counts = batch_bbox_counts[:active_count]
+
+                    # The caches are sliced to the first rows inside the decoder
+                    return_dict = model(
+                        pixel_values=batch_pixel_values,
+                        decoder_input_boxes=batch_bboxes,
+                        decoder_input_boxes_mask=full_bbox_mask[:active_count, :prefix_length + placed],
+                        decoder_input_boxes_counts=batch_bbox_counts,
+                        encoder_outputs=encoder_outputs,
+                    )
+                    logits = return_dict["logits"][:, -1]
+
+                    if blocked is None:
+                        label_count_tensor = torch.tensor(label_counts, dtype=torch.long, device=model.device)
+                        blocked = torch.arange(logits.shape[-1], device=model.device)[None, :] >= label_count_tensor[:, None]
+
+                    # Mask out already predicted boxes and positions above the number of boxes, we can only predict each box once
+                    logits = logits.masked_fill(blocked[:active_count], min_val)
+                    if step_box_count == 1:
+                        preds = torch.argmax(logits, dim=-1)[:, None]
                     else:
-                        last_token_mask.append([0])
+                        # Multibox engine - greedily place the step_box_count remaining boxes the pointer logits rank highest for
+                        # the next position, as if the ones after it would have been predicted in the same order
+                        preds = torch.topk(logits, step_box_count, dim=-1).indices
+                    predictions[:active_count, placed:placed + step_box_count] = preds
+                    blocked[:active_count].scatter_(1, preds, True)
+                    placed += step_box_count
 
-                if done.all():
-                    break
+                    encoder_outputs = (return_dict["encoder_last_hidden_state"],)
 
-                past_key_values = return_dict["past_key_values"]
-                encoder_outputs = (return_dict["encoder_last_hidden_state"],)
-
-                batch_bboxes = torch.tensor(last_tokens, dtype=torch.long).to(model.device)
-                token_bbox_mask = torch.tensor(last_token_mask, dtype=torch.long).to(model.device)
-                batch_bbox_mask = torch.cat([batch_bbox_mask, token_bbox_mask], dim=1)
-                token_count += 1
+                    # Add one to avoid colliding with the 1000 height/width token for bboxes
+                    batch_bboxes = (preds + processor.box_size["height"] + 1)[:, :, None].expand(-1, -1, 4)
+        finally:
+            # The decoder is shared, so it always goes back to the tuple cache path
+            model.decoder._clear_cache()
 
+        batch_predictions = [row[:count] for row, count in zip(predictions.tolist(), label_counts)]
         for j, row_pred in enumerate(batch_predictions):
-            row_bboxes = bboxes[i+j]
+            row_bboxes = bboxes[batch_idxs[j]]
             assert len(row_pred) == len(row_bboxes), f"Mismatch between logits and bboxes. Logits: {len(row_pred)}, Bboxes: {len(row_bboxes)}"
 
-            orig_size = orig_sizes[j]
-            ranks = [0] * len(row_bboxes)
-
-            for box_idx in range(len(row_bboxes)):
-                ranks[row_pred[box_idx]] = box_idx
-
-            order_boxes = []
-            for row_bbox, rank in zip(row_bboxes, ranks):
-                order_box = OrderBox(
-                    bbox=row_bbox,
-                    position=rank,
-                )
-                order_boxes.append(order_box)
-
-            result = OrderResult(
-                bboxes=order_boxes,
-                image_bbox=[0, 0, orig_size[0], orig_size[1]],
-            )
-            output_order.append(result)
+            output_order[batch_idxs[j]] = get_order_result(row_bboxes, row_pred, orig_sizes[j])
     return output_order
 
 
+def get_order_result(row_bboxes: List[List[float]], row_pred: List[int], orig_size) -> OrderResult:
+    # row_pred is the box index at each position in the reading order
+    ranks = [0] * len(row_bboxes)
+
+    for box_idx in range(len(row_bboxes)):
+        ranks[row_pred[box_idx]] = box_idx
+
+    order_boxes = []
+    for row_bbox, rank in zip(row_bboxes, ranks):
+        order_box = OrderBox(
+            bbox=row_bbox,
+            position=rank,
+        )
+        order_boxes.append(order_box)
+
+    return OrderResult(
+        bboxes=order_boxes,
+        image_bbox=[0, 0, orig_size[0], orig_size[1]],
+    )
+
+
+def get_layout_complexity(bboxes: List[List[float]], vertical_lines: List[ColumnLine] | None = None, min_overlap=.5) -> float:
+    # Share of the box area in boxes that sit side by side with another box - multiple columns, sidebars, tables.  0 for a single
+    # column page, and small for a single column page with a running header and page number.
+    # Boxes are side by side when they don't overlap horizontally, and overlap vertically by min_overlap of the shorter box.
+    if len(bboxes) < 2:
+        return 0.
+
+    boxes = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+    heights = boxes[:, 3] - boxes[:, 1]
+    y_overlap = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    x_apart = (boxes[:, None, 2] <= boxes[None, :, 0]) | (boxes[None, :, 2] <= boxes[:, None, 0])
+    side_by_side = np.any(x_apart & (y_overlap > min_overlap * np.minimum(heights[:, None], heights[None, :])), axis=1)
+
+    # Column lines (see get_vertical_lines) with boxes on both sides of them
+    for line in vertical_lines or []:
+        in_span = (boxes[:, 1] < line.bbox[3]) & (boxes[:, 3] > line.bbox[1])
+        left = in_span & (boxes[:, 2] <= line.bbox[0])
+        right = in_span & (boxes[:, 0] >= line.bbox[2])
+        if left.any() and right.any():
+            side_by_side |= left | right
+
+    areas = np.maximum(heights, 0) * np.maximum(boxes[:, 2] - boxes[:, 0], 0)
+    if areas.sum() == 0:
+        return float(side_by_side.mean())
+    return float(areas[side_by_side].sum() / areas.sum())
+
+
+def xy_cut_order(bboxes: List[List[float]]) -> List[int]:
+    # Recursive XY-cut - split the boxes into bands at horizontal gaps, then each band into columns at vertical gaps, and
+    # so on.  Returns the box index at each position in the reading order, like batch_ordering predicts.
+    def cut(idxs, horizontal, tried_other=False):
+        if len(idxs) <= 1:
+            return idxs
+
+        start_dim, end_dim = (1, 3) if horizontal else (0, 2)
+        idxs = sorted(idxs, key=lambda idx: (bboxes[idx][start_dim], bboxes[idx][end_dim]))
+        groups = [[idxs[0]]]
+        group_end = bboxes[idxs[0]][end_dim]
+        for idx in idxs[1:]:
+            if bboxes[idx][start_dim] >= group_end:
+                groups.append([])
+            groups[-1].append(idx)
+            group_end = max(group_end, bboxes[idx][end_dim])
+
+        if len(groups) == 1:
+            if tried_other:
+                # No gap either way, fall back to top to bottom, left to right
+                return sorted(idxs, key=lambda idx: (bboxes[idx][1], bboxes[idx][0]))
+            return cut(idxs, not horizontal, tried_other=True)
+        return [idx for group in groups for idx in cut(group, not horizontal)]
+
+    return cut(list(range(len(bboxes))), horizontal=True)
+
+
+def tiered_ordering(
+        images: List,
+        bboxes: List[List[List[float]]],
+        model: OrderVisionEncoderDecoderModel,
+        processor,
+        vertical_lines: List[List[ColumnLine]] | None = None,
+        max_complexity=None,
+        batch_size=None,
+        engine=None
+) -> Tuple[List[OrderResult], Dict]:
+    # Simple pages are ordered by xy_cut_order, and only complex pages (see get_layout_complexity) go to batch_ordering.
+    # vertical_lines are the column lines for each page, from TextDetectionResult.vertical_lines.
+    assert len(images) == len(bboxes)
+    if max_complexity is None:
+        max_complexity = settings.ORDER_HEURISTIC_MAX_COMPLEXITY
+    if vertical_lines is None:
+        vertical_lines = [None] * len(images)
+
+    complexities = [get_layout_complexity(page_bboxes, page_lines) for page_bboxes, page_lines in zip(bboxes, vertical_lines)]
+    model_idxs = [idx for idx, complexity in enumerate(complexities) if complexity > max_complexity]
+
+    output_order = [None] * len(images)
+    if len(model_idxs) > 0:
+        model_results = batch_ordering([images[idx] for idx in model_idxs], [bboxes[idx] for idx in model_idxs], model, processor, batch_size=batch_size, engine=engine)
+        for idx, result in zip(model_idxs, model_results):
+            output_order[idx] = result
+
+    for idx, result in enumerate(output_order):
+        if result is None:
+            output_order[idx] = get_order_result(bboxes[idx], xy_cut_order(bboxes[idx]), images[idx].size)
+
+    stats = {
+        "heuristic": len(images) - len(model_idxs),
+        "model": len(model_idxs),
+        "complexity": complexities
+    }
+    return output_order, stats
+
+
 
 
 
@@ -26,7 +26,11 @@ def get_detected_lines_sobel(image, vertical=True):
 
     # Convert to 8-bit image
     scaled_sobel = np.uint8(255 * abs_sobelx / np.max(abs_sobelx))
+    return clean_sobel_lines(scaled_sobel)
 
+
+def clean_sobel_lines(scaled_sobel):
+    # Erode and dilate with a tall kernel, so only long runs of edges are left
     kernel = np.ones((20, 1), np.uint8)
     eroded = cv2.erode(scaled_sobel, kernel, iterations=1)
     scaled_sobel = cv2.dilate(eroded, kernel, iterations=3)
@@ -39,8 +43,10 @@ def get_detected_lines(image, slope_tol_deg=2, vertical=False, horizontal=False)
     new_image = image.astype(np.float32) * 255  # Convert to 0-255 range
     if vertical or horizontal:
         new_image = get_detected_lines_sobel(new_image, vertical)
-    new_image = new_image.astype(np.uint8)
+    return get_hough_lines(new_image.astype(np.uint8), slope_tol_deg, vertical, horizontal)
+
 
+def get_hough_lines(new_image, slope_tol_deg=2, vertical=False, horizontal=False) -> List[ColumnLine]:
     edges = cv2.Canny(new_image, 150, 200, apertureSize=3)
     if vertical:
         max_gap = 100
@@ -100,8 +106,23 @@ def draw_lines_on_image(line_info: List[ColumnLine], img):
     return img
 
 
+def intervals_overlap(start1, end1, start2, end2) -> bool:
+    # Whether the pixel ranges [start1, end1) and [start2, end2) share a pixel
+    return max(int(start1), int(start2)) < min(int(end1), int(end2))
+
+
 def get_vertical_lines(image, processor_size, image_size, divisor=20, x_tolerance=40, y_tolerance=20) -> List[ColumnLine]:
     vertical_lines = get_detected_lines(image, vertical=True)
+    return merge_vertical_lines(vertical_lines, processor_size, image_size, divisor, x_tolerance, y_tolerance)
+
+
+def get_vertical_lines_from_sobel(scaled_sobel, processor_size, image_size, divisor=20, x_tolerance=40, y_tolerance=20) -> List[ColumnLine]:
+    # Same as get_vertical_lines, from the 8-bit horizontal sobel image of the affinity map (see DetectionMaps)
+    vertical_lines = get_hough_lines(clean_sobel_lines(scaled_sobel), vertical=True)
+    return merge_vertical_lines(vertical_lines, processor_size, image_size, divisor, x_tolerance, y_tolerance)
+
+
+def merge_vertical_lines(vertical_lines: List[ColumnLine], processor_size, image_size, divisor=20, x_tolerance=40, y_tolerance=20) -> List[ColumnLine]:
     for line in vertical_lines:
         line.rescale_bbox(processor_size, image_size)
     vertical_lines = sorted(vertical_lines, key=lambda x: x.bbox[0])
@@ -109,54 +130,47 @@ def get_vertical_lines(image, processor_size, image_size, divisor=20, x_toleranc
         line.round_bbox(divisor)
 
     # Merge adjacent line segments together
-    to_remove = []
-    for i, line in enumerate(vertical_lines):
-        for j, line2 in enumerate(vertical_lines):
-            if j <= i:
-                continue
-            if line.bbox[0] != line2.bbox[0]:
-                continue
-
-            expanded_line1 = [line.bbox[0], line.bbox[1] - y_tolerance, line.bbox[2],
-                              line.bbox[3] + y_tolerance]
-
-            line1_points = set(range(int(expanded_line1[1]), int(expanded_line1[3])))
-            line2_points = set(range(int(line2.bbox[1]), int(line2.bbox[3])))
-            intersect_y = len(line1_points.intersection(line2_points)) > 0
-
-            if intersect_y:
-                vertical_lines[j].bbox[1] = min(line.bbox[1], line2.bbox[1])
-                vertical_lines[j].bbox[3] = max(line.bbox[3], line2.bbox[3])
-                to_remove.append(i)
-
-    vertical_lines = [line for i, line in enumerate(vertical_lines) if i not in to_remove]
+    # Lines are sorted by x, so each line is only compared to the later lines in its x bucket (or within x_tolerance below).
+    # Lines are merged in the same order as before, with the y overlap of the pixel ranges [y1, y2) checked as intervals.
+    bboxes = [line.bbox for line in vertical_lines]
+    removed = [False] * len(bboxes)
+    for i, bbox in enumerate(bboxes):
+        for j in range(i + 1, len(bboxes)):
+            bbox2 = bboxes[j]
+            if bbox[0] != bbox2[0]:
+                break
+
+            if intervals_overlap(bbox[1] - y_tolerance, bbox[3] + y_tolerance, bbox2[1], bbox2[3]):
+                bbox2[1] = min(bbox[1], bbox2[1])
+                bbox2[3] = max(bbox[3], bbox2[3])
+                removed[i] = True
+
+    vertical_lines = [line for line, is_removed in zip(vertical_lines, removed) if not is_removed]
 
     # Remove redundant segments
-    to_remove = []
-    for i, line in enumerate(vertical_lines):
-        if i in to_remove:
+    bboxes = [line.bbox for line in vertical_lines]
+    removed = [False] * len(bboxes)
+    for i, bbox in enumerate(bboxes):
+        if removed[i]:
             continue
-        for j, line2 in enumerate(vertical_lines):
-            if j <= i or j in to_remove:
+        for j in range(i + 1, len(bboxes)):
+            bbox2 = bboxes[j]
+            if bbox2[0] - bbox[0] >= x_tolerance:
+                break
+            if removed[j] or not intervals_overlap(bbox[1], bbox[3], bbox2[1], bbox2[3]):
                 continue
-            close_in_x = abs(line.bbox[0] - line2.bbox[0]) < x_tolerance
-            line1_points = set(range(int(line.bbox[1]), int(line.bbox[3])))
-            line2_points = set(range(int(line2.bbox[1]), int(line2.bbox[3])))
-
-            intersect_y = len(line1_points.intersection(line2_points)) > 0
-
-            if close_in_x and intersect_y:
-                # Keep the longer line and extend it
-                if len(line2_points) > len(line1_points):
-                    vertical_lines[j].bbox[1] = min(line.bbox[1], line2.bbox[1])
-                    vertical_lines[j].bbox[3] = max(line.bbox[3], line2.bbox[3])
-                    to_remove.append(i)
-                else:
-                    vertical_lines[i].bbox[1] = min(line.bbox[1], line2.bbox[1])
-                    vertical_lines[i].bbox[3] = max(line.bbox[3], line2.bbox[3])
-                    to_remove.append(j)
-
-    vertical_lines = [line for i, line in enumerate(vertical_lines) if i not in to_remove]
+
+            # Keep the longer line and extend it
+            if max(0, int(bbox2[3]) - int(bbox2[1])) > max(0, int(bbox[3]) - int(bbox[1])):
+                bbox2[1] = min(bbox[1], bbox2[1])
+                bbox2[3] = max(bbox[3], bbox2[3])
+                removed[i] = True
+            else:
+                bbox[1] = min(bbox[1], bbox2[1])
+                bbox[3] = max(bbox[3], bbox2[3])
+                removed[j] = True
+
+    vertical_lines = [line for line, is_removed in zip(vertical_lines, removed) if not is_removed]
 
     if len(vertical_lines) > 0:
         # Always start with top left of page
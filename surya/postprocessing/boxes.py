@@ -0,0 +1,107 @@
+from typing import List, Sequence
+
+import numpy as np
+
+from surya.schema import PolygonBox
+
+
+class BoxArray:
+    """
+    Polygons for many boxes as one (N, 4, 2) float32 array, with optional confidences, so postprocessing can rescale, clip
+    and compare whole pages of boxes at once.  Converted to schema objects (PolygonBox, LayoutBox, ...) only when results
+    are returned.
+
+    integer is set once the corners have been rounded to pixels (by rescale), and they're returned as ints, like
+    PolygonBox.rescale does.
+    """
+
+    def __init__(self, polygons, confidences=None, integer: bool = False):
+        self.polygons = np.asarray(polygons, dtype=np.float32).reshape(-1, 4, 2)
+        if confidences is None:
+            confidences = np.full(len(self.polygons), np.nan)
+        self.confidences = np.array([np.nan if c is None else c for c in confidences], dtype=np.float64).reshape(-1)
+        assert len(self.confidences) == len(self.polygons)
+        self.integer = integer
+
+    @classmethod
+    def from_boxes(cls, boxes: Sequence[PolygonBox]) -> "BoxArray":
+        return cls([box.polygon for box in boxes], [box.confidence for box in boxes])
+
+    @classmethod
+    def concatenate(cls, arrays: List["BoxArray"]) -> "BoxArray":
+        if len(arrays) == 0:
+            return cls([])
+        return cls(
+            np.concatenate([a.polygons for a in arrays]),
+            np.concatenate([a.confidences for a in arrays]),
+            integer=all([a.integer for a in arrays])
+        )
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def __getitem__(self, idxs) -> "BoxArray":
+        # Index array or boolean mask
+        return BoxArray(self.polygons[idxs], self.confidences[idxs], integer=self.integer)
+
+    @property
+    def bboxes(self) -> np.ndarray:
+        # (N, 4) x1, y1, x2, y2, taken from the same corners as PolygonBox.bbox
+        polygons = self.polygons.astype(np.float64)
+        xs = polygons[:, [0, 1], 0]
+        ys = polygons[:, [0, 2], 1]
+        return np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+
+    @property
+    def areas(self) -> np.ndarray:
+        bboxes = self.bboxes
+        return (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+
+    def rescale(self, processor_size, image_size) -> "BoxArray":
+        # Same as PolygonBox.rescale, corners are scaled and truncated to ints
+        page_width, page_height = processor_size
+        img_width, img_height = image_size
+        scalers = np.array([img_width / page_width, img_height / page_height])
+        polygons = np.trunc(self.polygons.astype(np.float64) * scalers)
+        return BoxArray(polygons, self.confidences, integer=True)
+
+    def fit_to_bounds(self, bounds) -> "BoxArray":
+        polygons = self.polygons.copy()
+        polygons[:, :, 0] = np.minimum(np.maximum(polygons[:, :, 0], bounds[0]), bounds[2])
+        polygons[:, :, 1] = np.minimum(np.maximum(polygons[:, :, 1], bounds[1]), bounds[3])
+        return BoxArray(polygons, self.confidences, integer=self.integer)
+
+    def intersection_areas(self, other: "BoxArray") -> np.ndarray:
+        # (N, M) bbox intersection areas between these boxes and the other boxes
+        a = self.bboxes[:, None, :]
+        b = other.bboxes[None, :, :]
+        x_overlap = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+        y_overlap = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
+        return x_overlap * y_overlap
+
+    def intersection_pct(self, other: "BoxArray") -> np.ndarray:
+        # (N, M) share of each of these boxes covered by each other box, 0 for empty boxes, like PolygonBox.intersection_pct
+        areas = np.broadcast_to(self.areas[:, None], (len(self), len(other)))
+        return np.divide(self.intersection_areas(other), areas, out=np.zeros(areas.shape), where=areas != 0)
+
+    def iou(self, other: "BoxArray") -> np.ndarray:
+        intersections = self.intersection_areas(other)
+        unions = self.areas[:, None] + other.areas[None, :] - intersections
+        return np.divide(intersections, unions, out=np.zeros(unions.shape), where=unions != 0)
+
+    def tolist(self) -> List[List[List[float]]]:
+        if self.integer:
+            return self.polygons.astype(np.int64).tolist()
+        return self.polygons.astype(np.float64).tolist()
+
+    def to_boxes(self, box_type=PolygonBox, validate: bool = False, **fields) -> List[PolygonBox]:
+        # fields are per box lists of any other fields, like labels
+        # Polygons are always 4 corners here, so validation is skipped, unless validate is set.  Validation converts integer
+        # corners to floats, like building the boxes from rescaled polygons does.
+        confidences = [None if np.isnan(c) else c for c in self.confidences.tolist()]
+        construct = box_type if validate else box_type.model_construct
+        boxes = []
+        for idx, (polygon, confidence) in enumerate(zip(self.tolist(), confidences)):
+            box_fields = {name: values[idx] for name, values in fields.items()}
+            boxes.append(construct(polygon=polygon, confidence=confidence, **box_fields))
+        return boxes
@@ -4,59 +4,78 @@ import numpy as np
 import cv2
 from PIL import ImageDraw, ImageFont
 
+from surya.postprocessing.boxes import BoxArray
 from surya.postprocessing.fonts import get_font_path
 from surya.schema import PolygonBox
 from surya.settings import settings
 from surya.postprocessing.text import get_text_size
 
 
+def get_vertical_candidates(bboxes: np.ndarray, inclusive: bool = True):
+    # Sweep over the boxes sorted by top edge.  Returns index pairs (a, b), a != b, where b's top edge is inside a's vertical
+    # span - [y1, y2] if inclusive, else [y1, y2).  Any box contained in a is a b, and any two boxes that overlap vertically
+    # are a pair in at least one order.  Lines mostly don't overlap vertically, so this is close to linear instead of all pairs.
+    order = np.argsort(bboxes[:, 1], kind="stable")
+    tops = bboxes[order, 1]
+    starts = np.searchsorted(tops, bboxes[:, 1], side="left")
+    ends = np.searchsorted(tops, bboxes[:, 3], side="right" if inclusive else "left")
+    counts = np.maximum(ends - starts, 0)
+
+    a = np.repeat(np.arange(len(bboxes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = order[np.repeat(starts, counts) + offsets]
+
+    different = a != b
+    return a[different], b[different]
+
+
+def get_largest_box_mask(boxes: BoxArray) -> np.ndarray:
+    # Drops boxes that are more than 90% covered by a larger box
+    bboxes = boxes.bboxes
+    areas = boxes.areas
+
+    # Boxes can only cover each other if they overlap vertically, so check the candidate pairs both ways
+    a, b = get_vertical_candidates(bboxes, inclusive=False)
+    outer, inner = np.concatenate([a, b]), np.concatenate([b, a])
+
+    x_overlap = np.maximum(0, np.minimum(bboxes[inner, 2], bboxes[outer, 2]) - np.maximum(bboxes[inner, 0], bboxes[outer, 0]))
+    y_overlap = np.maximum(0, np.minimum(bboxes[inner, 3], bboxes[outer, 3]) - np.maximum(bboxes[inner, 1], bboxes[outer, 1]))
+    inner_areas = areas[inner]
+    overlap = np.divide(x_overlap * y_overlap, inner_areas, out=np.zeros_like(inner_areas), where=inner_areas != 0)
+
+    covered = (overlap > .9) & (inner_areas < areas[outer])
+    keep = np.ones(len(boxes), dtype=bool)
+    keep[inner[covered]] = False
+    return keep
+
+
+def get_clean_box_mask(boxes: BoxArray) -> np.ndarray:
+    # Drops flat boxes, and boxes fully inside a different box
+    polygons = boxes.polygons
+    flat = (np.ptp(polygons[:, :, 0], axis=1) == 0) | (np.ptp(polygons[:, :, 1], axis=1) == 0)
+
+    bboxes = boxes.bboxes
+    outer, inner = get_vertical_candidates(bboxes, inclusive=True)
+    inside = (
+        (bboxes[inner, 0] >= bboxes[outer, 0]) &
+        (bboxes[inner, 1] >= bboxes[outer, 1]) &
+        (bboxes[inner, 2] <= bboxes[outer, 2]) &
+        (bboxes[inner, 3] <= bboxes[outer, 3]) &
+        np.any(bboxes[inner] != bboxes[outer], axis=1)
+    )
+    keep = ~flat
+    keep[inner[inside]] = False
+    return keep
+
+
 def keep_largest_boxes(boxes: List[PolygonBox]) -> List[PolygonBox]:
-    new_boxes = []
-    for box_obj in boxes:
-        box = box_obj.bbox
-        box_area = (box[2] - box[0]) * (box[3] - box[1])
-        contained = False
-        for other_box_obj in boxes:
-            if other_box_obj.polygon == box_obj.polygon:
-                continue
-
-            other_box = other_box_obj.bbox
-            other_box_area = (other_box[2] - other_box[0]) * (other_box[3] - other_box[1])
-            if box == other_box:
-                continue
-            # find overlap percentage
-            overlap = box_obj.intersection_pct(other_box_obj)
-            if overlap > .9 and box_area < other_box_area:
-                contained = True
-                break
-        if not contained:
-            new_boxes.append(box_obj)
-    return new_boxes
+    keep = get_largest_box_mask(BoxArray.from_boxes(boxes))
+    return [box for box, keep_box in zip(boxes, keep) if keep_box]
 
 
 def clean_boxes(boxes: List[PolygonBox]) -> List[PolygonBox]:
-    new_boxes = []
-    for box_obj in boxes:
-        xs = [point[0] for point in box_obj.polygon]
-        ys = [point[1] for point in box_obj.polygon]
-        if max(xs) == min(xs) or max(ys) == min(ys):
-            continue
-
-        box = box_obj.bbox
-        contained = False
-        for other_box_obj in boxes:
-            if other_box_obj.polygon == box_obj.polygon:
-                continue
-
-            other_box = other_box_obj.bbox
-            if box == other_box:
-                continue
-            if box[0] >= other_box[0] and box[1] >= other_box[1] and box[2] <= other_box[2] and box[3] <= other_box[3]:
-                contained = True
-                break
-        if not contained:
-            new_boxes.append(box_obj)
-    return new_boxes
+    keep = get_clean_box_mask(BoxArray.from_boxes(boxes))
+    return [box for box, keep_box in zip(boxes, keep) if keep_box]
 
 
 def get_dynamic_thresholds(linemap, text_threshold, low_text, typical_top10_avg=0.7):
@@ -64,6 +83,11 @@ def get_dynamic_thresholds(linemap, text_threshold, low_text, typical_top10_avg=
     flat_map = linemap.ravel()
     top_10_count = int(len(flat_map) * 0.9)
     avg_intensity = np.mean(np.partition(flat_map, top_10_count)[top_10_count:])
+    return scale_dynamic_thresholds(avg_intensity, text_threshold, low_text, typical_top10_avg)
+
+
+def scale_dynamic_thresholds(avg_intensity, text_threshold, low_text, typical_top10_avg=0.7):
+    # Scale the thresholds down for faint heatmaps, based on the average intensity of the top 10% pixels
     scaling_factor = np.clip(avg_intensity / typical_top10_avg, 0, 1) ** (1 / 2)
 
     low_text = np.clip(low_text * scaling_factor, 0.1, 0.6)
@@ -72,26 +96,48 @@ def get_dynamic_thresholds(linemap, text_threshold, low_text, typical_top10_avg=
     return text_threshold, low_text
 
 
+def get_component_maxes(linemap, labels, label_count) -> np.ndarray:
+    # Max of linemap over each connected component (0 is the background), in one pass over the labeled pixels
+    flat_labels = labels.ravel()
+    foreground = flat_labels > 0
+    component_maxes = np.full(label_count, -np.inf, dtype=linemap.dtype)
+    np.maximum.at(component_maxes, flat_labels[foreground], linemap.ravel()[foreground])
+    return component_maxes
+
+
 def detect_boxes(linemap, text_threshold, low_text):
     # From CRAFT - https://github.com/clovaai/CRAFT-pytorch
     # Modified to return boxes and for speed, accuracy
-    img_h, img_w = linemap.shape
-
     text_threshold, low_text = get_dynamic_thresholds(linemap, text_threshold, low_text)
 
     text_score_comb = (linemap > low_text).astype(np.uint8)
     label_count, labels, stats, centroids = cv2.connectedComponentsWithStats(text_score_comb, connectivity=4)
+    line_maxes = get_component_maxes(linemap, labels, label_count)
+    return get_component_boxes(labels, stats, line_maxes, text_threshold)
+
+
+def detect_boxes_from_seeds(text_mask, seed_coords, seed_values, text_threshold):
+    # Same as detect_boxes, for a heatmap that was thresholded elsewhere (see DetectionMaps).  text_mask is the uint8 map
+    # of pixels above low_text, and the seeds are the (y, x) coordinates and values of the pixels at or above text_threshold.
+    # Components without seeds are below the threshold anyway, so the seeds are enough to find each component's max.
+    label_count, labels, stats, centroids = cv2.connectedComponentsWithStats(text_mask, connectivity=4)
+    line_maxes = np.full(label_count, -np.inf, dtype=np.float32)
+    np.maximum.at(line_maxes, labels[seed_coords[:, 0], seed_coords[:, 1]], seed_values)
+    return get_component_boxes(labels, stats, line_maxes, text_threshold)
+
+
+def get_component_boxes(labels, stats, line_maxes, text_threshold):
+    img_h, img_w = labels.shape
+
+    # Size and threshold filtering for every component at once, so only the survivors get a mask and a box
+    keep = (stats[:, cv2.CC_STAT_AREA] >= 10) & (line_maxes >= text_threshold)
+    keep[0] = False # Background
 
     det = []
     confidences = []
     max_confidence = 0
 
-    for k in range(1, label_count):
-        # size filtering
-        size = stats[k, cv2.CC_STAT_AREA]
-        if size < 10:
-            continue
-
+    for k in np.flatnonzero(keep):
         # make segmentation map
         x, y, w, h = stats[k, [cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT]]
 
@@ -105,12 +151,7 @@ def detect_boxes(linemap, text_threshold, low_text):
         ex, ey = min(img_w, x + w + niter + buffer), min(img_h, y + h + niter + buffer)
 
         mask = (labels[sy:ey, sx:ex] == k)
-        line_max = np.max(linemap[sy:ey, sx:ex][mask])
-
-        # thresholding
-        if line_max < text_threshold:
-            continue
-
+        line_max = line_maxes[k]
         segmap = mask.astype(np.uint8)
 
         ksize = buffer + niter
@@ -147,7 +188,7 @@ def detect_boxes(linemap, text_threshold, low_text):
     return det, confidences
 
 
-def get_detected_boxes(textmap, text_threshold=None, low_text=None) -> List[PolygonBox]:
+def get_detected_box_array(textmap, text_threshold=None, low_text=None) -> BoxArray:
     if text_threshold is None:
         text_threshold = settings.DETECTOR_TEXT_THRESHOLD
     if low_text is None:
@@ -158,17 +199,24 @@ def get_detected_boxes(textmap, text_threshold=None, low_text=None) -> List[Poly
 
     boxes, confidences = detect_boxes(textmap, text_threshold, low_text)
     # From point form to box form
-    return [PolygonBox(polygon=box, confidence=confidence) for box, confidence in zip(boxes, confidences)]
+    return BoxArray(boxes, confidences)
 
 
-def get_and_clean_boxes(textmap, processor_size, image_size, text_threshold=None, low_text=None) -> List[PolygonBox]:
-    bboxes = get_detected_boxes(textmap, text_threshold, low_text)
-    for bbox in bboxes:
-        bbox.rescale(processor_size, image_size)
-        bbox.fit_to_bounds([0, 0, image_size[0], image_size[1]])
+def get_detected_boxes(textmap, text_threshold=None, low_text=None) -> List[PolygonBox]:
+    return get_detected_box_array(textmap, text_threshold, low_text).to_boxes()
+
+
+def clean_detected_box_array(boxes: BoxArray, processor_size, image_size) -> BoxArray:
+    boxes = boxes.rescale(processor_size, image_size).fit_to_bounds([0, 0, image_size[0], image_size[1]])
+    return boxes[get_clean_box_mask(boxes)]
 
-    bboxes = clean_boxes(bboxes)
-    return bboxes
+
+def get_and_clean_box_array(textmap, processor_size, image_size, text_threshold=None, low_text=None) -> BoxArray:
+    return clean_detected_box_array(get_detected_box_array(textmap, text_threshold, low_text), processor_size, image_size)
+
+
+def get_and_clean_boxes(textmap, processor_size, image_size, text_threshold=None, low_text=None) -> List[PolygonBox]:
+    return get_and_clean_box_array(textmap, processor_size, image_size, text_threshold, low_text).to_boxes()
 
 
 def draw_bboxes_on_image(bboxes, image, labels=None, label_font_size=10, color: str | list = 'red'):
@@ -4,6 +4,10 @@ from PIL import Image
 
 from surya.postprocessing.math.latex import fix_math, contains_math
 from surya.postprocessing.text import truncate_repetitions
+from surya.model.recognition.static_decoder import get_static_decode_engine
+from surya.model.recognition.tokenizer import text_to_utf16_numbers
+from surya.model.recognition.config import TOKEN_OFFSET
+from surya.util.cache import get_recognition_cache
 from surya.settings import settings
 from tqdm import tqdm
 import numpy as np
@@ -21,6 +25,16 @@ def get_batch_size():
     return batch_size
 
 
+def get_done_check_interval():
+    interval = settings.RECOGNITION_DONE_CHECK_INTERVAL
+    if interval is None:
+        interval = 1
+        if settings.TORCH_DEVICE_MODEL == "cuda":
+            interval = 8 # Avoid a host sync on every token
+    # Check at least every step, 0 or less would divide by zero in the decode loops
+    return max(1, interval)
+
+
 def pad_to_batch_size(tensor, batch_size):
     current_batch_size = tensor.shape[0]
     if current_batch_size >= batch_size:
@@ -32,8 +46,103 @@ def pad_to_batch_size(tensor, batch_size):
     return F.pad(tensor, padding, mode='constant', value=0)
 
 
-def batch_recognition(images: List, languages: List[List[str] | None], model, processor, batch_size=None):
-    assert all([isinstance(image, Image.Image) for image in images])
+def get_image_width(image):
+    return image.shape[1] if isinstance(image, np.ndarray) else image.width
+
+
+def convert_line_image(image):
+    # Line slices can be RGB arrays (see slice_polys_from_array), which skip the PIL round trip
+    if isinstance(image, np.ndarray):
+        return image
+    return image.convert("RGB")  # also copies the images
+
+
+# Rough characters (= tokens, one per UTF-16 code unit) per line height of width.  Latin glyphs are about half as wide as
+# they are tall, while CJK glyphs are square.
+DEFAULT_CHARS_PER_ASPECT = 2.0
+LANGUAGE_CHARS_PER_ASPECT = {
+    "zh": 1.0,
+    "ja": 1.0,
+    "ko": 1.0,
+}
+MATH_TOKEN_MULTIPLIER = 2.5 # LaTeX takes several tokens per rendered symbol
+
+
+def estimate_token_count(image, langs: List[str] | None) -> float:
+    if isinstance(image, np.ndarray):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+
+    # Tall lines are rotated before recognition, see SuryaImageProcessor.align_long_axis
+    aspect = max(width, height) / max(min(width, height), 1)
+
+    langs = langs or []
+    text_langs = [lang for lang in langs if lang != "_math"]
+    chars_per_aspect = DEFAULT_CHARS_PER_ASPECT
+    if len(text_langs) > 0:
+        chars_per_aspect = sum([LANGUAGE_CHARS_PER_ASPECT.get(lang, DEFAULT_CHARS_PER_ASPECT) for lang in text_langs]) / len(text_langs)
+
+    token_count = aspect * chars_per_aspect
+    if "_math" in langs:
+        token_count *= MATH_TOKEN_MULTIPLIER
+
+    # Prompt is the start token plus one token per language
+    return min(token_count, settings.RECOGNITION_MAX_TOKENS) + len(langs) + 1
+
+
+def get_recognition_order(images: List, languages: List[List[str] | None]) -> List[int]:
+    if settings.RECOGNITION_LENGTH_BUCKETING:
+        # Group lines by how many tokens they should decode, so batches don't keep stepping after most lines finished
+        keys = [estimate_token_count(image, langs) for image, langs in zip(images, languages)]
+    else:
+        # Sort images by width, so similar length ones go together
+        keys = [get_image_width(image) for image in images]
+    return sorted(range(len(images)), key=lambda idx: keys[idx])
+
+
+def get_pixel_dtype(model):
+    # numpy has no bfloat16, so only float16 models get their pixels preprocessed at model precision
+    return np.float16 if model.dtype == torch.float16 else np.float32
+
+
+def pixel_values_to_tensor(pixel_values: np.ndarray, model):
+    # The processor returns one contiguous (N, 3, H, W) batch, which torch wraps without a copy
+    return torch.from_numpy(pixel_values).to(device=model.device, dtype=model.dtype)
+
+
+def get_encoder_text_hidden_states(model, batch_pixel_values, encoder_batch_size):
+    encoder_hidden_states = None
+    for z in range(0, batch_pixel_values.shape[0], encoder_batch_size):
+        encoder_pixel_values = batch_pixel_values[z:min(z + encoder_batch_size, batch_pixel_values.shape[0])]
+        encoder_hidden_states_batch = model.encoder(pixel_values=encoder_pixel_values).last_hidden_state
+        if encoder_hidden_states is None:
+            encoder_hidden_states = encoder_hidden_states_batch
+        else:
+            encoder_hidden_states = torch.cat([encoder_hidden_states, encoder_hidden_states_batch], dim=0)
+
+    text_encoder_input_ids = torch.arange(
+        model.text_encoder.config.query_token_count,
+        device=encoder_hidden_states.device,
+        dtype=torch.long
+    ).unsqueeze(0).expand(encoder_hidden_states.size(0), -1)
+
+    encoder_text_hidden_states = model.text_encoder(
+        input_ids=text_encoder_input_ids,
+        cache_position=None,
+        attention_mask=None,
+        encoder_hidden_states=encoder_hidden_states,
+        encoder_attention_mask=None,
+        use_cache=False
+    ).hidden_states
+    return encoder_text_hidden_states
+
+
+def continuous_batch_recognition(images: List, languages: List[List[str] | None], model, processor, batch_size=None):
+    # Keeps batch_size decoding slots busy - when a line finishes, its slot is evicted and the next line starts decoding in it
+    # Prompt tokens are fed one per step, so every row can be at a different position
+    # Lines in the recognition cache, or repeating an earlier line, are looked up when they're preprocessed and never get a slot
+    assert all([isinstance(image, (Image.Image, np.ndarray)) for image in images])
     assert len(images) == len(languages)
 
     if len(images) == 0:
@@ -42,134 +151,619 @@ def batch_recognition(images: List, languages: List[List[str] | None], model, pr
     if batch_size is None:
         batch_size = get_batch_size()
 
-    # Sort images by width, so similar length ones go together
-    sorted_pairs = sorted(enumerate(images), key=lambda x: x[1].width, reverse=False)
+    # Sort images by width, so similar length ones are encoded together
+    sorted_pairs = sorted(enumerate(images), key=lambda x: get_image_width(x[1]), reverse=False)
     indices, images = zip(*sorted_pairs)
     indices = list(indices)
     images = list(images)
+    languages = [languages[idx] for idx in indices]
+
+    max_tokens = settings.RECOGNITION_MAX_TOKENS
+    encoder_batch_size = batch_size // settings.RECOGNITION_ENCODER_BATCH_DIVISOR + 1
+    eos_id, pad_id = processor.tokenizer.eos_id, processor.tokenizer.pad_id
+
+    model.decoder.model._setup_cache(model.config, batch_size, model.device, model.dtype, static_cache=True)
+    model.text_encoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
+
+    batch_predictions = [[] for _ in range(len(images))]
+    batch_scores = [[] for _ in range(len(images))]
+    eos_scores = [0.0] * len(images)
+
+    cache = get_recognition_cache()
+    line_keys = [None] * len(images)
+    first_lines = {}
+    cached_results = {}
+
+    # Lines that have been encoded, but are waiting for a free slot
+    ready_lines = []
+    ready_hidden_states = []
+    ready_prompts = []
+    next_line = 0
+
+    slot_lines = [None] * batch_size
+    slot_encoder_states = None
+    slot_prompts = torch.full((batch_size, max_tokens), pad_id, dtype=torch.long, device=model.device)
+    slot_prompt_lens = torch.ones(batch_size, dtype=torch.long, device=model.device)
+    slot_positions = torch.zeros(batch_size, dtype=torch.long, device=model.device)
+    slot_generated = torch.zeros(batch_size, dtype=torch.long, device=model.device)
+    slot_active = torch.zeros(batch_size, dtype=torch.bool, device=model.device)
+    last_preds = torch.full((batch_size,), pad_id, dtype=torch.long, device=model.device)
+
+    progress = tqdm(total=len(images), desc="Recognizing Text")
+    with torch.no_grad():
+        first_step = True
+        while True:
+            free_slots = [slot for slot, line in enumerate(slot_lines) if line is None]
+
+            # Encode more lines if we don't have enough to fill the free slots
+            while len(ready_lines) < len(free_slots) and next_line < len(images):
+                chunk_lines = list(range(next_line, min(next_line + encoder_batch_size, len(images))))
+                next_line += len(chunk_lines)
+                chunk_images = [convert_line_image(images[line]) for line in chunk_lines]
+                chunk_langs = [languages[line] for line in chunk_lines]
+                processed_chunk = processor(text=[""] * len(chunk_images), images=chunk_images, langs=chunk_langs, dtype=get_pixel_dtype(model))
+                chunk_pixel_values = processed_chunk["pixel_values"]
+                chunk_prompt_langs = processed_chunk["langs"]
+
+                if cache is not None:
+                    run_idxs = []
+                    for idx, (line, pixel_values, langs) in enumerate(zip(chunk_lines, chunk_pixel_values, chunk_langs)):
+                        line_keys[line] = cache.get_key(pixel_values, langs)
+                        if line_keys[line] in first_lines:
+                            continue
+                        first_lines[line_keys[line]] = line
+                        cached = cache.get(line_keys[line])
+                        if cached is None:
+                            run_idxs.append(idx)
+                        else:
+                            cached_results[line] = cached
+
+                    progress.update(len(chunk_lines) - len(run_idxs))
+                    if len(run_idxs) == 0:
+                        continue
+                    chunk_lines = [chunk_lines[idx] for idx in run_idxs]
+                    chunk_pixel_values = chunk_pixel_values[run_idxs]
+                    chunk_prompt_langs = [chunk_prompt_langs[idx] for idx in run_idxs]
+
+                chunk_pixel_values = pixel_values_to_tensor(chunk_pixel_values, model)
+                chunk_hidden_states = get_encoder_text_hidden_states(model, chunk_pixel_values, encoder_batch_size)
+
+                ready_lines.extend(chunk_lines)
+                ready_hidden_states.extend(chunk_hidden_states)
+                ready_prompts.extend([[model.config.decoder_start_token_id] + lang for lang in chunk_prompt_langs])
+
+            # Move waiting lines into free slots
+            fill_slots = free_slots[:len(ready_lines)]
+            if len(fill_slots) > 0:
+                fill_lines = ready_lines[:len(fill_slots)]
+                fill_hidden_states = torch.stack(ready_hidden_states[:len(fill_slots)], dim=0)
+                fill_prompts = ready_prompts[:len(fill_slots)]
+                ready_lines = ready_lines[len(fill_slots):]
+                ready_hidden_states = ready_hidden_states[len(fill_slots):]
+                ready_prompts = ready_prompts[len(fill_slots):]
+
+                if slot_encoder_states is None:
+                    slot_encoder_states = torch.zeros((batch_size,) + fill_hidden_states.shape[1:], dtype=fill_hidden_states.dtype, device=model.device)
+
+                fill_idxs = torch.tensor(fill_slots, dtype=torch.long, device=model.device)
+                slot_encoder_states[fill_idxs] = fill_hidden_states
+                slot_prompts[fill_idxs] = pad_id
+                for slot, prompt in zip(fill_slots, fill_prompts):
+                    slot_prompts[slot, :len(prompt)] = torch.tensor(prompt, dtype=torch.long, device=model.device)
+                slot_prompt_lens[fill_idxs] = torch.tensor([len(p) for p in fill_prompts], dtype=torch.long, device=model.device)
+                slot_positions[fill_idxs] = 0
+                slot_generated[fill_idxs] = 0
+                slot_active[fill_idxs] = True
+
+                # The first step fills the cross attention cache for every slot
+                if not first_step:
+                    model.decoder.model._reset_cache_slots(fill_idxs, fill_hidden_states)
+
+                for slot, line in zip(fill_slots, fill_lines):
+                    slot_lines[slot] = line
+
+            if all(line is None for line in slot_lines):
+                break
+
+            # Rows still in their prompt get the next prompt token, the others get their last prediction
+            in_prompt = slot_positions < slot_prompt_lens
+            prompt_tokens = slot_prompts.gather(1, slot_positions.clamp(max=max_tokens - 1).unsqueeze(1)).squeeze(1)
+            batch_decoder_input = torch.where(in_prompt, prompt_tokens, last_preds).unsqueeze(1)
+
+            return_dict = model.decoder(
+                input_ids=batch_decoder_input,
+                encoder_hidden_states=slot_encoder_states,
+                cache_position=slot_positions.unsqueeze(1),
+                use_cache=True,
+                prefill=False
+            )
+            first_step = False
+
+            logits = return_dict["logits"][:, -1]
+            preds = torch.argmax(logits, dim=-1)
+            scores = torch.max(F.softmax(logits, dim=-1), dim=-1).values
+
+            # The prediction after the last prompt token is the first generated token
+            generating = slot_active & (slot_positions >= slot_prompt_lens - 1)
+            is_eos = (preds == eos_id) | (preds == pad_id)
+            emitted = generating & ~is_eos
+            # Lines get max_tokens minus their prompt length tokens, like decode_batch
+            slot_generated = slot_generated + emitted.long()
+            finished = generating & (is_eos | (slot_generated >= max_tokens - slot_prompt_lens))
+
+            # Finished and empty slots stay in place, so they never write past the end of the cache
+            last_preds = preds
+            slot_active = slot_active & ~finished
+            slot_positions = slot_positions + slot_active.long()
+
+            # Copy the step results to the host in one go, instead of per row
+            step_state = torch.stack([preds, emitted.long(), finished.long(), is_eos.long()], dim=0).tolist()
+            step_scores = scores.float().tolist()
+            step_preds, step_emitted, step_finished, step_eos = step_state
+
+            finished_slots = []
+            for slot, line in enumerate(slot_lines):
+                if line is None:
+                    continue
+                if step_emitted[slot]:
+                    batch_predictions[line].append(step_preds[slot])
+                    batch_scores[line].append(step_scores[slot])
+                elif step_eos[slot] and step_finished[slot]:
+                    eos_scores[line] = step_scores[slot]
+
+                if step_finished[slot]:
+                    finished_slots.append(slot)
+                    slot_lines[slot] = None
+
+            progress.update(len(finished_slots))
+    progress.close()
+
+    detected_text = processor.tokenizer.batch_decode(batch_predictions)
+    detected_text = [truncate_repetitions(dt) for dt in detected_text]
+    has_math = [lang and "_math" in lang for lang in languages]
+    detected_text = [fix_math(text) if math and contains_math(text) else text for text, math in zip(detected_text, has_math)]
+    confidences = [sum(line_scores) / len(line_scores) if len(line_scores) > 0 else eos_score for line_scores, eos_score in zip(batch_scores, eos_scores)]
+
+    if cache is not None:
+        decoded_lines = [line for line in first_lines.values() if line not in cached_results]
+        cache.put_many([(line_keys[line], detected_text[line], confidences[line]) for line in decoded_lines])
+        for line, key in enumerate(line_keys):
+            first_line = first_lines[key]
+            detected_text[line], confidences[line] = cached_results.get(first_line, (detected_text[first_line], confidences[first_line]))
+
+    output_text = sorted(zip(indices, detected_text), key=lambda x: x[0])
+    confidences = sorted(zip(indices, confidences), key=lambda x: x[0])
+    output_text = [text for _, text in output_text]
+    confidences = [conf for _, conf in confidences]
+    return output_text, confidences
 
-    output_text = []
-    confidences = []
-    for i in tqdm(range(0, len(images), batch_size), desc="Recognizing Text"):
-        batch_images = images[i:i+batch_size]
-        batch_images = [image.convert("RGB") for image in batch_images]  # also copies the images
 
-        batch_langs = languages[i:i+batch_size]
-        has_math = [lang and "_math" in lang for lang in batch_langs]
+def decode_batch(model, processor, encoder_text_hidden_states, batch_decoder_input: List[List[int]], batch_size: int):
+    max_input_length = max([len(tokens) for tokens in batch_decoder_input])
+
+    # Pad decoder input to max length if needed, to ensure we can convert to a tensor
+    for token_idx in range(len(batch_decoder_input)):
+        lang_len = len(batch_decoder_input[token_idx])
+        if lang_len < max_input_length:
+            batch_decoder_input[token_idx] = [processor.tokenizer.pad_id] * (max_input_length - lang_len) + batch_decoder_input[token_idx]
+
+    current_batch_size = len(batch_decoder_input)
+    batch_decoder_input = torch.tensor(np.stack(batch_decoder_input, axis=0), dtype=torch.long, device=model.device)
+
+    token_count = 0
+    inference_token_count = batch_decoder_input.shape[-1]
+
+    decoder_position_ids = torch.ones_like(batch_decoder_input[0, :], dtype=torch.int64, device=model.device).cumsum(0) - 1
+    model.decoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
+
+    # Tokens, scores, and the done mask stay on device, and are only copied to host once the batch is finished
+    batch_tokens = torch.full((current_batch_size, settings.RECOGNITION_MAX_TOKENS), processor.tokenizer.pad_id, dtype=torch.long, device=model.device)
+    sequence_scores = torch.zeros((current_batch_size, settings.RECOGNITION_MAX_TOKENS), dtype=torch.float32, device=model.device)
+    token_lengths = torch.zeros(current_batch_size, dtype=torch.long, device=model.device)
+    all_done = torch.zeros(current_batch_size, dtype=torch.bool, device=model.device)
+    step = 0
+
+    with torch.no_grad(): # inference_mode doesn't work with torch.compile
+        if settings.RECOGNITION_STATIC_CACHE:
+            # Pad inputs to max batch size for static cache
+            encoder_text_hidden_states = pad_to_batch_size(encoder_text_hidden_states, batch_size)
+            batch_decoder_input = pad_to_batch_size(batch_decoder_input, batch_size)
+
+        while token_count < settings.RECOGNITION_MAX_TOKENS - 1:
+            is_prefill = token_count == 0
+            #TODO: add attention mask
+            return_dict = model.decoder(
+                input_ids=batch_decoder_input,
+                encoder_hidden_states=encoder_text_hidden_states,
+                cache_position=decoder_position_ids,
+                use_cache=True,
+                prefill=is_prefill
+            )
+
+            decoder_position_ids = decoder_position_ids[-1:] + 1
+            logits = return_dict["logits"][:current_batch_size] # Ignore batch padding
+            aux_logits = return_dict.get("aux_logits", None)
+
+            preds = torch.argmax(logits[:, -1], dim=-1)
+            scores = torch.max(F.softmax(logits[:, -1], dim=-1), dim=-1).values
+            done = (preds == processor.tokenizer.eos_id) | (preds == processor.tokenizer.pad_id)
+            all_done = all_done | done
+
+            # The first token is always scored, after that finished lines score 0 so they drop out of the mean
+            if not is_prefill:
+                scores = scores.masked_fill(all_done, 0)
+            sequence_scores[:, step] = scores
+
+            # Lines only grow until they're done, so predictions are a prefix of each row
+            batch_tokens[:, step] = preds.masked_fill(all_done, processor.tokenizer.pad_id)
+            token_lengths += (~all_done).long()
+            step += 1
+
+            # Checking for early exit syncs with the device, so only do it every few steps
+            if step % get_done_check_interval() == 0 and all_done.all():
+                break
+
+            batch_decoder_input = preds.unsqueeze(1)
+
+            token_count += inference_token_count
+            inference_token_count = batch_decoder_input.shape[-1]
 
-        processed_batch = processor(text=[""] * len(batch_images), images=batch_images, langs=batch_langs)
+            if settings.RECOGNITION_STATIC_CACHE:
+                batch_decoder_input = pad_to_batch_size(batch_decoder_input, batch_size)
 
-        batch_pixel_values = processed_batch["pixel_values"]
-        batch_langs = processed_batch["langs"]
-        batch_decoder_input = [[model.config.decoder_start_token_id] + lang for lang in batch_langs]
-        max_input_length = max([len(tokens) for tokens in batch_decoder_input])
+    sequence_scores = torch.sum(sequence_scores, dim=-1) / torch.sum(sequence_scores != 0, dim=-1)
+    batch_predictions = [tokens[:length] for tokens, length in zip(batch_tokens.tolist(), token_lengths.tolist())]
+    return batch_predictions, sequence_scores
+
+
+def static_decode_batch(model, processor, encoder_text_hidden_states, batch_decoder_input: List[List[int]], batch_size: int):
+    # Same results as decode_batch, but every step has the same shapes, so it runs through the captured/compiled engine step
+    # Rows feed their prompt one token per step at their own position, instead of left padding the prompts, so this needs a
+    # causal decoder to match a prefill
+    assert model.decoder.config.causal, "The static decode engine needs a causal decoder"
+    max_tokens = settings.RECOGNITION_MAX_TOKENS
+    # decode_batch left pads the prompts, and generates until the padded prompt plus the tokens reach max_tokens
+    generation_limit = max_tokens - max([len(prompt) for prompt in batch_decoder_input])
+    eos_id, pad_id = processor.tokenizer.eos_id, processor.tokenizer.pad_id
+    current_batch_size = len(batch_decoder_input)
+    device = model.device
+
+    with torch.no_grad():
+        engine = get_static_decode_engine(model, batch_size, max_tokens, encoder_text_hidden_states)
+        engine.reset(encoder_text_hidden_states)
+
+        prompts = torch.full((batch_size, max_tokens), pad_id, dtype=torch.long, device=device)
+        for row, prompt in enumerate(batch_decoder_input):
+            prompts[row, :len(prompt)] = torch.tensor(prompt, dtype=torch.long, device=device)
+        prompt_lens = torch.ones(batch_size, dtype=torch.long, device=device)
+        prompt_lens[:current_batch_size] = torch.tensor([len(prompt) for prompt in batch_decoder_input], dtype=torch.long, device=device)
+
+        batch_tokens = torch.full((batch_size, max_tokens), pad_id, dtype=torch.long, device=device)
+        sequence_scores = torch.zeros((batch_size, max_tokens), dtype=torch.float32, device=device)
+        token_lengths = torch.zeros(batch_size, dtype=torch.long, device=device)
+        positions = torch.zeros(batch_size, dtype=torch.long, device=device)
+        last_preds = torch.full((batch_size,), pad_id, dtype=torch.long, device=device)
+        # Padding rows start out done
+        all_done = torch.arange(batch_size, device=device) >= current_batch_size
+        row_idxs = torch.arange(batch_size, device=device)
+
+        step = 0
+        while step < max_tokens:
+            in_prompt = positions < prompt_lens
+            prompt_tokens = prompts.gather(1, positions.unsqueeze(1)).squeeze(1)
+            step_input = torch.where(in_prompt, prompt_tokens, last_preds)
+
+            preds, scores = engine.step(step_input, positions)
+
+            # The prediction after the last prompt token is the first generated token
+            generating = positions >= prompt_lens - 1
+            is_first = positions == prompt_lens - 1
+            is_eos = (preds == eos_id) | (preds == pad_id)
+            done = all_done | (generating & is_eos)
+
+            # The first token is always scored, after that finished lines score 0 so they drop out of the mean
+            score_rows = generating & ~all_done & (is_first | ~done)
+            emit_rows = generating & ~done
+            generated_idx = (positions - prompt_lens + 1).clamp(min=0)
+            sequence_scores[row_idxs, generated_idx] = torch.where(score_rows, scores.float(), sequence_scores[row_idxs, generated_idx])
+            batch_tokens[row_idxs, generated_idx] = torch.where(emit_rows, preds, batch_tokens[row_idxs, generated_idx])
+            token_lengths += emit_rows.long()
+
+            # Rows stop at the same token limit as decode_batch
+            all_done = done | (token_lengths >= generation_limit)
+            last_preds = preds
+            positions = positions + (~all_done).long()
+            step += 1
+
+            # Checking for early exit syncs with the device, so only do it every few steps
+            if step % get_done_check_interval() == 0 and all_done.all():
+                break
+
+    sequence_scores = sequence_scores[:current_batch_size]
+    sequence_scores = torch.sum(sequence_scores, dim=-1) / torch.sum(sequence_scores != 0, dim=-1)
+    batch_predictions = [tokens[:length] for tokens, length in zip(batch_tokens[:current_batch_size].tolist(), token_lengths[:current_batch_size].tolist())]
+    return batch_predictions, sequence_scores
+
+
+def get_draft_tokens(draft: str | None, eos_id: int) -> List[int] | None:
+    # Draft text (usually from the PDF text layer) tokenized the way the decoder emits it, ending with eos
+    if not draft:
+        return None
+    return [token + TOKEN_OFFSET for token in text_to_utf16_numbers(draft)] + [eos_id]
+
+
+def align_draft(draft: List[int], generated: List[int], expected: int, window: int = 8) -> int:
+    # Index in the draft of the next token, after the model diverged from it.  Looks for the tail of the generated text in
+    # the draft near where we expect to be, so a missing or extra char in the text layer only costs one step.
+    if expected > 0 and expected <= len(draft) and draft[expected - 1] == generated[-1]:
+        return expected
+
+    start = max(expected - window, 0)
+    end = min(expected + window, len(draft))
+    for ngram_len in (3, 2, 1):
+        if len(generated) < ngram_len:
+            continue
+        tail = generated[-ngram_len:]
+        matches = [idx + ngram_len for idx in range(start, end - ngram_len + 1) if draft[idx:idx + ngram_len] == tail]
+        if len(matches) > 0:
+            return min(matches, key=lambda idx: abs(idx - expected))
+
+    # Treat it as a substitution, and keep going
+    return expected
+
+
+def speculative_decode_batch(model, processor, encoder_text_hidden_states, batch_decoder_input: List[List[int]], batch_drafts: List[List[int] | None], batch_size: int):
+    # Greedy decoding that checks several draft tokens per decoder pass.  Each row feeds its pending tokens, then the next
+    # draft tokens, and keeps the longest draft prefix that matches the greedy predictions, plus the prediction after it.
+    # The output is the same as plain greedy decoding, a bad draft just means fewer tokens per step.
+    max_tokens = settings.RECOGNITION_MAX_TOKENS
+    eos_id, pad_id = processor.tokenizer.eos_id, processor.tokenizer.pad_id
+    current_batch_size = len(batch_decoder_input)
+    device = model.device
+
+    block_width = max(settings.RECOGNITION_SPECULATIVE_TOKENS + 1, max([len(prompt) for prompt in batch_decoder_input]))
+    # Every row writes a full block past its last accepted token, so the cache needs room for one extra block
+    model.decoder.model._setup_cache(model.config, current_batch_size, device, model.dtype, static_cache=True, max_length=max_tokens + block_width)
+
+    pending = [list(prompt) for prompt in batch_decoder_input]
+    cached = [0] * current_batch_size
+    draft_offsets = [0] * current_batch_size
+    # Same limit as decode_batch, which left pads the prompts
+    generation_limit = max_tokens - max([len(prompt) for prompt in batch_decoder_input])
+    batch_predictions = [[] for _ in range(current_batch_size)]
+    batch_scores = [[] for _ in range(current_batch_size)]
+    done = [False] * current_batch_size
+    block_offsets = torch.arange(block_width, device=device)
+
+    with torch.no_grad():
+        while not all(done):
+            block_tokens = []
+            block_drafts = []
+            for row in range(current_batch_size):
+                row_tokens = pending[row] if not done[row] else []
+                row_draft = []
+                if not done[row] and batch_drafts[row] is not None:
+                    row_draft = batch_drafts[row][draft_offsets[row]:draft_offsets[row] + block_width - len(row_tokens)]
+                block_drafts.append(row_draft)
+                block_tokens.append(row_tokens + row_draft + [pad_id] * (block_width - len(row_tokens) - len(row_draft)))
+
+            block_input = torch.tensor(block_tokens, dtype=torch.long, device=device)
+            cache_position = torch.tensor(cached, dtype=torch.long, device=device).unsqueeze(1) + block_offsets
+            logits = model.decoder(
+                input_ids=block_input,
+                encoder_hidden_states=encoder_text_hidden_states,
+                cache_position=cache_position,
+                use_cache=True,
+                prefill=False
+            )["logits"]
+
+            preds = torch.argmax(logits, dim=-1)
+            scores = torch.max(F.softmax(logits, dim=-1), dim=-1).values
+
+            # One host copy per step for the whole block
+            step_preds = preds.tolist()
+            step_scores = scores.float().tolist()
+
+            for row in range(current_batch_size):
+                if done[row]:
+                    continue
+
+                pending_len = len(pending[row])
+                draft_tokens = block_drafts[row]
+                draft_len = len(draft_tokens)
+
+                # The prediction after the last pending token is the first new token, each matching draft token buys one more
+                new_tokens = 0
+                for idx in range(pending_len - 1, pending_len + draft_len):
+                    token = step_preds[row][idx]
+                    is_first = len(batch_predictions[row]) == 0 and len(batch_scores[row]) == 0
+                    new_tokens += 1
+
+                    if token == eos_id or token == pad_id:
+                        # The first token is always scored, even when it ends the line
+                        if is_first:
+                            batch_scores[row].append(step_scores[row][idx])
+                        done[row] = True
+                        break
+
+                    batch_predictions[row].append(token)
+                    batch_scores[row].append(step_scores[row][idx])
+                    if len(batch_scores[row]) >= generation_limit:
+                        done[row] = True
+                        break
+
+                    draft_idx = idx - pending_len + 1
+                    if draft_idx >= draft_len or draft_tokens[draft_idx] != token:
+                        break
+
+                if done[row]:
+                    continue
+
+                # Accepted draft tokens are already in the cache, the last prediction still has to be fed
+                cached[row] += pending_len + new_tokens - 1
+                pending[row] = [batch_predictions[row][-1]]
+                if batch_drafts[row] is not None:
+                    draft_offsets[row] = align_draft(batch_drafts[row], batch_predictions[row], draft_offsets[row] + new_tokens)
+
+    sequence_scores = torch.tensor([sum(scores) / len(scores) for scores in batch_scores], dtype=torch.float32)
+    return batch_predictions, sequence_scores
+
+
+def decode_lines(model, processor, encoder_text_hidden_states, batch_decoder_input: List[List[int]], batch_size: int):
+    # The static engine feeds prompts one token per step, so it's only used for causal decoders
+    if settings.RECOGNITION_STATIC_ENGINE and model.decoder.config.causal:
+        return static_decode_batch(model, processor, encoder_text_hidden_states, batch_decoder_input, batch_size)
+    return decode_batch(model, processor, encoder_text_hidden_states, batch_decoder_input, batch_size)
+
+
+def decode_lines_with_drafts(model, processor, encoder_text_hidden_states, batch_decoder_input: List[List[int]], batch_drafts: List[List[int] | None], batch_size: int):
+    # Lines with a draft are decoded speculatively, and the rest the usual way
+    draft_rows = [row for row, draft in enumerate(batch_drafts) if draft]
+    other_rows = [row for row, draft in enumerate(batch_drafts) if not draft]
+
+    batch_predictions = [None] * len(batch_decoder_input)
+    sequence_scores = torch.zeros(len(batch_decoder_input), dtype=torch.float32)
+    for rows, speculative in [(draft_rows, True), (other_rows, False)]:
+        if len(rows) == 0:
+            continue
+
+        row_hidden_states = encoder_text_hidden_states[rows]
+        row_decoder_input = [batch_decoder_input[row] for row in rows]
+        if speculative:
+            row_predictions, row_scores = speculative_decode_batch(model, processor, row_hidden_states, row_decoder_input, [batch_drafts[row] for row in rows], batch_size)
+        else:
+            row_predictions, row_scores = decode_lines(model, processor, row_hidden_states, row_decoder_input, batch_size)
+
+        for row, predictions, score in zip(rows, row_predictions, row_scores.tolist()):
+            batch_predictions[row] = predictions
+            sequence_scores[row] = score
+    return batch_predictions, sequence_scores
+
+
+def batch_recognition(images: List, languages: List[List[str] | None], model, processor, batch_size=None, drafts: List[str | None] | None = None):
+    # drafts is optional expected text for each line (like the PDF text layer), used to decode several tokens per step
+    assert all([isinstance(image, (Image.Image, np.ndarray)) for image in images])
+    assert len(images) == len(languages)
+    assert drafts is None or len(drafts) == len(images)
+
+    # Prompts are fed one token per step, which only gives the same results as a prefill for causal decoders
+    if not settings.RECOGNITION_CONTINUOUS_BATCHING or not model.decoder.config.causal:
+        return bucketed_batch_recognition(images, languages, model, processor, batch_size=batch_size, drafts=drafts)
+
+    # Lines with a draft are decoded speculatively in bucketed batches, and the rest with continuous batching
+    draft_idxs = []
+    if drafts is not None and settings.RECOGNITION_SPECULATIVE_TOKENS > 0:
+        draft_idxs = [idx for idx, draft in enumerate(drafts) if draft]
+    if len(draft_idxs) == 0:
+        return continuous_batch_recognition(images, languages, model, processor, batch_size=batch_size)
+
+    draft_set = set(draft_idxs)
+    other_idxs = [idx for idx in range(len(images)) if idx not in draft_set]
+    output_text = [None] * len(images)
+    confidences = [None] * len(images)
+    draft_results = bucketed_batch_recognition(
+        [images[idx] for idx in draft_idxs], [languages[idx] for idx in draft_idxs], model, processor, batch_size=batch_size, drafts=[drafts[idx] for idx in draft_idxs]
+    )
+    other_results = continuous_batch_recognition([images[idx] for idx in other_idxs], [languages[idx] for idx in other_idxs], model, processor, batch_size=batch_size)
+    for idxs, (idxs_text, idxs_confidences) in [(draft_idxs, draft_results), (other_idxs, other_results)]:
+        for idx, text, confidence in zip(idxs, idxs_text, idxs_confidences):
+            output_text[idx] = text
+            confidences[idx] = confidence
+    return output_text, confidences
 
-        # Pad decoder input to max length if needed, to ensure we can convert to a tensor
-        for token_idx in range(len(batch_decoder_input)):
-            lang_len = len(batch_decoder_input[token_idx])
-            if lang_len < max_input_length:
-                batch_decoder_input[token_idx] = [processor.tokenizer.pad_id] * (max_input_length - lang_len) + batch_decoder_input[token_idx]
 
-        current_batch_size = len(batch_pixel_values)
+def bucketed_batch_recognition(images: List, languages: List[List[str] | None], model, processor, batch_size=None, drafts: List[str | None] | None = None):
+    # Decodes length-bucketed batches one at a time, each until its longest line is done
+    if len(images) == 0:
+        return [], []
 
-        batch_pixel_values = torch.tensor(np.stack(batch_pixel_values, axis=0), dtype=model.dtype, device=model.device)
-        batch_decoder_input = torch.tensor(np.stack(batch_decoder_input, axis=0), dtype=torch.long, device=model.device)
+    cache = get_recognition_cache()
 
-        token_count = 0
-        inference_token_count = batch_decoder_input.shape[-1]
-        batch_predictions = [[] for _ in range(current_batch_size)]
+    if batch_size is None:
+        batch_size = get_batch_size()
 
-        decoder_position_ids = torch.ones_like(batch_decoder_input[0, :], dtype=torch.int64, device=model.device).cumsum(0) - 1
-        model.decoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
-        model.text_encoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
+    indices = get_recognition_order(images, languages)
+    images = [images[idx] for idx in indices]
+    languages = [languages[idx] for idx in indices]
+    if drafts is not None:
+        drafts = [get_draft_tokens(drafts[idx], processor.tokenizer.eos_id) for idx in indices]
 
-        sequence_scores = None
-        all_done = torch.zeros(current_batch_size, dtype=torch.bool, device=model.device)
-        encoder_hidden_states = None
+    output_text = []
+    confidences = []
+    for i in tqdm(range(0, len(images), batch_size), desc="Recognizing Text"):
+        batch_images = images[i:i+batch_size]
+        batch_images = [convert_line_image(image) for image in batch_images]
 
-        with torch.no_grad(): # inference_mode doesn't work with torch.compile
-            encoder_batch_size = batch_size // settings.RECOGNITION_ENCODER_BATCH_DIVISOR + 1
-            for z in range(0, batch_pixel_values.shape[0], encoder_batch_size):
-                encoder_pixel_values = batch_pixel_values[z:min(z + encoder_batch_size, batch_pixel_values.shape[0])]
-                encoder_hidden_states_batch = model.encoder(pixel_values=encoder_pixel_values).last_hidden_state
-                if encoder_hidden_states is None:
-                    encoder_hidden_states = encoder_hidden_states_batch
-                else:
-                    encoder_hidden_states = torch.cat([encoder_hidden_states, encoder_hidden_states_batch], dim=0)
-
-            text_encoder_input_ids = torch.arange(
-                model.text_encoder.config.query_token_count,
-                device=encoder_hidden_states.device,
-                dtype=torch.long
-            ).unsqueeze(0).expand(encoder_hidden_states.size(0), -1)
-
-            encoder_text_hidden_states = model.text_encoder(
-                input_ids=text_encoder_input_ids,
-                cache_position=None,
-                attention_mask=None,
-                encoder_hidden_states=encoder_hidden_states,
-                encoder_attention_mask=None,
-                use_cache=False
-            ).hidden_states
-            del encoder_hidden_states
+        batch_langs = languages[i:i+batch_size]
+        has_math = [lang and "_math" in lang for lang in batch_langs]
 
-            if settings.RECOGNITION_STATIC_CACHE:
-                # Pad inputs to max batch size for static cache
-                encoder_text_hidden_states = pad_to_batch_size(encoder_text_hidden_states, batch_size)
-                batch_decoder_input = pad_to_batch_size(batch_decoder_input, batch_size)
+        processed_batch = processor(text=[""] * len(batch_images), images=batch_images, langs=batch_langs, dtype=get_pixel_dtype(model))
 
-            while token_count < settings.RECOGNITION_MAX_TOKENS - 1:
-                is_prefill = token_count == 0
-                #TODO: add attention mask
-                return_dict = model.decoder(
-                    input_ids=batch_decoder_input,
-                    encoder_hidden_states=encoder_text_hidden_states,
-                    cache_position=decoder_position_ids,
-                    use_cache=True,
-                    prefill=is_prefill
-                )
-
-                decoder_position_ids = decoder_position_ids[-1:] + 1
-                logits = return_dict["logits"][:current_batch_size] # Ignore batch padding
-                aux_logits = return_dict.get("aux_logits", None)
-
-                preds = torch.argmax(logits[:, -1], dim=-1)
-                scores = torch.max(F.softmax(logits[:, -1], dim=-1), dim=-1).values.unsqueeze(1)
-                done = (preds == processor.tokenizer.eos_id) | (preds == processor.tokenizer.pad_id)
-                done = done
-                all_done = all_done | done
-
-                if is_prefill:
-                    sequence_scores = scores
+        batch_pixel_values = processed_batch["pixel_values"]
+        batch_drafts = drafts[i:i+batch_size] if drafts is not None else None
+        batch_text = [None] * len(batch_images)
+        batch_confidences = [None] * len(batch_images)
+
+        # Lines seen before skip the encoder and decoder, only the rest are recognized
+        run_idxs = list(range(len(batch_images)))
+        if cache is not None:
+            batch_keys = [cache.get_key(pixel_values, langs) for pixel_values, langs in zip(batch_pixel_values, batch_langs)]
+            # Repeated lines sort next to each other, so repeats within the batch are only recognized once too
+            first_idxs = {}
+            run_idxs = []
+            for idx, key in enumerate(batch_keys):
+                if key in first_idxs:
+                    continue
+                first_idxs[key] = idx
+                cached = cache.get(key)
+                if cached is None:
+                    run_idxs.append(idx)
                 else:
-                    scores = scores.masked_fill(all_done, 0)
-                    sequence_scores = torch.cat([sequence_scores, scores], dim=1)
+                    batch_text[idx], batch_confidences[idx] = cached
 
-                if all_done.all():
-                    break
+            if len(run_idxs) == 0:
+                output_text.extend([batch_text[first_idxs[key]] for key in batch_keys])
+                confidences.extend([batch_confidences[first_idxs[key]] for key in batch_keys])
+                continue
 
-                batch_decoder_input = preds.unsqueeze(1)
+            if len(run_idxs) < len(batch_images):
+                batch_pixel_values = batch_pixel_values[run_idxs]
+                has_math = [has_math[idx] for idx in run_idxs]
+                batch_drafts = [batch_drafts[idx] for idx in run_idxs] if batch_drafts is not None else None
 
-                for j, (pred, status) in enumerate(zip(preds, all_done)):
-                    if not status:
-                        batch_predictions[j].append(int(pred))
+        batch_langs = [processed_batch["langs"][idx] for idx in run_idxs]
+        batch_decoder_input = [[model.config.decoder_start_token_id] + lang for lang in batch_langs]
+        batch_pixel_values = pixel_values_to_tensor(batch_pixel_values, model)
+        model.text_encoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
 
-                token_count += inference_token_count
-                inference_token_count = batch_decoder_input.shape[-1]
-                max_position_id = torch.max(decoder_position_ids).item()
-                decoder_position_ids = torch.ones_like(batch_decoder_input[0, :], dtype=torch.int64, device=model.device).cumsum(0) - 1 + max_position_id
+        with torch.no_grad(): # inference_mode doesn't work with torch.compile
+            encoder_batch_size = batch_size // settings.RECOGNITION_ENCODER_BATCH_DIVISOR + 1
+            encoder_text_hidden_states = get_encoder_text_hidden_states(model, batch_pixel_values, encoder_batch_size)
 
-                if settings.RECOGNITION_STATIC_CACHE:
-                    batch_decoder_input = pad_to_batch_size(batch_decoder_input, batch_size)
+        # Speculative decoding feeds each row at its own positions with a causal mask, so it needs a causal decoder too
+        use_drafts = batch_drafts is not None and settings.RECOGNITION_SPECULATIVE_TOKENS > 0 and any(batch_drafts) and model.decoder.config.causal
+        if use_drafts:
+            batch_predictions, sequence_scores = decode_lines_with_drafts(model, processor, encoder_text_hidden_states, batch_decoder_input, batch_drafts, batch_size)
+        else:
+            batch_predictions, sequence_scores = decode_lines(model, processor, encoder_text_hidden_states, batch_decoder_input, batch_size)
 
-        sequence_scores = torch.sum(sequence_scores, dim=-1) / torch.sum(sequence_scores != 0, dim=-1)
         detected_text = processor.tokenizer.batch_decode(batch_predictions)
         detected_text = [truncate_repetitions(dt) for dt in detected_text]
 
         # Postprocess to fix LaTeX output (add $$ signs, etc)
         detected_text = [fix_math(text) if math and contains_math(text) else text for text, math in zip(detected_text, has_math)]
-        output_text.extend(detected_text)
-        confidences.extend(sequence_scores.tolist())
+        sequence_scores = sequence_scores.tolist()
+        for idx, text, confidence in zip(run_idxs, detected_text, sequence_scores):
+            batch_text[idx] = text
+            batch_confidences[idx] = confidence
+
+        if cache is not None:
+            cache.put_many([(batch_keys[idx], text, confidence) for idx, text, confidence in zip(run_idxs, detected_text, sequence_scores)])
+            batch_text = [batch_text[first_idxs[key]] for key in batch_keys]
+            batch_confidences = [batch_confidences[first_idxs[key]] for key in batch_keys]
+
+        output_text.extend(batch_text)
+        confidences.extend(batch_confidences)
 
         del encoder_text_hidden_states
 
@@ -152,6 +152,7 @@ class ColumnLine(Bbox):
 class TextLine(PolygonBox):
     text: str
     confidence: Optional[float] = None
+    source: str = "ocr" # "ocr" if recognized, "pdf" if taken from the PDF text layer
 
 
 class OCRResult(BaseModel):
@@ -16,12 +16,16 @@ class Settings(BaseSettings):
     ENABLE_EFFICIENT_ATTENTION: bool = True # Usually keep True, but if you get CUDA errors, setting to False can help
     ENABLE_CUDNN_ATTENTION: bool = False # Causes issues on many systems when set to True, but can improve performance on certain GPUs
     FLATTEN_PDF: bool = True # Flatten PDFs by merging form fields before processing
+    PDF_RENDER_WINDOW_SIZE: int = 32 # Max rendered pages kept in memory per PDF when loading lazily
+    PDF_RENDER_WORKERS: int = 1 # Processes used to render PDF pages.  1 renders in the main process.
+    PDF_RENDER_CHUNK_SIZE: int = 4 # Pages rendered per task when using multiple render processes
 
     # Paths
     DATA_DIR: str = "data"
     RESULT_DIR: str = "results"
     BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     FONT_DIR: str = os.path.join(BASE_DIR, "static", "fonts")
+    PAGE_CACHE_PATH: Optional[str] = None # Page result cache used by the CLI scripts with --cache.  Defaults to page_cache.sqlite in RESULT_DIR
 
     @computed_field
     def TORCH_DEVICE_MODEL(self) -> str:
@@ -45,6 +49,7 @@ class Settings(BaseSettings):
     DETECTOR_BLANK_THRESHOLD: float = 0.35 # Threshold for blank space (below this is considered blank)
     DETECTOR_POSTPROCESSING_CPU_WORKERS: int = min(8, os.cpu_count()) # Number of workers for postprocessing
     DETECTOR_MIN_PARALLEL_THRESH: int = 3 # Minimum number of images before we parallelize
+    DETECTOR_DEVICE_POSTPROCESSING: bool = False # Threshold text heatmaps on the model device, and only copy masks to the cpu.  Boxes can differ very slightly.
 
     # Text recognition
     RECOGNITION_MODEL_CHECKPOINT: str = "vikp/surya_rec2"
@@ -61,7 +66,18 @@ class Settings(BaseSettings):
     RECOGNITION_BENCH_DATASET_NAME: str = "vikp/rec_bench"
     RECOGNITION_PAD_VALUE: int = 255 # Should be 0 or 255
     RECOGNITION_STATIC_CACHE: bool = False # Static cache for torch compile
+    RECOGNITION_STATIC_ENGINE: bool = False # Decode with persistent buffers and a step captured once as a cuda graph (torch.compile on other devices)
     RECOGNITION_ENCODER_BATCH_DIVISOR: int = 2 # Divisor for batch size in decoder
+    RECOGNITION_CONTINUOUS_BATCHING: bool = False # Start decoding new lines in the slots of finished lines, instead of waiting for the whole batch
+    RECOGNITION_DONE_CHECK_INTERVAL: Optional[int] = None # Decode steps between checks for a finished batch.  Defaults to 8 for cuda, 1 otherwise.  Values below 1 check every step
+    RECOGNITION_LENGTH_BUCKETING: bool = True # Batch lines by estimated output length (aspect ratio, language, math), instead of by width
+    RECOGNITION_SPECULATIVE_TOKENS: int = 8 # Draft tokens (from the PDF text layer) checked per decoder pass, 0 to disable
+    RECOGNITION_TEXT_LAYER_MIN_COVERAGE: float = .8 # Share of a line's width the PDF text layer has to cover to be used instead of OCR
+    RECOGNITION_TEXT_LAYER_MIN_VALID: float = 1.0 # Share of the line's PDF glyphs that need a real unicode mapping
+    RECOGNITION_TEXT_LAYER_MIN_IOU: float = .5 # Minimum overlap between the PDF glyph boxes and the detected line
+    RECOGNITION_CACHE_SIZE: int = 0 # Recognized lines kept in memory, so repeated lines (headers, footers) skip the model.  0 disables it
+    RECOGNITION_CACHE_PATH: Optional[str] = None # Optional sqlite file that keeps recognized lines across runs
+    RECOGNITION_MAX_PAGES_IN_FLIGHT: int = 32 # Pages held in memory at once by iter_ocr
 
     # Layout
     LAYOUT_MODEL_CHECKPOINT: str = "vikp/surya_layout3"
@@ -73,6 +89,9 @@ class Settings(BaseSettings):
     ORDER_MAX_BOXES: int = 256
     ORDER_BATCH_SIZE: Optional[int] = None  # Defaults to 4 for CPU/MPS, 32 otherwise
     ORDER_BENCH_DATASET_NAME: str = "vikp/order_bench"
+    ORDER_ENGINE: str = "autoregressive" # "autoregressive" predicts one box per decoder step, "multibox" greedily places several boxes per step
+    ORDER_MULTIBOX_BOXES_PER_STEP: int = 16 # Boxes placed per decoder step with the multibox engine
+    ORDER_HEURISTIC_MAX_COMPLEXITY: float = 0.1 # Pages up to this layout complexity are ordered geometrically by tiered_ordering
 
     # Table Rec
     TABLE_REC_MODEL_CHECKPOINT: str = "vikp/surya_tablerec"
@@ -80,6 +99,7 @@ class Settings(BaseSettings):
     TABLE_REC_MAX_BOXES: int = 512
     TABLE_REC_MAX_ROWS: int = 384
     TABLE_REC_BATCH_SIZE: Optional[int] = None
+    TABLE_REC_DONE_CHECK_STEPS: int = 8 # Decode steps between checks for whether every table in the batch is done.  Values below 1 check every step
     TABLE_REC_BENCH_DATASET_NAME: str = "vikp/fintabnet_bench"
 
     # Tesseract (for benchmarks only)
@@ -39,6 +39,17 @@ def sort_bboxes(bboxes, tolerance=1):
     return sorted_page_blocks
 
 
+def get_prediction_corners(batch_predictions: np.ndarray, orig_sizes: List[tuple], out_box_size: int) -> np.ndarray:
+    # (cx, cy, w, h) predictions in model box coordinates to (x1, y1, x2, y2) in image coordinates, for every table in the batch at once
+    scalers = np.array(orig_sizes, dtype=np.float64) / out_box_size
+    half_sizes = batch_predictions[:, :, 2:4] / 2
+    batch_corners = np.concatenate([
+        batch_predictions[:, :, 0:2] - half_sizes,
+        batch_predictions[:, :, 0:2] + half_sizes
+    ], axis=-1)
+    return batch_corners * np.tile(scalers, 2)[:, None, :]
+
+
 def batch_table_recognition(images: List, table_cells: List[List[Dict]], model: OrderVisionEncoderDecoderModel, processor, batch_size=None) -> List[TableResult]:
     assert all([isinstance(image, Image.Image) for image in images])
     assert len(images) == len(table_cells)
@@ -47,7 +58,8 @@ def batch_table_recognition(images: List, table_cells: List[List[Dict]], model:
 
     output_order = []
     for i in tqdm(range(0, len(images), batch_size), desc="Recognizing tables"):
-        batch_table_cells = deepcopy(table_cells[i:i+batch_size])
+        # Copied page by page, since the processor rescales boxes in place and a page's cells can be passed more than once
+        batch_table_cells = [deepcopy(page_cells) for page_cells in table_cells[i:i+batch_size]]
         batch_table_cells = [sort_bboxes(page_bboxes) for page_bboxes in batch_table_cells] # Sort bboxes before passing in
         batch_list_bboxes = [[block["bbox"] for block in page] for page in batch_table_cells]
 
@@ -78,7 +90,9 @@ def batch_table_recognition(images: List, table_cells: List[List[Dict]], model:
         model.decoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
         model.text_encoder.model._setup_cache(model.config, batch_size, model.device, model.dtype)
 
-        batch_predictions = [[] for _ in range(current_batch_size)]
+        # Predictions stay on the device until the batch is done, then are copied to the host once.  Each step writes the
+        # (cx, cy, w, h, class) prediction for every table, and -1 for tables that are already done.
+        batch_predictions = torch.full((current_batch_size, max_tokens, 5), -1, dtype=torch.long, device=model.device)
 
         with torch.inference_mode():
             encoder_hidden_states = model.encoder(pixel_values=batch_pixel_values).last_hidden_state
@@ -93,6 +107,8 @@ def batch_table_recognition(images: List, table_cells: List[List[Dict]], model:
             ).hidden_states
 
             token_count = 0
+            step = 0
+            done_check_steps = max(1, settings.TABLE_REC_DONE_CHECK_STEPS)
             all_done = torch.zeros(current_batch_size, dtype=torch.bool, device=model.device)
 
             while token_count < max_tokens:
@@ -113,41 +129,30 @@ def batch_table_recognition(images: List, table_cells: List[List[Dict]], model:
                 box_preds = torch.argmax(box_logits, dim=-1)
 
                 done = (rowcol_preds == processor.tokenizer.eos_id) | (rowcol_preds == processor.tokenizer.pad_id)
-                done = done
                 all_done = all_done | done
 
-                if all_done.all():
+                # Checking for the end syncs with the host, so it's only done every few steps.  The extra steps are all -1.
+                if step % done_check_steps == 0 and all_done.all():
                     break
 
                 batch_decoder_input = torch.cat([box_preds.unsqueeze(1), rowcol_preds.unsqueeze(1).unsqueeze(1)], dim=-1)
+                batch_predictions[:, step] = batch_decoder_input[:, 0].masked_fill(all_done[:, None], -1)
 
-                for j, (pred, status) in enumerate(zip(batch_decoder_input, all_done)):
-                    if not status:
-                        batch_predictions[j].append(pred[0].tolist())
-
+                step += 1
                 token_count += inference_token_count
                 inference_token_count = batch_decoder_input.shape[1]
 
-        for j, (preds, input_cells, orig_size) in enumerate(zip(batch_predictions, batch_table_cells, orig_sizes)):
-            img_w, img_h = orig_size
-            width_scaler = img_w / model.config.decoder.out_box_size
-            height_scaler = img_h / model.config.decoder.out_box_size
-
-            # cx, cy to corners
-            for i, pred in enumerate(preds):
-                w = pred[2] / 2
-                h = pred[3] / 2
-                x1 = pred[0] - w
-                y1 = pred[1] - h
-                x2 = pred[0] + w
-                y2 = pred[1] + h
-                class_ = int(pred[4] - SPECIAL_TOKENS)
+        batch_predictions = batch_predictions.cpu().numpy()
+        batch_valid = batch_predictions[:, :, 4] >= 0
+        batch_corners = get_prediction_corners(batch_predictions, orig_sizes, model.config.decoder.out_box_size)
+        batch_classes = batch_predictions[:, :, 4] - SPECIAL_TOKENS
 
-                preds[i] = [x1 * width_scaler, y1 * height_scaler, x2 * width_scaler, y2 * height_scaler, class_]
+        for j, (input_cells, orig_size) in enumerate(zip(batch_table_cells, orig_sizes)):
+            img_w, img_h = orig_size
 
             # Get rows and columns
-            bb_rows = [p[:4] for p in preds if p[4] == 0]
-            bb_cols = [p[:4] for p in preds if p[4] == 1]
+            bb_rows = batch_corners[j][batch_valid[j] & (batch_classes[j] == 0)].tolist()
+            bb_cols = batch_corners[j][batch_valid[j] & (batch_classes[j] == 1)].tolist()
 
             rows = []
             cols = []
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import zlib
+from collections import OrderedDict
+from typing import Callable, Generator, Iterable, List, Tuple
+
+import numpy as np
+
+from surya.settings import settings
+
+
+class RecognitionCache:
+    """
+    Recognized text and confidence for line images, keyed by a hash of the preprocessed pixels and the languages.
+    Repeated lines (headers, footers, page numbers) are only recognized once.  The in-memory tier is an LRU bounded
+    by max_entries, and an optional sqlite file keeps results across runs.
+    """
+
+    def __init__(self, max_entries: int, disk_path: str | None = None):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if disk_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self.db = sqlite3.connect(disk_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS lines (key TEXT PRIMARY KEY, text TEXT, confidence REAL)")
+            self.db.commit()
+
+    @staticmethod
+    def get_key(pixel_values: np.ndarray, langs: List[str] | None) -> str:
+        # The model and max tokens are part of the key, since disk entries outlive the process
+        key = hashlib.blake2b(digest_size=16)
+        key.update(np.ascontiguousarray(pixel_values).view(np.uint8))
+        key.update(str(pixel_values.dtype).encode())
+        key.update(json.dumps([langs, settings.RECOGNITION_MODEL_CHECKPOINT, settings.RECOGNITION_MAX_TOKENS]).encode())
+        return key.hexdigest()
+
+    def get(self, key: str) -> Tuple[str, float] | None:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT text, confidence FROM lines WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                self._add(key, (row[0], row[1]))
+                return row[0], row[1]
+
+        self.misses += 1
+        return None
+
+    def put_many(self, items: List[Tuple[str, str, float]]):
+        # items are (key, text, confidence)
+        for key, text, confidence in items:
+            self._add(key, (text, confidence))
+
+        if self.db is not None and len(items) > 0:
+            self.db.executemany("INSERT OR REPLACE INTO lines (key, text, confidence) VALUES (?, ?, ?)", items)
+            self.db.commit()
+
+    def _add(self, key: str, value: Tuple[str, float]):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+_recognition_cache = None
+
+
+def get_recognition_cache() -> RecognitionCache | None:
+    # Built from the settings, and rebuilt if they change.  None if caching is turned off.
+    global _recognition_cache
+    if settings.RECOGNITION_CACHE_SIZE <= 0 and settings.RECOGNITION_CACHE_PATH is None:
+        return None
+
+    if (
+        _recognition_cache is None or
+        _recognition_cache.max_entries != settings.RECOGNITION_CACHE_SIZE or
+        _recognition_cache.disk_path != settings.RECOGNITION_CACHE_PATH
+    ):
+        _recognition_cache = RecognitionCache(settings.RECOGNITION_CACHE_SIZE, settings.RECOGNITION_CACHE_PATH)
+    return _recognition_cache
+
+
+# Settings that change each stage's results, so they're part of the page cache key
+PAGE_CACHE_SETTINGS = {
+    "detection": ["DETECTOR_MODEL_CHECKPOINT", "DETECTOR_IMAGE_CHUNK_HEIGHT", "DETECTOR_TEXT_THRESHOLD", "DETECTOR_BLANK_THRESHOLD", "DETECTOR_DEVICE_POSTPROCESSING", "IMAGE_DPI", "FLATTEN_PDF"],
+    "layout": ["LAYOUT_MODEL_CHECKPOINT", "DETECTOR_MODEL_CHECKPOINT", "DETECTOR_IMAGE_CHUNK_HEIGHT", "DETECTOR_TEXT_THRESHOLD", "DETECTOR_BLANK_THRESHOLD", "DETECTOR_DEVICE_POSTPROCESSING", "IMAGE_DPI", "FLATTEN_PDF"],
+    "ocr": [
+        "DETECTOR_MODEL_CHECKPOINT", "DETECTOR_IMAGE_CHUNK_HEIGHT", "DETECTOR_TEXT_THRESHOLD", "DETECTOR_BLANK_THRESHOLD", "DETECTOR_DEVICE_POSTPROCESSING", "IMAGE_DPI", "IMAGE_DPI_HIGHRES",
+        "FLATTEN_PDF", "RECOGNITION_MODEL_CHECKPOINT", "RECOGNITION_MAX_TOKENS", "RECOGNITION_TEXT_LAYER_MIN_COVERAGE", "RECOGNITION_TEXT_LAYER_MIN_VALID",
+        "RECOGNITION_TEXT_LAYER_MIN_IOU"
+    ],
+}
+
+
+class PageResultCache:
+    """
+    Results for whole pages (TextDetectionResult, LayoutResult, OCRResult), stored in a sqlite file, so re-running the
+    CLI scripts on unchanged files skips the models.  Keys cover the file contents, page, stage, and the settings that
+    affect the stage (see PAGE_CACHE_SETTINGS).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file_hashes = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, result BLOB)")
+        self.db.commit()
+
+    def get_file_hash(self, path: str) -> str:
+        # Hashed once per run, files are only re-read if they change size or modification time
+        stat = os.stat(path)
+        file_id = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self.file_hashes:
+            file_hash = hashlib.blake2b(digest_size=16)
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_hash.update(chunk)
+            self.file_hashes[file_id] = file_hash.hexdigest()
+        return self.file_hashes[file_id]
+
+    def get_key(self, path: str, page_idx: int, stage: str, extra=None) -> str:
+        # extra is anything else the result depends on, like the languages
+        stage_settings = {name: getattr(settings, name) for name in PAGE_CACHE_SETTINGS[stage]}
+        key = json.dumps([self.get_file_hash(path), page_idx, stage, stage_settings, extra], sort_keys=True, default=str)
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str, result_type):
+        row = self.db.execute("SELECT result FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return result_type.model_validate_json(zlib.decompress(row[0]))
+
+    def put(self, key: str, result):
+        # Maps (heatmaps, segmentation maps) aren't stored
+        maps = {field: None for field in ("heatmap", "affinity_map", "segmentation_map", "heatmaps") if field in type(result).model_fields}
+        result = result.model_copy(update=maps).model_dump_json()
+        self.db.execute("INSERT OR REPLACE INTO pages (key, result) VALUES (?, ?)", (key, zlib.compress(result.encode())))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def get_page_cache_path() -> str:
+    if settings.PAGE_CACHE_PATH is not None:
+        return settings.PAGE_CACHE_PATH
+    return os.path.join(settings.RESULT_DIR, "page_cache.sqlite")
+
+
+def iter_cached_pages(cache: PageResultCache | None, keys: List[str], result_type, compute: Callable[[List[int]], Iterable]) -> Generator:
+    # Yields the result for every page in order.  Cached pages are read from the cache, and compute is called once with the
+    # indices of the other pages, and has to return (or yield) their results in that order.
+    if cache is None:
+        yield from compute(list(range(len(keys))))
+        return
+
+    results = [cache.get(key, result_type) for key in keys]
+    miss_idxs = [idx for idx, result in enumerate(results) if result is None]
+    computed = iter(compute(miss_idxs)) if len(miss_idxs) > 0 else iter([])
+    for key, result in zip(keys, results):
+        if result is None:
+            result = next(computed)
+            cache.put(key, result)
+        yield result
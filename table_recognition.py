@@ -8,7 +8,7 @@ from collections import defaultdict
 from surya.detection import batch_text_detection
 from surya.input.load import load_from_folder, load_from_file
 from surya.input.pdflines import get_table_blocks
-from surya.layout import batch_layout_detection
+from surya.layout import batch_text_and_layout_detection
 from surya.model.detection.model import load_model as load_det_model, load_processor as load_det_processor
 from surya.model.table_rec.model import load_model as load_model
 from surya.model.table_rec.processor import load_processor
@@ -56,8 +56,7 @@ def main():
 
         prev_name = name
 
-    line_predictions = batch_text_detection(images, det_model, det_processor)
-    layout_predictions = batch_layout_detection(images, layout_model, layout_processor, line_predictions)
+    line_predictions, layout_predictions = batch_text_and_layout_detection(images, det_model, det_processor, layout_model, layout_processor)
     table_cells = []
 
     table_imgs = []
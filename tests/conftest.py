@@ -0,0 +1,234 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+from PIL import Image, ImageDraw
+from transformers.modeling_outputs import SemanticSegmenterOutput
+
+from surya.model.detection.config import EfficientViTConfig
+from surya.model.detection.model import EfficientViTForSemanticSegmentation
+from surya.model.detection.processor import SegformerImageProcessor
+from surya.model.ordering.config import MBartOrderConfig, VariableDonutSwinConfig, SuryaOrderConfig
+from surya.model.ordering.encoderdecoder import OrderVisionEncoderDecoderModel
+from surya.model.ordering.processor import OrderImageProcessor
+from surya.model.recognition.config import DonutSwinConfig, SuryaOCRConfig, SuryaOCRDecoderConfig, SuryaOCRTextEncoderConfig, TOTAL_VOCAB_SIZE
+from surya.model.recognition.encoderdecoder import OCREncoderDecoderModel
+from surya.model.recognition.processor import SuryaImageProcessor, SuryaProcessor
+from surya.model.table_rec.config import DonutSwinTableRecConfig, SuryaTableRecConfig, SuryaTableRecDecoderConfig, SuryaTableRecTextEncoderConfig
+from surya.model.table_rec.encoderdecoder import TableRecEncoderDecoderModel
+from surya.model.table_rec import processor as table_rec_processor
+from surya.settings import settings
+
+TINY_REC_IMAGE_SIZE = {"height": 256, "width": 896}
+TINY_ORDER_IMAGE_SIZE = {"height": 128, "width": 128}
+TINY_TABLE_IMAGE_SIZE = {"height": 128, "width": 128}
+TINY_DET_IMAGE_SIZE = {"height": 256, "width": 256}
+
+
+def make_tiny_rec_model(causal=True, eos_scale=1.0):
+    # Small random recognition model, so the decode loops can be compared without downloading checkpoints
+    torch.manual_seed(0)
+    encoder = DonutSwinConfig(embed_dim=16, depths=[1, 1, 1, 1], num_heads=[1, 2, 4, 8], num_kv_heads=[1, 1, 1, 1])
+    decoder = SuryaOCRDecoderConfig(
+        num_hidden_layers=3, hidden_size=64, intermediate_size=128, num_attention_heads=4, num_key_value_heads=2,
+        vocab_size=TOTAL_VOCAB_SIZE, cross_attn_layers=(0, 1, 2), self_attn_layers=(0, 1, 2), global_attn_layers=(0, 1, 2),
+        encoder_hidden_size=64, aux_heads=0, causal=causal
+    )
+    text_encoder = SuryaOCRTextEncoderConfig(
+        num_hidden_layers=2, hidden_size=64, intermediate_size=128, num_attention_heads=4, num_key_value_heads=2,
+        vocab_size=TOTAL_VOCAB_SIZE, cross_attn_layers=(0, 1), self_attn_layers=(0, 1), global_attn_layers=(0, 1),
+        encoder_hidden_size=128, query_token_count=16
+    )
+    config = SuryaOCRConfig(encoder=encoder.to_dict(), decoder=decoder.to_dict())
+    config.encoder, config.decoder, config.text_encoder = encoder, decoder, text_encoder
+    model = OCREncoderDecoderModel(config).eval()
+
+    # Scales how often the random model emits eos (token 1)
+    with torch.no_grad():
+        model.decoder.lm_head.weight[1] = model.decoder.lm_head.weight[1] * eos_scale
+    return model
+
+
+@pytest.fixture
+def token_limit_model(monkeypatch):
+    # Without an eos bias the random model runs every line to the token limit
+    monkeypatch.setattr(settings, "RECOGNITION_MAX_TOKENS", 24)
+    return make_tiny_rec_model(causal=True, eos_scale=0.)
+
+
+def get_generation_limit():
+    # Tokens each line decodes at the limit - the prompt is the start token plus one language token
+    return settings.RECOGNITION_MAX_TOKENS - 2
+
+
+def decoded_token_counts(processor, run):
+    # Token counts for every line passed to batch_decode while run() is called
+    counts = []
+    batch_decode = processor.tokenizer.batch_decode
+
+    def recording_batch_decode(predictions, *args, **kwargs):
+        counts.extend([len(tokens) for tokens in predictions])
+        return batch_decode(predictions, *args, **kwargs)
+
+    with mock.patch.object(processor.tokenizer, "batch_decode", side_effect=recording_batch_decode):
+        result = run()
+    return result, counts
+
+
+@pytest.fixture(scope="session")
+def rec_processor():
+    image_processor = SuryaImageProcessor(max_size=TINY_REC_IMAGE_SIZE, image_mean=[0.5] * 3, image_std=[0.5] * 3, resample=2)
+    with mock.patch.object(SuryaImageProcessor, "from_pretrained", return_value=image_processor):
+        processor = SuryaProcessor()
+    processor.image_processor.max_size = TINY_REC_IMAGE_SIZE
+    return processor
+
+
+@pytest.fixture(scope="session")
+def line_images():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (int(rng.integers(15, 40)), int(width), 3), dtype=np.uint8) for width in rng.integers(30, 600, 12)]
+
+
+@pytest.fixture(scope="session")
+def order_model():
+    # Small random reading order model
+    torch.manual_seed(0)
+    encoder = VariableDonutSwinConfig(image_size=TINY_ORDER_IMAGE_SIZE["height"], embed_dim=8, depths=[1, 1, 1, 1], num_heads=[1, 2, 4, 8], num_kv_heads=[1, 1, 1, 1], window_size=4)
+    decoder = MBartOrderConfig(
+        vocab_size=257, max_position_embeddings=1024, d_model=64, decoder_layers=2, decoder_ffn_dim=128, decoder_attention_heads=4,
+        kv_heads=2, max_width=1300, max_height=1300, dropout=0.0
+    )
+    config = SuryaOrderConfig(encoder=encoder.to_dict(), decoder=decoder.to_dict())
+    config.encoder, config.decoder = encoder, decoder
+    return OrderVisionEncoderDecoderModel(config).eval()
+
+
+@pytest.fixture(scope="session")
+def order_processor():
+    processor = OrderImageProcessor(image_mean=[0.5] * 3, image_std=[0.5] * 3)
+    processor.size = TINY_ORDER_IMAGE_SIZE
+    box_size = 1024
+    max_tokens = 256
+    processor.token_sep_id = max_tokens + box_size + 1
+    processor.token_pad_id = max_tokens + box_size + 2
+    processor.max_boxes = max_tokens - 1
+    processor.box_size = {"height": box_size, "width": box_size}
+    return processor
+
+
+@pytest.fixture(scope="session")
+def order_pages():
+    rng = np.random.default_rng(0)
+    images, bboxes = [], []
+    for box_count in [12, 0, 30, 7, 12, 45]:
+        width, height = int(rng.integers(300, 800)), int(rng.integers(300, 1000))
+        images.append(Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8)))
+        page_bboxes = []
+        for _ in range(box_count):
+            x, y = float(rng.uniform(0, width - 20)), float(rng.uniform(0, height - 10))
+            page_bboxes.append([x, y, x + float(rng.uniform(5, 200)), y + float(rng.uniform(3, 30))])
+        bboxes.append(page_bboxes)
+    return images, bboxes
+
+
+@pytest.fixture(scope="session")
+def table_model():
+    # Small random table recognition model, with wider heads so it predicts a mix of rows, columns and eos
+    torch.manual_seed(0)
+    encoder = DonutSwinTableRecConfig(
+        image_size=(TINY_TABLE_IMAGE_SIZE["width"], TINY_TABLE_IMAGE_SIZE["height"]), embed_dim=8, depths=[1, 1, 1, 1], num_heads=[1, 2, 4, 8],
+        num_kv_heads=[1, 2, 4, 8], window_size=4, encoder_length=400
+    )
+    layer_config = dict(
+        num_hidden_layers=2, hidden_size=64, intermediate_size=128, encoder_hidden_size=64, num_attention_heads=4, num_key_value_heads=2,
+        cross_attn_layers=(0, 1), self_attn_layers=(0, 1), global_attn_layers=(0, 1), encoder_cross_attn_layers=(0, 1)
+    )
+    decoder = SuryaTableRecDecoderConfig(**layer_config)
+    text_encoder = SuryaTableRecTextEncoderConfig(**layer_config)
+    config = SuryaTableRecConfig(encoder=encoder.to_dict(), decoder=decoder.to_dict(), text_encoder=text_encoder.to_dict())
+    config.encoder, config.decoder, config.text_encoder = encoder, decoder, text_encoder
+    model = TableRecEncoderDecoderModel(config).eval()
+    with torch.no_grad():
+        model.decoder.class_head.weight.normal_(0, 2.0)
+        model.decoder.class_head.weight[:2] *= 0.6
+        model.decoder.bbox_head.weight.normal_(0, 1.0)
+    return model
+
+
+@pytest.fixture(scope="session")
+def table_processor():
+    image_processor = table_rec_processor.SuryaImageProcessor(image_mean=[0.5] * 3, image_std=[0.5] * 3)
+    with mock.patch.object(table_rec_processor.SuryaImageProcessor, "from_pretrained", return_value=image_processor):
+        processor = table_rec_processor.load_processor()
+    processor.image_processor.max_size = TINY_TABLE_IMAGE_SIZE
+    return processor
+
+
+@pytest.fixture(scope="session")
+def table_pages():
+    rng = np.random.default_rng(0)
+    images, cells = [], []
+    for _ in range(7):
+        width, height = int(rng.integers(200, 700)), int(rng.integers(150, 500))
+        images.append(Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8)))
+        page_cells = []
+        for _ in range(int(rng.integers(3, 30))):
+            x, y = float(rng.uniform(0, width - 30)), float(rng.uniform(0, height - 15))
+            page_cells.append({"bbox": [x, y, x + float(rng.uniform(5, 30)), y + float(rng.uniform(5, 15))], "text": "t"})
+        cells.append(page_cells)
+    return images, cells
+
+
+class DarkPixelDetectionModel(EfficientViTForSemanticSegmentation):
+    # Heatmaps from the dark pixels of the input instead of random weights, so detection finds the drawn lines
+    def forward(self, pixel_values):
+        gray = pixel_values.float().mean(dim=1, keepdim=True)
+        dark = (gray < gray.mean(dim=(2, 3), keepdim=True)).float()
+        dark = F.avg_pool2d(F.max_pool2d(dark, 5, stride=1, padding=2), 4)
+        position = torch.linspace(0, 1, dark.shape[-1], device=dark.device)[None, None, None, :]
+        if self.config.id2label[0] != "Blank":
+            # Text detection - the text heatmap, and an affinity map that fades out to the right
+            return SemanticSegmenterOutput(logits=torch.cat([dark, dark * (1 - position)], dim=1).to(pixel_values.dtype))
+
+        labels = [1 - dark]
+        for label_idx in range(1, self.config.num_labels):
+            # Later layout labels favor the right of the page, so there is more than one region type
+            labels.append(dark * (1 - (position - label_idx / self.config.num_labels).abs()))
+        return SemanticSegmenterOutput(logits=torch.cat(labels, dim=1).to(pixel_values.dtype))
+
+
+def make_det_model(labels=("Text", "Affinity")):
+    torch.manual_seed(0)
+    config = EfficientViTConfig(
+        num_labels=len(labels), widths=(8, 16, 32, 32, 64), hidden_sizes=(8, 16, 32, 32), head_dim=8, depths=(1, 1, 1, 1, 1),
+        decoder_layer_hidden_size=16, decoder_hidden_size=32, id2label=dict(enumerate(labels))
+    )
+    return DarkPixelDetectionModel(config).eval()
+
+
+@pytest.fixture(scope="session")
+def det_model():
+    return make_det_model()
+
+
+@pytest.fixture(scope="session")
+def det_processor():
+    return SegformerImageProcessor(size=TINY_DET_IMAGE_SIZE, do_resize=False)
+
+
+@pytest.fixture(scope="session")
+def det_pages():
+    # Pages with dark bars for text lines, a few taller than one detection split
+    rng = np.random.default_rng(0)
+    pages = []
+    for width, height in [(300, 400), (340, 900), (380, 250), (420, 600), (300, 300)]:
+        page = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(page)
+        for top in range(20, height - 30, 40):
+            left = int(rng.integers(10, 60))
+            draw.rectangle((left, top, int(rng.integers(left + 40, width - 10)), top + int(rng.integers(8, 16))), fill="black")
+        pages.append(page)
+    return pages
@@ -0,0 +1,70 @@
+import copy
+
+import numpy as np
+
+from surya.postprocessing.affinity import merge_vertical_lines
+from surya.schema import ColumnLine
+
+
+def merge_vertical_lines_pairwise(vertical_lines, processor_size, image_size, divisor=20, x_tolerance=40, y_tolerance=20):
+    # Compares every pair of lines, with the y overlap checked on sets of pixel rows
+    for line in vertical_lines:
+        line.rescale_bbox(processor_size, image_size)
+    vertical_lines = sorted(vertical_lines, key=lambda x: x.bbox[0])
+    for line in vertical_lines:
+        line.round_bbox(divisor)
+
+    to_remove = []
+    for i, line in enumerate(vertical_lines):
+        for j, line2 in enumerate(vertical_lines):
+            if j <= i or line.bbox[0] != line2.bbox[0]:
+                continue
+            line1_points = set(range(int(line.bbox[1] - y_tolerance), int(line.bbox[3] + y_tolerance)))
+            line2_points = set(range(int(line2.bbox[1]), int(line2.bbox[3])))
+            if len(line1_points.intersection(line2_points)) > 0:
+                vertical_lines[j].bbox[1] = min(line.bbox[1], line2.bbox[1])
+                vertical_lines[j].bbox[3] = max(line.bbox[3], line2.bbox[3])
+                to_remove.append(i)
+    vertical_lines = [line for i, line in enumerate(vertical_lines) if i not in to_remove]
+
+    to_remove = []
+    for i, line in enumerate(vertical_lines):
+        if i in to_remove:
+            continue
+        for j, line2 in enumerate(vertical_lines):
+            if j <= i or j in to_remove:
+                continue
+            close_in_x = abs(line.bbox[0] - line2.bbox[0]) < x_tolerance
+            line1_points = set(range(int(line.bbox[1]), int(line.bbox[3])))
+            line2_points = set(range(int(line2.bbox[1]), int(line2.bbox[3])))
+            if close_in_x and len(line1_points.intersection(line2_points)) > 0:
+                # Keep the longer line and extend it
+                if len(line2_points) > len(line1_points):
+                    vertical_lines[j].bbox[1] = min(line.bbox[1], line2.bbox[1])
+                    vertical_lines[j].bbox[3] = max(line.bbox[3], line2.bbox[3])
+                    to_remove.append(i)
+                else:
+                    vertical_lines[i].bbox[1] = min(line.bbox[1], line2.bbox[1])
+                    vertical_lines[i].bbox[3] = max(line.bbox[3], line2.bbox[3])
+                    to_remove.append(j)
+    vertical_lines = [line for i, line in enumerate(vertical_lines) if i not in to_remove]
+
+    if len(vertical_lines) > 0:
+        vertical_lines[0].bbox[1] = 0
+    return vertical_lines
+
+
+def test_merge_vertical_lines_matches_pairwise_checks():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        width, height = int(rng.integers(20, 500)), int(rng.integers(20, 700))
+        lines = []
+        for _ in range(int(rng.integers(0, 60))):
+            x = int(rng.integers(0, width))
+            y1, y2 = sorted(rng.integers(0, height, 2).tolist())
+            lines.append(ColumnLine(bbox=[np.int32(x), np.int32(y1), np.int32(x + rng.integers(0, 3)), np.int32(y2)], vertical=True, horizontal=False))
+        tolerances = dict(x_tolerance=int(rng.integers(1, 80)), y_tolerance=int(rng.integers(0, 60)))
+
+        merged = merge_vertical_lines(copy.deepcopy(lines), (500, 700), (1000, 1400), **tolerances)
+        expected = merge_vertical_lines_pairwise(copy.deepcopy(lines), (500, 700), (1000, 1400), **tolerances)
+        assert [line.model_dump() for line in merged] == [line.model_dump() for line in expected]
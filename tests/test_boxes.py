@@ -0,0 +1,23 @@
+import numpy as np
+
+from surya.layout import get_regions
+from surya.postprocessing.boxes import BoxArray
+from surya.schema import LayoutBox
+
+
+def test_to_boxes_validate():
+    boxes = BoxArray([[[0, 0], [10, 0], [10, 5], [0, 5]]]).rescale((10, 10), (20, 20))
+    assert boxes.to_boxes(LayoutBox, label=["Text"])[0].polygon[0] == [0, 0]
+    assert isinstance(boxes.to_boxes(LayoutBox, label=["Text"])[0].polygon[1][0], int)
+    assert isinstance(boxes.to_boxes(LayoutBox, validate=True, label=["Text"])[0].polygon[1][0], float)
+
+
+def test_regions_have_float_corners():
+    heatmaps = np.zeros((3, 100, 120), dtype=np.float32)
+    heatmaps[1, 10:30, 10:80] = .9
+    heatmaps[2, 50:70, 20:90] = .9
+    segment_assignment = heatmaps.argmax(axis=0)
+
+    regions = get_regions(list(heatmaps), (600, 500), {0: "Blank", 1: "Text", 2: "Table"}, segment_assignment)
+    assert len(regions) == 2
+    assert all([isinstance(coord, float) for region in regions for corner in region.model_dump()["polygon"] for coord in corner])
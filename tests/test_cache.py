@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from surya.schema import OCRResult, PolygonBox, TextDetectionResult, TextLine
+from surya.settings import settings
+from surya.util import cache as cache_module
+from surya.util.cache import PageResultCache, RecognitionCache, get_recognition_cache, iter_cached_pages
+
+
+def test_recognition_cache_lru():
+    cache = RecognitionCache(max_entries=2)
+    cache.put_many([("a", "first", 0.5), ("b", "second", 0.6)])
+    assert cache.get("a") == ("first", 0.5)
+
+    # "b" is now the least recently used
+    cache.put_many([("c", "third", 0.7)])
+    assert cache.get("b") is None
+    assert cache.get("a") == ("first", 0.5)
+    assert cache.get("c") == ("third", 0.7)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_recognition_cache_persists(tmp_path):
+    path = str(tmp_path / "lines" / "cache.sqlite")
+    RecognitionCache(max_entries=1, disk_path=path).put_many([("a", "first", 0.5), ("b", "second", 0.6)])
+
+    # Entries evicted from memory are still on disk, and a new cache reads them back
+    cache = RecognitionCache(max_entries=1, disk_path=path)
+    assert cache.get("a") == ("first", 0.5)
+    assert cache.get("b") == ("second", 0.6)
+    assert list(cache.entries) == ["b"]
+    assert cache.get("c") is None
+
+
+def test_recognition_cache_key():
+    pixels = np.random.default_rng(0).random((3, 8, 8), dtype=np.float32)
+    key = RecognitionCache.get_key(pixels, ["en"])
+    assert RecognitionCache.get_key(pixels.copy(), ["en"]) == key
+    assert RecognitionCache.get_key(pixels, ["fr"]) != key
+    assert RecognitionCache.get_key(pixels.astype(np.float16), ["en"]) != key
+
+    changed = pixels.copy()
+    changed[0, 0, 0] += 1
+    assert RecognitionCache.get_key(changed, ["en"]) != key
+
+
+def test_get_recognition_cache_follows_settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "_recognition_cache", None)
+    monkeypatch.setattr(settings, "RECOGNITION_CACHE_SIZE", 0)
+    monkeypatch.setattr(settings, "RECOGNITION_CACHE_PATH", None)
+    assert get_recognition_cache() is None
+
+    monkeypatch.setattr(settings, "RECOGNITION_CACHE_SIZE", 10)
+    cache = get_recognition_cache()
+    assert get_recognition_cache() is cache
+
+    monkeypatch.setattr(settings, "RECOGNITION_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    assert get_recognition_cache() is not cache
+    assert get_recognition_cache().disk_path == settings.RECOGNITION_CACHE_PATH
+
+
+def make_ocr_result(text):
+    line = TextLine(text=text, polygon=[[0, 0], [10, 0], [10, 5], [0, 5]], confidence=0.9)
+    return OCRResult(text_lines=[line], languages=["en"], image_bbox=[0, 0, 100, 100])
+
+
+def test_page_result_cache(tmp_path):
+    path = str(tmp_path / "pages.sqlite")
+    cache = PageResultCache(path)
+    key = cache.get_key(__file__, 0, "ocr")
+    assert cache.get(key, OCRResult) is None
+
+    cache.put(key, make_ocr_result("hello"))
+    assert cache.get(key, OCRResult) == make_ocr_result("hello")
+    cache.close()
+    cache = PageResultCache(path)
+    assert cache.get(key, OCRResult) == make_ocr_result("hello")
+
+    # Maps aren't stored
+    detection = TextDetectionResult(bboxes=[PolygonBox(polygon=[[0, 0], [10, 0], [10, 5], [0, 5]])], vertical_lines=[], heatmap=Image.new("L", (10, 10)), affinity_map=Image.new("L", (10, 10)), image_bbox=[0, 0, 10, 10])
+    cache.put("detection", detection)
+    assert cache.get("detection", TextDetectionResult) == detection.model_copy(update={"heatmap": None, "affinity_map": None})
+
+
+def test_page_result_cache_key(tmp_path, monkeypatch):
+    document = tmp_path / "doc.pdf"
+    document.write_bytes(b"first version")
+    cache = PageResultCache(str(tmp_path / "pages.sqlite"))
+    key = cache.get_key(str(document), 0, "detection")
+    assert cache.get_key(str(document), 0, "detection") == key
+
+    for other_key in [
+        cache.get_key(str(document), 1, "detection"),
+        cache.get_key(str(document), 0, "layout"),
+        cache.get_key(str(document), 0, "detection", extra={"langs": ["en"]}),
+    ]:
+        assert other_key != key
+
+    # Only the settings the stage depends on are part of the key
+    monkeypatch.setattr(settings, "RECOGNITION_BATCH_SIZE", 3)
+    assert cache.get_key(str(document), 0, "detection") == key
+    monkeypatch.setattr(settings, "DETECTOR_TEXT_THRESHOLD", 0.5)
+    assert cache.get_key(str(document), 0, "detection") != key
+    monkeypatch.undo()
+
+    # Changed files get new keys
+    document.write_bytes(b"second version")
+    os.utime(document, ns=(0, 0))
+    assert cache.get_key(str(document), 0, "detection") != key
+
+
+def test_iter_cached_pages(tmp_path):
+    cache = PageResultCache(str(tmp_path / "pages.sqlite"))
+    keys = ["a", "b", "c", "d"]
+    cache.put("b", make_ocr_result("cached b"))
+    cache.put("d", make_ocr_result("cached d"))
+
+    computed = []
+
+    def compute(idxs):
+        computed.append(idxs)
+        return [make_ocr_result(f"computed {keys[idx]}") for idx in idxs]
+
+    results = list(iter_cached_pages(cache, keys, OCRResult, compute))
+    assert computed == [[0, 2]]
+    assert [result.text_lines[0].text for result in results] == ["computed a", "cached b", "computed c", "cached d"]
+
+    # Computed pages are stored, so the next run computes nothing
+    assert [result.text_lines[0].text for result in iter_cached_pages(cache, keys, OCRResult, compute)] == ["computed a", "cached b", "computed c", "cached d"]
+    assert computed == [[0, 2]]
+    assert list(iter_cached_pages(None, keys[:2], OCRResult, compute)) == [make_ocr_result("computed a"), make_ocr_result("computed b")]
@@ -0,0 +1,79 @@
+from unittest import mock
+
+import pytest
+
+import surya.recognition
+import surya.util.cache
+from surya.recognition import batch_recognition, continuous_batch_recognition
+from surya.settings import settings
+from surya.util.cache import get_recognition_cache
+
+from conftest import make_tiny_rec_model, decoded_token_counts, get_generation_limit
+
+
+def test_continuous_batching_token_limit(rec_processor, line_images, token_limit_model, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    langs = [["en"]] * len(line_images)
+
+    (batched_text, _), batched_counts = decoded_token_counts(rec_processor, lambda: batch_recognition(line_images, langs, token_limit_model, rec_processor, batch_size=4))
+    (continuous_text, _), continuous_counts = decoded_token_counts(rec_processor, lambda: continuous_batch_recognition(line_images, langs, token_limit_model, rec_processor, batch_size=4))
+
+    assert set(batched_counts) == {get_generation_limit()}
+    assert set(continuous_counts) == {get_generation_limit()}
+    assert continuous_text == batched_text
+
+
+def test_continuous_batching_non_causal_fallback(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", True)
+    model = make_tiny_rec_model(causal=False, eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+
+    with mock.patch("surya.recognition.continuous_batch_recognition") as continuous:
+        batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    continuous.assert_not_called()
+
+
+def test_continuous_batching_with_recognition_cache(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    monkeypatch.setattr(surya.util.cache, "_recognition_cache", None)
+    model = make_tiny_rec_model(causal=True, eos_scale=8.)
+    # Every line shows up twice, so repeats within the run are looked up too
+    images = line_images + line_images[::-1]
+    langs = [["en"]] * len(images)
+
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    expected = batch_recognition(images, langs, model, rec_processor, batch_size=4)
+
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", True)
+    monkeypatch.setattr(settings, "RECOGNITION_CACHE_SIZE", 100)
+    continuous = mock.patch.object(surya.recognition, "continuous_batch_recognition", wraps=surya.recognition.continuous_batch_recognition)
+    with continuous as continuous_batch_recognition:
+        (first_text, first_confidences), first_counts = decoded_token_counts(rec_processor, lambda: batch_recognition(images, langs, model, rec_processor, batch_size=4))
+    continuous_batch_recognition.assert_called_once()
+    assert first_text == expected[0]
+    assert first_confidences == pytest.approx(expected[1])
+    assert sum([count > 0 for count in first_counts]) == len(line_images)
+
+    with mock.patch.object(model.decoder, "forward", side_effect=AssertionError("cached lines shouldn't be decoded")):
+        assert batch_recognition(images, langs, model, rec_processor, batch_size=4) == (first_text, first_confidences)
+    assert get_recognition_cache().hits == len(line_images)
+
+
+def test_continuous_batching_with_drafts(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    model = make_tiny_rec_model(causal=True, eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    plain_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    drafts = [text if idx % 3 == 0 else None for idx, text in enumerate(plain_text)]
+
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", True)
+    continuous = mock.patch.object(surya.recognition, "continuous_batch_recognition", wraps=surya.recognition.continuous_batch_recognition)
+    with continuous as continuous_batch_recognition:
+        draft_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4, drafts=drafts)
+
+    assert draft_text == plain_text
+    # Lines without a draft are still decoded with continuous batching
+    assert len(continuous_batch_recognition.call_args.args[0]) == sum([draft is None for draft in drafts])
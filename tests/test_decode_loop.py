@@ -0,0 +1,50 @@
+from unittest import mock
+
+import pytest
+import torch
+
+from surya.recognition import batch_recognition, decode_batch, get_done_check_interval
+from surya.settings import settings
+
+from conftest import make_tiny_rec_model, get_generation_limit
+
+
+@pytest.mark.parametrize("static_cache", [False, True])
+def test_decode_batch_does_not_sync(rec_processor, token_limit_model, monkeypatch, static_cache):
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_CACHE", static_cache)
+    # Never check for early exit, so any host sync left comes from the decode steps
+    monkeypatch.setattr(settings, "RECOGNITION_DONE_CHECK_INTERVAL", 1000)
+    model = token_limit_model
+    encoder_text_hidden_states = torch.randn(3, model.config.text_encoder.query_token_count, model.config.decoder.encoder_hidden_size)
+    decoder_input = [[model.config.decoder_start_token_id, 5]] * 3
+
+    syncs = []
+    item, to_bool = torch.Tensor.item, torch.Tensor.__bool__
+
+    def counting_item(tensor):
+        syncs.append("item")
+        return item(tensor)
+
+    def counting_bool(tensor):
+        syncs.append("bool")
+        return to_bool(tensor)
+
+    with mock.patch.object(torch.Tensor, "item", counting_item), mock.patch.object(torch.Tensor, "__bool__", counting_bool):
+        predictions, _ = decode_batch(model, rec_processor, encoder_text_hidden_states, decoder_input, batch_size=4)
+
+    assert [len(tokens) for tokens in predictions] == [get_generation_limit()] * 3
+    assert syncs == []
+
+
+@pytest.mark.parametrize("interval", [0, -2])
+def test_decode_batch_done_check_interval_below_one(rec_processor, line_images, monkeypatch, interval):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    model = make_tiny_rec_model(eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+
+    monkeypatch.setattr(settings, "RECOGNITION_DONE_CHECK_INTERVAL", 1)
+    expected = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    monkeypatch.setattr(settings, "RECOGNITION_DONE_CHECK_INTERVAL", interval)
+    assert get_done_check_interval() == 1
+    assert batch_recognition(line_images, langs, model, rec_processor, batch_size=4) == expected
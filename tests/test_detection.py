@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from surya.detection import batch_text_detection, get_device_detection_maps
+from surya.layout import batch_layout_detection, batch_text_and_layout_detection
+from surya.model.detection.processor import SegformerImageProcessor
+from surya.postprocessing.heatmap import get_dynamic_thresholds
+from surya.settings import settings
+
+from conftest import make_det_model
+
+
+@pytest.mark.parametrize("shared_preprocessing", [True, False])
+def test_text_and_layout_detection_matches_separate_runs(det_model, det_processor, det_pages, shared_preprocessing):
+    layout_model = make_det_model(labels=("Blank", "Text", "Figure", "Table", "Caption"))
+    layout_processor = det_processor
+    if not shared_preprocessing:
+        layout_processor = SegformerImageProcessor(size={"height": 128, "width": 128}, do_resize=False)
+
+    expected_lines = batch_text_detection(det_pages, det_model, det_processor, batch_size=3)
+    expected_layout = batch_layout_detection(det_pages, layout_model, layout_processor, detection_results=expected_lines, batch_size=3)
+    lines, layout = batch_text_and_layout_detection(det_pages, det_model, det_processor, layout_model, layout_processor, batch_size=3)
+
+    assert all([len(result.bboxes) > 0 for result in layout])
+    assert lines == expected_lines
+    assert layout == expected_layout
+
+
+def test_device_detection_maps_match_cpu_thresholds():
+    rng = np.random.default_rng(0)
+    heatmap = cv2.GaussianBlur(rng.random((200, 160), dtype=np.float32), (0, 0), 2)
+    heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
+    affinity_map = rng.random((200, 160), dtype=np.float32) * 0.2
+    affinity_map[20:180, 70:74] = 0.9
+    maps = get_device_detection_maps(torch.from_numpy(heatmap), torch.from_numpy(affinity_map))
+
+    text_threshold, low_text = get_dynamic_thresholds(heatmap, settings.DETECTOR_TEXT_THRESHOLD, settings.DETECTOR_BLANK_THRESHOLD)
+    assert maps.text_threshold == pytest.approx(text_threshold)
+    assert np.array_equal(maps.text_mask, (heatmap > low_text).astype(np.uint8))
+    assert np.array_equal(maps.seed_coords, np.argwhere(heatmap >= text_threshold))
+    assert np.array_equal(maps.seed_values, heatmap[heatmap >= text_threshold])
+
+    # The 8-bit horizontal sobel the column line detection starts from
+    sobel = np.absolute(cv2.Sobel(affinity_map * 255, cv2.CV_32F, 1, 0, ksize=3))
+    assert np.array_equal(maps.affinity_sobel, np.uint8(255 * sobel / np.max(sobel)))
+
+
+def test_device_postprocessing_matches_cpu_path(det_model, det_processor, det_pages, monkeypatch):
+    expected = batch_text_detection(det_pages, det_model, det_processor, batch_size=3)
+    monkeypatch.setattr(settings, "DETECTOR_DEVICE_POSTPROCESSING", True)
+    assert batch_text_detection(det_pages, det_model, det_processor, batch_size=3) == expected
+    # The maps need the full heatmaps, so they still come from the cpu path
+    assert batch_text_detection(det_pages[:1], det_model, det_processor, include_maps=True)[0].heatmap is not None
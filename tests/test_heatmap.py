@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+from surya.postprocessing.heatmap import clean_boxes, detect_boxes, get_component_maxes, get_dynamic_thresholds, keep_largest_boxes
+from surya.schema import PolygonBox
+
+
+def make_linemap(seed, size=(120, 160)):
+    # Smoothed noise, so there are components of many sizes and peaks
+    linemap = cv2.GaussianBlur(np.random.default_rng(seed).random(size, dtype=np.float32), (0, 0), 2)
+    return (linemap - linemap.min()) / (linemap.max() - linemap.min())
+
+
+def test_component_maxes_match_per_component_loop():
+    for seed in range(5):
+        linemap = make_linemap(seed)
+        label_count, labels, _, _ = cv2.connectedComponentsWithStats((linemap > 0.5).astype(np.uint8), connectivity=4)
+        expected = [np.max(linemap[labels == k]) for k in range(1, label_count)]
+        assert label_count > 10
+        assert get_component_maxes(linemap, labels, label_count)[1:].tolist() == expected
+
+
+def test_detect_boxes_filters_like_per_component_loop():
+    for seed in range(5):
+        linemap = make_linemap(seed)
+        _, confidences = detect_boxes(linemap, 0.8, 0.6)
+
+        # Components are kept if they have at least 10 pixels and reach the text threshold
+        text_threshold, low_text = get_dynamic_thresholds(linemap, 0.8, 0.6)
+        label_count, labels, stats, _ = cv2.connectedComponentsWithStats((linemap > low_text).astype(np.uint8), connectivity=4)
+        maxes = [np.max(linemap[labels == k]) for k in range(1, label_count) if stats[k, cv2.CC_STAT_AREA] >= 10]
+        maxes = [line_max for line_max in maxes if line_max >= text_threshold]
+        assert 5 < len(maxes) < label_count - 1
+        assert confidences == [line_max / max(maxes) for line_max in maxes]
+
+
+def keep_largest_boxes_pairwise(boxes):
+    # Checks every pair of boxes
+    new_boxes = []
+    for box_obj in boxes:
+        box = box_obj.bbox
+        box_area = (box[2] - box[0]) * (box[3] - box[1])
+        contained = False
+        for other_box_obj in boxes:
+            other_box = other_box_obj.bbox
+            if other_box_obj.polygon == box_obj.polygon or box == other_box:
+                continue
+            other_box_area = (other_box[2] - other_box[0]) * (other_box[3] - other_box[1])
+            if box_obj.intersection_pct(other_box_obj) > .9 and box_area < other_box_area:
+                contained = True
+                break
+        if not contained:
+            new_boxes.append(box_obj)
+    return new_boxes
+
+
+def clean_boxes_pairwise(boxes):
+    # Checks every pair of boxes
+    new_boxes = []
+    for box_obj in boxes:
+        xs = [point[0] for point in box_obj.polygon]
+        ys = [point[1] for point in box_obj.polygon]
+        if max(xs) == min(xs) or max(ys) == min(ys):
+            continue
+
+        box = box_obj.bbox
+        contained = False
+        for other_box_obj in boxes:
+            other_box = other_box_obj.bbox
+            if other_box_obj.polygon == box_obj.polygon or box == other_box:
+                continue
+            if box[0] >= other_box[0] and box[1] >= other_box[1] and box[2] <= other_box[2] and box[3] <= other_box[3]:
+                contained = True
+                break
+        if not contained:
+            new_boxes.append(box_obj)
+    return new_boxes
+
+
+def make_boxes(rng, count, grid):
+    # Boxes on a small grid, so there are plenty of nested, duplicate, touching and flat boxes
+    boxes = []
+    for _ in range(count):
+        x1, y1 = rng.integers(0, grid, 2)
+        x2, y2 = x1 + rng.integers(0, grid // 3 + 1), y1 + rng.integers(0, grid // 3 + 1)
+        kind = rng.integers(0, 4)
+        if kind == 0 and len(boxes) > 0:
+            # Inside an earlier box
+            outer = boxes[rng.integers(len(boxes))].bbox
+            x1, y1 = rng.integers(int(outer[0]), int(outer[2]) + 1), rng.integers(int(outer[1]), int(outer[3]) + 1)
+            x2, y2 = rng.integers(x1, int(outer[2]) + 1), rng.integers(y1, int(outer[3]) + 1)
+        elif kind == 1 and len(boxes) > 0:
+            boxes.append(PolygonBox(polygon=boxes[rng.integers(len(boxes))].polygon))
+            continue
+
+        polygon = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        if kind == 2:
+            polygon = polygon[2:] + polygon[:2]
+        boxes.append(PolygonBox(polygon=[[float(x) if rng.random() < .5 else int(x), int(y)] for x, y in polygon]))
+    return boxes
+
+
+def test_box_filters_match_pairwise_checks():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        boxes = make_boxes(rng, rng.integers(0, 40), rng.integers(3, 50))
+        assert [id(box) for box in clean_boxes(boxes)] == [id(box) for box in clean_boxes_pairwise(boxes)]
+        assert [id(box) for box in keep_largest_boxes(boxes)] == [id(box) for box in keep_largest_boxes_pairwise(boxes)]
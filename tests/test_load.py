@@ -0,0 +1,84 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from surya.input.load import load_from_file, load_from_folder, load_pdf
+from surya.input.processing import LazyPdfPages, get_pdf_page_images
+from surya.input.rasterize import shutdown_render_pool
+from surya.settings import settings
+
+
+def make_pdf(path, page_count=7):
+    # Pages of different sizes and contents, so a page rendered out of order doesn't match
+    pages = []
+    for idx in range(page_count):
+        page = Image.new("RGB", (200 + 10 * idx, 150 + 30 * idx), "white")
+        ImageDraw.Draw(page).rectangle((10, 10 + 10 * idx, 60 + 15 * idx, 30 + 10 * idx), fill="black")
+        pages.append(page)
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    return str(path)
+
+
+def assert_same_pages(pages, expected):
+    assert [page.size for page in pages] == [page.size for page in expected]
+    assert all([np.array_equal(np.asarray(page), np.asarray(expected_page)) for page, expected_page in zip(pages, expected)])
+
+
+def make_folder(tmp_path):
+    pages = [Image.new("RGB", (200, 100 + 20 * idx), "white") for idx in range(3)]
+    pages[0].save(tmp_path / "doc.pdf", save_all=True, append_images=pages[1:])
+    pages[0].save(tmp_path / "page.png")
+    (tmp_path / "notes.txt").write_text("not an image")
+    return tmp_path
+
+
+def test_load_from_folder_sources(tmp_path):
+    folder = make_folder(tmp_path)
+    images, names, text_lines, sources = load_from_folder(str(folder), max_pages=2, lazy=True, return_sources=True)
+
+    # Unreadable files are skipped, and every page keeps its file and page index
+    assert len(sources) == len(images) == len(names) == len(text_lines) == 3
+    assert sorted(sources) == [(str(folder / "doc.pdf"), 0), (str(folder / "doc.pdf"), 1), (str(folder / "page.png"), 0)]
+    for (path, page_idx), name, image in zip(sources, names, images):
+        assert path.endswith(name + ".pdf") or path.endswith(name + ".png")
+        if path.endswith(".pdf"):
+            assert image.size == load_from_file(path, max_pages=1, start_page=page_idx)[0][0].size
+
+    assert load_from_folder(str(folder), max_pages=2)[1] == names
+
+
+def test_load_from_file_sources(tmp_path):
+    folder = make_folder(tmp_path)
+    _, _, _, sources = load_from_file(str(folder / "doc.pdf"), start_page=1, return_sources=True)
+    assert sources == [(str(folder / "doc.pdf"), 1), (str(folder / "doc.pdf"), 2)]
+    assert load_from_file(str(folder / "page.png"), return_sources=True)[3] == [(str(folder / "page.png"), 0)]
+
+
+def test_lazy_pdf_pages_match_eager(tmp_path):
+    pdf_path = make_pdf(tmp_path / "doc.pdf")
+    eager, _, _ = load_pdf(pdf_path, start_page=1)
+    assert load_pdf(pdf_path, start_page=1, lazy=True)[0].sizes == [page.size for page in eager]
+
+    lazy = LazyPdfPages(pdf_path, range(1, 7), window_size=2)
+    # In order, backwards, and jumping around, never holding more than the window
+    for idxs in [range(6), range(5, -1, -1), [3, 0, 5, -1, 2, 2]]:
+        pages = []
+        for idx in idxs:
+            pages.append(lazy[idx])
+            assert len(lazy._cache) <= 2
+        assert_same_pages(pages, [eager[idx] for idx in idxs])
+    assert_same_pages(lazy[1:4], eager[1:4])
+    lazy.close()
+
+
+def test_render_pool_matches_serial(tmp_path, monkeypatch):
+    pdf_path = make_pdf(tmp_path / "doc.pdf")
+    page_indices = [6, 0, 3, 2, 5, 1]
+    serial = get_pdf_page_images(pdf_path, page_indices)
+
+    # Three chunks across two workers, read back in page order
+    monkeypatch.setattr(settings, "PDF_RENDER_WORKERS", 2)
+    monkeypatch.setattr(settings, "PDF_RENDER_CHUNK_SIZE", 2)
+    try:
+        assert_same_pages(get_pdf_page_images(pdf_path, page_indices), serial)
+    finally:
+        shutdown_render_pool()
@@ -0,0 +1,27 @@
+import pytest
+
+from surya.ocr import iter_ocr, run_ocr
+from surya.settings import settings
+
+from conftest import make_tiny_rec_model
+
+
+def line_results(result):
+    return [(line.text, line.polygon) for line in result.text_lines]
+
+
+@pytest.mark.parametrize("max_pages_in_flight", [1, 2, 5])
+def test_iter_ocr_matches_run_ocr(det_model, det_processor, det_pages, rec_processor, max_pages_in_flight, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_MAX_TOKENS", 24)
+    rec_model = make_tiny_rec_model(eos_scale=8.)
+    langs = [["en"]] * len(det_pages)
+    expected = run_ocr(det_pages, langs, det_model, det_processor, rec_model, rec_processor)
+    results = list(iter_ocr(det_pages, langs, det_model, det_processor, rec_model, rec_processor, max_pages_in_flight=max_pages_in_flight))
+
+    # One result per page, in page order, whatever the window size
+    assert [result.image_bbox for result in results] == [[0, 0, page.size[0], page.size[1]] for page in det_pages]
+    assert all([len(result.text_lines) > 0 for result in results])
+    for result, expected_result in zip(results, expected):
+        assert line_results(result) == line_results(expected_result)
+        # Windows batch different lines together, which can move the scores slightly
+        assert [line.confidence for line in result.text_lines] == pytest.approx([line.confidence for line in expected_result.text_lines], rel=1e-4)
@@ -0,0 +1,103 @@
+from unittest import mock
+
+import pytest
+
+from surya.ordering import batch_ordering, get_layout_complexity, get_step_box_count, tiered_ordering, xy_cut_order
+from surya.schema import ColumnLine
+from surya.settings import settings
+
+
+def get_positions(results):
+    return [[box.position for box in result.bboxes] for result in results]
+
+
+def test_batch_ordering_clears_static_cache_on_error(order_model, order_processor, order_pages):
+    images, bboxes = order_pages
+    expected = get_positions(batch_ordering(images, bboxes, order_model, order_processor, batch_size=2))
+
+    decoder = order_model.decoder.model.decoder
+    with mock.patch.object(order_model.decoder, "forward", side_effect=RuntimeError("decode failed")):
+        with pytest.raises(RuntimeError):
+            batch_ordering(images, bboxes, order_model, order_processor, batch_size=2)
+
+    assert not decoder.static_cache
+    assert not any([layer.self_attn.static_cache or layer.encoder_attn.static_cache for layer in decoder.layers])
+    assert get_positions(batch_ordering(images, bboxes, order_model, order_processor, batch_size=2)) == expected
+
+
+@pytest.mark.parametrize("boxes_per_step", [0, -3])
+def test_multibox_ordering_places_a_box_per_step(order_model, order_processor, order_pages, monkeypatch, boxes_per_step):
+    monkeypatch.setattr(settings, "ORDER_MULTIBOX_BOXES_PER_STEP", boxes_per_step)
+    assert get_step_box_count("multibox", [5, 12], 2, 0, 12) == 1
+
+    images, bboxes = order_pages
+    results = batch_ordering(images, bboxes, order_model, order_processor, batch_size=2, engine="multibox")
+    for positions, page_bboxes in zip(get_positions(results), bboxes):
+        assert sorted(positions) == list(range(len(page_bboxes)))
+
+
+def test_batch_ordering_groups_pages_by_box_count(order_model, order_processor, order_pages):
+    images, bboxes = order_pages
+    # Pages with equal box counts share a batch, so each gets the order it gets alone, in input order, even when passed twice
+    page_idxs = [0, 2, 4, 1, 2, 3, 3]
+    batch_images, batch_bboxes = [images[idx] for idx in page_idxs], [bboxes[idx] for idx in page_idxs]
+    expected = get_positions(batch_ordering(batch_images, batch_bboxes, order_model, order_processor, batch_size=1))
+    assert get_positions(batch_ordering(batch_images, batch_bboxes, order_model, order_processor, batch_size=2)) == expected
+
+    # Mixed counts slice finished pages off mid batch, and every page still gets each position once
+    for positions, page_bboxes in zip(get_positions(batch_ordering(images, bboxes, order_model, order_processor, batch_size=6)), bboxes):
+        assert sorted(positions) == list(range(len(page_bboxes)))
+
+
+# A header, two columns of three lines, and a footer.  The right column sits a bit lower, so there is no gap across both.
+TWO_COLUMN_PAGE = [
+    [300, 500, 360, 520],
+    [50, 100, 250, 124], [300, 110, 500, 134],
+    [50, 130, 250, 154], [300, 140, 500, 164],
+    [50, 160, 250, 184], [300, 170, 500, 194],
+    [50, 20, 500, 60],
+]
+
+
+def test_layout_complexity():
+    single_column = [[50, 100 + 30 * line, 500, 120 + 30 * line] for line in range(10)]
+    assert get_layout_complexity(single_column) == 0.
+    assert get_layout_complexity(single_column[:1]) == 0.
+
+    # A page number next to the last line only counts the two of them
+    assert get_layout_complexity(single_column + [[510, 370, 530, 390]]) == pytest.approx((450 * 20 + 20 * 20) / (10 * 450 * 20 + 20 * 20))
+    assert get_layout_complexity(TWO_COLUMN_PAGE) == pytest.approx(6 * 200 * 24 / (6 * 200 * 24 + 450 * 40 + 60 * 20))
+
+    # Boxes split by a column line count even when they don't line up
+    staggered = [[50, 100, 250, 120], [300, 140, 500, 160]]
+    assert get_layout_complexity(staggered) == 0.
+    assert get_layout_complexity(staggered, [ColumnLine(bbox=[270, 80, 272, 200], vertical=True, horizontal=False)]) == 1.
+
+
+def test_xy_cut_order():
+    # Header, left column, right column, footer
+    assert xy_cut_order(TWO_COLUMN_PAGE) == [7, 1, 3, 5, 2, 4, 6, 0]
+    assert xy_cut_order([[0, 40, 10, 50], [0, 0, 10, 10], [0, 20, 10, 30]]) == [1, 2, 0]
+    # Overlapping both ways, so no cut - top to bottom, then left to right
+    assert xy_cut_order([[20, 0, 60, 40], [0, 10, 30, 30], [10, 0, 50, 20]]) == [2, 0, 1]
+    assert xy_cut_order([]) == []
+
+
+def test_tiered_ordering(order_model, order_processor, order_pages):
+    images, bboxes = order_pages
+    single_column = [[50, 30 + 30 * line, 250, 50 + 30 * line] for line in range(8)]
+    page_bboxes = [single_column, bboxes[3], TWO_COLUMN_PAGE, bboxes[2]]
+    page_images = [images[0], images[3], images[2], images[2]]
+
+    results, stats = tiered_ordering(page_images, page_bboxes, order_model, order_processor, batch_size=2)
+    assert stats["heuristic"] == 1 and stats["model"] == 3
+    assert get_positions(results[:1]) == [list(range(8))]
+
+    # The complex pages get the model order
+    model_results = batch_ordering(page_images[1:], page_bboxes[1:], order_model, order_processor, batch_size=2)
+    assert get_positions(results[1:]) == get_positions(model_results)
+
+    # With the limit at the two column page's complexity, only the busier random page goes to the model
+    results, stats = tiered_ordering(page_images[:3], page_bboxes[:3], order_model, order_processor, max_complexity=stats["complexity"][2])
+    assert stats["model"] == 1
+    assert get_positions(results[2:]) == [[7, 1, 4, 2, 5, 3, 6, 0]]
@@ -0,0 +1,20 @@
+from surya.input.pdflines import is_valid_glyph, score_text_layer_line
+
+
+def test_is_valid_glyph():
+    assert is_valid_glyph("a")
+    assert is_valid_glyph(" ")
+    assert not is_valid_glyph("")
+    assert not is_valid_glyph("�")
+    assert not is_valid_glyph("")
+
+
+def test_unmapped_glyphs_are_not_valid():
+    polygon = [[0, 0], [40, 0], [40, 10], [0, 10]]
+    chars = [
+        {"char": "a", "bbox": [0, 0, 10, 10]},
+        {"char": "", "bbox": [10, 0, 20, 10]},
+        {"char": "", "bbox": [20, 0, 30, 10]},
+        {"char": "b", "bbox": [30, 0, 40, 10]},
+    ]
+    assert score_text_layer_line(chars, polygon)["valid"] == 0.5
@@ -0,0 +1,51 @@
+import numpy as np
+from transformers.image_utils import ChannelDimension
+
+from surya.input.processing import slice_and_pad_poly, slice_polys_from_array
+from surya.settings import settings
+
+
+def test_slice_polys_from_array_matches_pil_path():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (200, 300, 3), dtype=np.uint8)
+    polys = []
+    for _ in range(40):
+        x1, y1 = rng.integers(0, 250), rng.integers(0, 150)
+        x2, y2 = x1 + rng.integers(1, 50), y1 + rng.integers(1, 50)
+        rectangle = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        # Rectangles starting from any corner, and skewed quads that need the mask
+        polys.append(np.roll(rectangle, int(rng.integers(0, 4)), axis=0).tolist())
+        polys.append([[x1, y1], [x2, y1 + 3], [x2 - 2, y2], [x1 + 4, y2 - 1]])
+    polys.append([[10, 10], [10, 10], [40, 30], [40, 30]])
+
+    lines = slice_polys_from_array(image, polys)
+    assert len(lines) == len(polys)
+    for line, poly in zip(lines, polys):
+        assert np.array_equal(line, np.asarray(slice_and_pad_poly(image, poly)))
+
+
+def preprocess_per_image(image_processor, images):
+    # Recognition preprocessing one line at a time, in separate resize, pad, rescale and normalize steps
+    lines = []
+    for image in images:
+        image = image_processor.align_long_axis(image, size=image_processor.max_size, input_data_format=ChannelDimension.LAST)
+        image = image_processor.numpy_resize(image, image_processor.max_size, image_processor.resample).astype(np.float32)
+        image = image_processor.pad_image(image=image, size=image_processor.max_size, input_data_format=ChannelDimension.FIRST, pad_value=settings.RECOGNITION_PAD_VALUE)
+        image = image * image_processor.rescale_factor
+        lines.append(image_processor.normalize(image, mean=image_processor.image_mean, std=image_processor.image_std, input_data_format=ChannelDimension.FIRST))
+    return np.stack(lines, axis=0)
+
+
+def test_batched_recognition_preprocessing_matches_per_image(rec_processor, line_images):
+    # A tall line gets rotated first
+    images = line_images + [np.ascontiguousarray(line_images[0].transpose(1, 0, 2))]
+    image_processor = rec_processor.image_processor
+    expected = preprocess_per_image(image_processor, images)
+
+    pixel_values = image_processor.process_inner(images)
+    assert pixel_values.dtype == np.float32
+    np.testing.assert_allclose(pixel_values, expected, atol=1e-5)
+
+    half_pixel_values = image_processor.process_inner(images, dtype=np.float16)
+    assert half_pixel_values.dtype == np.float16
+    np.testing.assert_allclose(half_pixel_values.astype(np.float32), expected, atol=1e-2)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from surya.recognition import batch_recognition, estimate_token_count, get_recognition_order
+from surya.settings import settings
+
+from conftest import make_tiny_rec_model
+
+
+def test_estimate_token_count():
+    line = np.zeros((20, 200, 3), dtype=np.uint8)
+    latin = estimate_token_count(line, ["en"])
+    # CJK glyphs are about twice as wide, and math takes more tokens per glyph
+    assert estimate_token_count(line, ["zh"]) < latin < estimate_token_count(line, ["en", "_math"])
+    # Tall lines are rotated before recognition
+    assert estimate_token_count(np.ascontiguousarray(line.transpose(1, 0, 2)), ["en"]) == latin
+    assert estimate_token_count(np.zeros((2, 5000, 3), dtype=np.uint8), ["en"]) == settings.RECOGNITION_MAX_TOKENS + 2
+
+
+def test_recognition_order_by_estimated_length(monkeypatch):
+    lines = [np.zeros((20, width, 3), dtype=np.uint8) for width in [400, 100, 300, 200]]
+    langs = [["en"], ["en"], ["zh"], ["en", "_math"]]
+    assert get_recognition_order(lines, langs) == [1, 2, 0, 3]
+
+    monkeypatch.setattr(settings, "RECOGNITION_LENGTH_BUCKETING", False)
+    assert get_recognition_order(lines, langs) == [1, 3, 2, 0]
+
+
+@pytest.mark.parametrize("length_bucketing", [False, True])
+def test_bucketed_recognition_keeps_lines_with_their_languages(rec_processor, line_images, monkeypatch, length_bucketing):
+    monkeypatch.setattr(settings, "RECOGNITION_LENGTH_BUCKETING", length_bucketing)
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_MAX_TOKENS", 24)
+    model = make_tiny_rec_model(eos_scale=8.)
+    # Same length prompts, so batches don't need padding
+    langs = [[["en"], ["zh"], ["hi"], ["ru"]][idx % 4] for idx in range(len(line_images))]
+
+    # One line per batch can't mix up lines and languages
+    expected_text, expected_confidences = zip(*[batch_recognition([image], [lang], model, rec_processor, batch_size=1) for image, lang in zip(line_images, langs)])
+    text, confidences = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    assert text == [line_text[0] for line_text in expected_text]
+    assert confidences == pytest.approx([confidence[0] for confidence in expected_confidences], rel=1e-4)
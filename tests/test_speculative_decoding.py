@@ -0,0 +1,40 @@
+from unittest import mock
+
+import surya.recognition
+from surya.recognition import batch_recognition
+from surya.settings import settings
+
+from conftest import make_tiny_rec_model, decoded_token_counts, get_generation_limit
+
+
+def test_speculative_decoding_token_limit(rec_processor, line_images, token_limit_model, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    langs = [["en"]] * len(line_images)
+
+    (plain_text, _), plain_counts = decoded_token_counts(rec_processor, lambda: batch_recognition(line_images, langs, token_limit_model, rec_processor, batch_size=4))
+    assert set(plain_counts) == {get_generation_limit()}
+
+    for drafts in [plain_text, ["hello world"] * len(line_images)]:
+        (draft_text, _), draft_counts = decoded_token_counts(rec_processor, lambda: batch_recognition(line_images, langs, token_limit_model, rec_processor, batch_size=4, drafts=drafts))
+        assert sorted(draft_counts) == sorted(plain_counts)
+        assert draft_text == plain_text
+
+
+def test_speculative_decoding_rows_without_drafts(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    model = make_tiny_rec_model(causal=True, eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+
+    plain_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    drafts = [text if idx % 3 == 0 else None for idx, text in enumerate(plain_text)]
+
+    speculative = mock.patch.object(surya.recognition, "speculative_decode_batch", wraps=surya.recognition.speculative_decode_batch)
+    with speculative as speculative_decode_batch:
+        draft_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4, drafts=drafts)
+
+    assert draft_text == plain_text
+    speculated_drafts = [draft for call in speculative_decode_batch.call_args_list for draft in call.args[4]]
+    assert len(speculated_drafts) == sum([bool(draft) for draft in drafts])
+    assert all([draft is not None for draft in speculated_drafts])
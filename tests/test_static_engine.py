@@ -0,0 +1,57 @@
+from unittest import mock
+
+import pytest
+
+import surya.model.recognition.static_decoder as static_decoder
+from surya.recognition import batch_recognition, static_decode_batch
+from surya.settings import settings
+
+from conftest import make_tiny_rec_model, decoded_token_counts, get_generation_limit
+
+
+def test_static_engine_token_limit(rec_processor, line_images, token_limit_model, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    langs = [["en"]] * len(line_images)
+
+    results = {}
+    for static_engine in [False, True]:
+        monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", static_engine)
+        results[static_engine] = decoded_token_counts(rec_processor, lambda: batch_recognition(line_images, langs, token_limit_model, rec_processor, batch_size=4))
+
+    (batched_text, _), batched_counts = results[False]
+    (static_text, _), static_counts = results[True]
+    assert set(batched_counts) == {get_generation_limit()}
+    assert static_counts == batched_counts
+    assert static_text == batched_text
+
+
+def test_static_engine_non_causal(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", True)
+    model = make_tiny_rec_model(causal=False, eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+
+    with pytest.raises(AssertionError):
+        static_decode_batch(model, rec_processor, None, [[model.config.decoder_start_token_id]], 4)
+
+    # batch_recognition uses decode_batch instead
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    batched_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", True)
+    assert batch_recognition(line_images, langs, model, rec_processor, batch_size=4)[0] == batched_text
+
+
+def test_static_engine_reused_across_decode_paths(rec_processor, line_images, monkeypatch):
+    monkeypatch.setattr(settings, "RECOGNITION_CONTINUOUS_BATCHING", False)
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", False)
+    model = make_tiny_rec_model(causal=True, eos_scale=8.)
+    langs = [["en"]] * len(line_images)
+    plain_text, _ = batch_recognition(line_images, langs, model, rec_processor, batch_size=4)
+    # Lines with drafts are decoded speculatively, which sets up the decoder cache between static batches
+    drafts = [text if idx % 3 == 0 else None for idx, text in enumerate(plain_text)]
+
+    monkeypatch.setattr(settings, "RECOGNITION_STATIC_ENGINE", True)
+    with mock.patch.object(static_decoder, "StaticDecodeEngine", wraps=static_decoder.StaticDecodeEngine) as engine:
+        assert batch_recognition(line_images, langs, model, rec_processor, batch_size=4, drafts=drafts)[0] == plain_text
+        assert batch_recognition(line_images, langs, model, rec_processor, batch_size=4)[0] == plain_text
+    assert engine.call_count == 1
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from surya.settings import settings
+from surya.tables import batch_table_recognition, get_prediction_corners
+
+
+@pytest.mark.parametrize("done_check_steps", [0, -1])
+def test_table_recognition_done_check_steps_below_one(table_model, table_processor, table_pages, monkeypatch, done_check_steps):
+    images, cells = table_pages
+    monkeypatch.setattr(settings, "TABLE_REC_DONE_CHECK_STEPS", 1)
+    expected = [result.model_dump() for result in batch_table_recognition(images, cells, table_model, table_processor, batch_size=3)]
+
+    monkeypatch.setattr(settings, "TABLE_REC_DONE_CHECK_STEPS", done_check_steps)
+    results = batch_table_recognition(images, cells, table_model, table_processor, batch_size=3)
+    assert [result.model_dump() for result in results] == expected
+
+
+def get_prediction_corners_per_box(predictions, orig_size, out_box_size):
+    # One table, one (cx, cy, w, h) box at a time
+    width_scaler = orig_size[0] / out_box_size
+    height_scaler = orig_size[1] / out_box_size
+    corners = []
+    for pred in predictions:
+        w, h = pred[2] / 2, pred[3] / 2
+        corners.append([(pred[0] - w) * width_scaler, (pred[1] - h) * height_scaler, (pred[0] + w) * width_scaler, (pred[1] + h) * height_scaler])
+    return corners
+
+
+def test_prediction_corners_match_per_box_loop():
+    rng = np.random.default_rng(0)
+    predictions = rng.integers(0, 1024, (4, 30, 5))
+    orig_sizes = [(int(width), int(height)) for width, height in rng.integers(50, 2000, (4, 2))]
+
+    corners = get_prediction_corners(predictions, orig_sizes, 1024)
+    for table_corners, table_predictions, orig_size in zip(corners, predictions.tolist(), orig_sizes):
+        assert table_corners.tolist() == get_prediction_corners_per_box(table_predictions, orig_size, 1024)
+
+
+def test_table_recognition_repeated_pages(table_model, table_processor, table_pages):
+    images, cells = table_pages
+    images, cells = [images[0], images[2]], [cells[0], cells[2]]
+    expected = batch_table_recognition(images, cells, table_model, table_processor, batch_size=1)
+    # The random model finds rows and columns on the second page
+    assert len(expected[1].rows) > 0 and len(expected[1].cols) > 0
+
+    # The same cells passed for several pages of a batch are only rescaled once per page
+    results = batch_table_recognition([images[0], images[0], images[1], images[1]], [cells[0], cells[0], cells[1], cells[1]], table_model, table_processor, batch_size=2)
+    assert results == [expected[0], expected[0], expected[1], expected[1]]